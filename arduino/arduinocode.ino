@@ -14,6 +14,19 @@ unsigned int remotePort = 8081
 WiFiUDP Udp;
 IPAddress remoteIp; // Define the remote IP address (this should be set to the server's IP)
 
+// Binary multi-sample frames (see udpserver/sensor_frames.py). Set to 0 to send
+// one CSV line per sample for servers that predate the binary format.
+#define USE_BINARY_FRAMES 1
+#define FRAME_SAMPLES 10                    // samples per datagram
+#define FRAME_CHANNELS 4                    // sensor_a0..sensor_a3
+const uint8_t FRAME_CHANNEL_MASK = 0x0F;
+const uint8_t FRAME_VERSION = 1;
+const uint8_t FRAME_DTYPE_INT16 = 0;
+const int FRAME_HEADER_SIZE = 16;
+uint8_t frameBuffer[FRAME_HEADER_SIZE + FRAME_SAMPLES * 2 + FRAME_SAMPLES * FRAME_CHANNELS * 2];
+unsigned long frameStartMillis = 0;
+int frameCount = 0;
+
 void setup() {
   remoteIp.fromString("XX.XX.XX.XX"); // Change the IP address here to UDP server
   Serial.begin(115200);
@@ -53,6 +66,12 @@ void loop() {
   // Get the current timestamp
   unsigned long timestamp = millis();
 
+#if USE_BINARY_FRAMES
+  appendFrameSample(timestamp, sensorValues);
+  if (frameCount == FRAME_SAMPLES) {
+    sendFrame();
+  }
+#else
   // Create a character array to hold the data
   char data[100];
 
@@ -66,11 +85,57 @@ void loop() {
 
   // Print sent data to serial monitor
   Serial.println(data);
+#endif
 
   // Wait before sending the next packet
   delay(10);
 }
 
+void writeU16(uint8_t *buf, int pos, uint16_t value) {
+  buf[pos] = value & 0xFF;
+  buf[pos + 1] = (value >> 8) & 0xFF;
+}
+
+void writeU32(uint8_t *buf, int pos, uint32_t value) {
+  for (int i = 0; i < 4; i++) {
+    buf[pos + i] = (value >> (8 * i)) & 0xFF;
+  }
+}
+
+// Store one sample's millis offset and channel values in the pending frame
+void appendFrameSample(unsigned long timestamp, int *sensorValues) {
+  if (frameCount == 0) {
+    frameStartMillis = timestamp;
+  }
+  writeU16(frameBuffer, FRAME_HEADER_SIZE + frameCount * 2, (uint16_t)(timestamp - frameStartMillis));
+  int samplePos = FRAME_HEADER_SIZE + FRAME_SAMPLES * 2 + frameCount * FRAME_CHANNELS * 2;
+  for (int c = 0; c < FRAME_CHANNELS; c++) {
+    writeU16(frameBuffer, samplePos + c * 2, (uint16_t)(int16_t)sensorValues[c]);
+  }
+  frameCount++;
+}
+
+// Fill in the little-endian frame header and send the pending samples as one datagram
+void sendFrame() {
+  frameBuffer[0] = 0xA5;
+  frameBuffer[1] = 0x5E;
+  frameBuffer[2] = FRAME_VERSION;
+  frameBuffer[3] = FRAME_DTYPE_INT16;
+  writeU32(frameBuffer, 4, (uint32_t)USER_ID);
+  writeU32(frameBuffer, 8, (uint32_t)frameStartMillis);
+  writeU16(frameBuffer, 12, (uint16_t)frameCount);
+  frameBuffer[14] = FRAME_CHANNEL_MASK;
+  frameBuffer[15] = 0;
+
+  Udp.beginPacket(remoteIp, remotePort);
+  Udp.write(frameBuffer, sizeof(frameBuffer));
+  Udp.endPacket();
+
+  Serial.print("Sent frame starting at ");
+  Serial.println(frameStartMillis);
+  frameCount = 0;
+}
+
 void printWifiStatus() {
   // Print the SSID of the network you're attached to:
   Serial.print("SSID: ");
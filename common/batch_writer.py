@@ -0,0 +1,167 @@
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Format a single value for PostgreSQL's COPY ... (FORMAT csv)
+def _format_copy_value(value):
+    if value is None:
+        return ''  # Unquoted empty field is NULL in CSV mode
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()  # bytea hex input format
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+# Background writer that batches rows from a bounded queue and flushes them with COPY.
+# A flush happens when batch_size rows are pending or flush_interval seconds have
+# passed since the first pending row, whichever comes first. All database work runs
+# on a single dedicated thread, so the event loop never blocks on PostgreSQL.
+#
+# With merge_sql set, each batch is COPYed into a temporary {table}_staging table
+# (same columns as table, emptied on commit) and merge_sql, typically an
+# INSERT ... SELECT ... ON CONFLICT from the staging table, is run in the same
+# transaction. This keeps COPY speed for tables that need upserts.
+class BatchWriter:
+    def __init__(self, name, connect, table, columns, batch_size=500, flush_interval=0.25,
+                 max_queue=50000, report_interval=10.0, merge_sql=None):
+        self.name = name
+        self.connect = connect
+        self.table = table
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-writer")
+        self.conn = None
+        self.merge_sql = merge_sql
+        copy_table = f"{table}_staging" if merge_sql else table
+        self.copy_sql = f"COPY {copy_table} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv)"
+
+        # Counters reported every report_interval seconds
+        self.rows_enqueued = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_failed = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.batch_size_max = 0
+
+    # Queue a row for writing; returns False (and counts a drop) if the queue is full
+    def enqueue(self, row):
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.rows_dropped += 1
+            return False
+        self.rows_enqueued += 1
+        return True
+
+    def _connect(self):
+        conn = self.connect()
+        if self.merge_sql:
+            cursor = conn.cursor()
+            cursor.execute(f"CREATE TEMP TABLE {self.table}_staging (LIKE {self.table}) ON COMMIT DELETE ROWS")
+            conn.commit()
+            cursor.close()
+        return conn
+
+    def _copy_rows(self, rows):
+        if self.conn is None or self.conn.closed:
+            self.conn = self._connect()
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(_format_copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        cursor = self.conn.cursor()
+        try:
+            cursor.copy_expert(self.copy_sql, buffer)
+            if self.merge_sql:
+                cursor.execute(self.merge_sql)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _flush_blocking(self, rows):
+        try:
+            self._copy_rows(rows)
+        except Exception as e:
+            print(f"[{self.name}] Flush of {len(rows)} rows failed, reconnecting and retrying: {e}")
+            try:
+                if self.conn is not None:
+                    self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+            self._copy_rows(rows)
+
+    async def flush(self, rows):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            await loop.run_in_executor(self.executor, self._flush_blocking, rows)
+            self.rows_written += len(rows)
+        except Exception as e:
+            self.rows_failed += len(rows)
+            print(f"[{self.name}] Dropping {len(rows)} rows after failed retry: {e}")
+        elapsed = time.perf_counter() - start
+        self.flushes += 1
+        self.flush_seconds_total += elapsed
+        self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+        self.batch_size_max = max(self.batch_size_max, len(rows))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.batch_size:
+                # Take whatever is already queued without yielding
+                while len(rows) < self.batch_size and not self.queue.empty():
+                    rows.append(self.queue.get_nowait())
+                remaining = deadline - loop.time()
+                if len(rows) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self.flush(rows)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "rows_enqueued": self.rows_enqueued,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "rows_failed": self.rows_failed,
+            "flushes": self.flushes,
+            "avg_batch_size": (self.rows_written + self.rows_failed) / self.flushes if self.flushes else 0.0,
+            "max_batch_size": self.batch_size_max,
+            "avg_flush_ms": 1000 * self.flush_seconds_total / self.flushes if self.flushes else 0.0,
+            "max_flush_ms": 1000 * self.flush_seconds_max,
+        }
+
+    # Periodically print writer statistics; the max values reset after each report
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            stats = self.stats()
+            print(f"[{self.name}] queue {stats['queue_depth']}, written {stats['rows_written']}, "
+                  f"dropped {stats['rows_dropped']}, failed {stats['rows_failed']}, "
+                  f"avg batch {stats['avg_batch_size']:.1f} (max {stats['max_batch_size']}), "
+                  f"avg flush {stats['avg_flush_ms']:.1f} ms (max {stats['max_flush_ms']:.1f} ms)")
+            self.flush_seconds_max = 0.0
+            self.batch_size_max = 0
+
+    # Start the writer and reporter tasks on the running loop
+    def start(self):
+        return [asyncio.create_task(self.run()), asyncio.create_task(self.report())]
@@ -0,0 +1,85 @@
+import struct
+import numpy as np
+
+# Binary /predict request (version 1), little-endian:
+#
+#   offset  size  field
+#   0       1     magic 0xC7
+#   1       1     version
+#   2       1     sample dtype code (0 = int16, 1 = float32)
+#   3       1     reserved (0)
+#   4       4     userid (uint32)
+#   8       4     rows N (uint32)
+#   12      2     channels C (uint16)
+#   14      2     reserved (0)
+#   16      ...   N * C samples, sample-major
+#
+# Binary /predict response (version 1), little-endian:
+#
+#   0       1     magic 0xC8
+#   1       1     version
+#   2       2     reserved (0)
+#   4       4     prediction count N (uint32)
+#   8       4     job_id (int32)
+#   12      2*N   class indices (int16)
+#   12+2N   4*N   confidences (float32)
+#
+# Gesture names are not included; map class indices with the job's class_mapping.
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+REQUEST_MAGIC = 0xC7
+RESPONSE_MAGIC = 0xC8
+PREDICT_CODEC_VERSION = 1
+REQUEST_HEADER = struct.Struct('<BBBxIIH2x')
+RESPONSE_HEADER = struct.Struct('<BBxxIi')
+REQUEST_DTYPES = {0: np.dtype('<i2'), 1: np.dtype('<f4')}
+
+
+# Pack samples[N, C] for one user into a request body
+def encode_predict_request(userid, samples):
+    samples = np.ascontiguousarray(samples, dtype='<f4')
+    if samples.ndim != 2:
+        raise ValueError(f"Expected samples of shape (N, C), got {samples.shape}")
+    header = REQUEST_HEADER.pack(REQUEST_MAGIC, PREDICT_CODEC_VERSION, 1, userid, samples.shape[0], samples.shape[1])
+    return header + samples.tobytes()
+
+
+# Unpack a request body into (userid, samples[N, C]), a view over the body
+def decode_predict_request(body):
+    if len(body) < REQUEST_HEADER.size:
+        raise ValueError(f"Request too short: {len(body)} bytes")
+    magic, version, dtype_code, userid, rows, channels = REQUEST_HEADER.unpack_from(body)
+    if magic != REQUEST_MAGIC:
+        raise ValueError("Not a binary predict request")
+    if version != PREDICT_CODEC_VERSION:
+        raise ValueError(f"Unsupported predict request version {version}")
+    if dtype_code not in REQUEST_DTYPES:
+        raise ValueError(f"Unsupported sample dtype code {dtype_code}")
+    dtype = REQUEST_DTYPES[dtype_code]
+    expected = REQUEST_HEADER.size + rows * channels * dtype.itemsize
+    if len(body) != expected:
+        raise ValueError(f"Request length {len(body)} does not match header (expected {expected})")
+    samples = np.frombuffer(body, dtype=dtype, count=rows * channels, offset=REQUEST_HEADER.size)
+    return userid, samples.reshape(rows, channels)
+
+
+def encode_predict_response(class_indices, confidences, job_id):
+    header = RESPONSE_HEADER.pack(RESPONSE_MAGIC, PREDICT_CODEC_VERSION, len(class_indices), job_id)
+    return b''.join((header, np.asarray(class_indices, dtype='<i2').tobytes(),
+                     np.asarray(confidences, dtype='<f4').tobytes()))
+
+
+# Unpack a response body into a dict with the same keys as the JSON response (minus "predictions")
+def decode_predict_response(body):
+    if len(body) < RESPONSE_HEADER.size:
+        raise ValueError(f"Response too short: {len(body)} bytes")
+    magic, version, count, job_id = RESPONSE_HEADER.unpack_from(body)
+    if magic != RESPONSE_MAGIC:
+        raise ValueError("Not a binary predict response")
+    if version != PREDICT_CODEC_VERSION:
+        raise ValueError(f"Unsupported predict response version {version}")
+    expected = RESPONSE_HEADER.size + 6 * count
+    if len(body) != expected:
+        raise ValueError(f"Response length {len(body)} does not match header (expected {expected})")
+    class_indices = np.frombuffer(body, dtype='<i2', count=count, offset=RESPONSE_HEADER.size)
+    confidences = np.frombuffer(body, dtype='<f4', count=count, offset=RESPONSE_HEADER.size + 2 * count)
+    return {"class_indices": class_indices.tolist(), "confidences": confidences.tolist(), "job_id": job_id}
@@ -0,0 +1,138 @@
+import time
+from collections import namedtuple
+from datetime import timedelta
+import numpy as np
+
+# Chunked columnar sample storage: one user_sensor_chunks row holds a contiguous
+# block of one user's samples (about CHUNK_MILLIS of device time). Per-sample millis
+# are stored as int32 offsets from millis_base and each channel as a packed float32
+# array, all little-endian bytea.
+NUM_SENSORS = 5
+CHUNK_MAX_SAMPLES = 32767  # Also fits sample_count on databases still at int2 (before migration 007)
+CHUNK_COLUMNS = ["userid", "millis_base", "sample_count", "ts_start", "ts_end", "millis_offsets",
+                 "sensor_a0", "sensor_a1", "sensor_a2", "sensor_a3", "sensor_a4"]
+
+SensorBlock = namedtuple('SensorBlock', ['millis', 'samples', 'ts'])
+
+
+class _OpenChunk:
+    def __init__(self, millis_base, ts_start):
+        self.millis_base = millis_base
+        self.ts_start = ts_start
+        self.ts_end = ts_start
+        self.last_millis = millis_base
+        self.millis = []
+        self.samples = []
+        self.count = 0
+        self.touched = time.monotonic()
+
+
+# Accumulates each user's samples into chunk rows. A chunk is closed when the next
+# sample is CHUNK_MILLIS or more after its first sample, when it holds max_samples,
+# when the device clock goes backwards, or when no samples arrive for idle_seconds.
+class SensorChunkBuilder:
+    def __init__(self, chunk_millis=1000, idle_seconds=2.0, max_samples=CHUNK_MAX_SAMPLES):
+        self.chunk_millis = chunk_millis
+        self.idle_seconds = idle_seconds
+        self.max_samples = max_samples
+        self.open = {}
+
+    # Add samples[N, 5] taken at millis[N]; received is the server time of the newest
+    # sample. Returns the rows of any chunks this closed.
+    def add(self, userid, millis, samples, received):
+        rows = []
+        last_millis = int(millis[-1])
+        start = 0
+        count = len(millis)
+        while start < count:
+            chunk = self.open.get(userid)
+            if chunk is None:
+                first_ts = received - timedelta(milliseconds=last_millis - int(millis[start]))
+                chunk = self.open[userid] = _OpenChunk(int(millis[start]), first_ts)
+
+            # Find where this frame crosses the chunk boundary, if it does
+            relative = millis[start:] - chunk.millis_base
+            steps = np.diff(np.concatenate(([chunk.last_millis], millis[start:])))
+            full = np.arange(len(relative)) >= self.max_samples - chunk.count
+            boundary = np.flatnonzero((relative >= self.chunk_millis) | (steps < 0) | full)
+            end = start + int(boundary[0]) if len(boundary) else count
+
+            if end > start:
+                chunk.millis.append(millis[start:end])
+                chunk.samples.append(samples[start:end])
+                chunk.count += end - start
+                chunk.last_millis = int(millis[end - 1])
+                chunk.ts_end = received - timedelta(milliseconds=last_millis - chunk.last_millis)
+                chunk.touched = time.monotonic()
+            if end < count:
+                rows.append(self._close(userid))
+            start = end
+        return rows
+
+    # Close chunks that have not received samples for idle_seconds
+    def flush_idle(self):
+        now = time.monotonic()
+        idle = [userid for userid, chunk in self.open.items() if now - chunk.touched >= self.idle_seconds]
+        return [self._close(userid) for userid in idle]
+
+    def flush_all(self):
+        return [self._close(userid) for userid in list(self.open)]
+
+    def _close(self, userid):
+        chunk = self.open.pop(userid)
+        millis = np.concatenate(chunk.millis)
+        samples = np.concatenate(chunk.samples).astype('<f4')
+        offsets = (millis - chunk.millis_base).astype('<i4')
+        return (userid, chunk.millis_base, chunk.count, chunk.ts_start.isoformat(), chunk.ts_end.isoformat(),
+                offsets.tobytes(), *(np.ascontiguousarray(samples[:, c]).tobytes() for c in range(NUM_SENSORS)))
+
+
+# Convert a datetime to a naive local-time datetime64[us], the convention the ingest
+# path uses when it writes timestamps
+def to_datetime64(value):
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return np.datetime64(value, 'us')
+
+
+# Read one user's samples between start and end (datetimes) from user_sensor_chunks.
+# Returns a SensorBlock of millis[N] int64, samples[N, 5] float32 and ts[N] datetime64[us].
+#
+# A user's chunks follow one another, so the index scan on (userid, ts_start) starts
+# at the newest chunk that ended before `start`: every chunk overlapping the range
+# starts after it, whatever CHUNK_MILLIS the chunks were written with.
+def read_sensor_chunks(conn, userid, start, end):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT millis_base, ts_start, millis_offsets, sensor_a0, sensor_a1, sensor_a2, sensor_a3, sensor_a4
+        FROM user_sensor_chunks
+        WHERE userid = %s AND ts_start <= %s AND ts_end >= %s
+          AND ts_start >= COALESCE((
+              SELECT ts_start FROM user_sensor_chunks
+              WHERE userid = %s AND ts_start <= %s AND ts_end < %s
+              ORDER BY ts_start DESC
+              LIMIT 1
+          ), '-infinity')
+        ORDER BY ts_start
+    ''', (userid, end, start, userid, start, start))
+    rows = cursor.fetchall()
+    cursor.close()
+
+    millis_parts, sample_parts, ts_parts = [], [], []
+    for millis_base, ts_start, offsets_blob, *channel_blobs in rows:
+        offsets = np.frombuffer(offsets_blob, dtype='<i4').astype(np.int64)
+        millis_parts.append(millis_base + offsets)
+        sample_parts.append(np.stack([np.frombuffer(blob, dtype='<f4') for blob in channel_blobs], axis=1))
+        ts_parts.append(to_datetime64(ts_start) + (offsets - offsets[0]).astype('timedelta64[ms]'))
+
+    if not rows:
+        return SensorBlock(np.empty(0, dtype=np.int64), np.empty((0, NUM_SENSORS), dtype=np.float32),
+                           np.empty(0, dtype='datetime64[us]'))
+
+    millis = np.concatenate(millis_parts)
+    samples = np.concatenate(sample_parts)
+    ts = np.concatenate(ts_parts)
+
+    # Trim the first and last chunks to the requested range
+    keep = (ts >= to_datetime64(start)) & (ts <= to_datetime64(end))
+    return SensorBlock(millis[keep], samples[keep], ts[keep])
@@ -0,0 +1,64 @@
+import ast
+import struct
+from collections import namedtuple
+import numpy as np
+
+# Wire format for sensor samples published on NATS_TOPIC (version 1), little-endian:
+#
+#   offset  size  field
+#   0       1     magic 0xC5 (never '{', the first byte of the legacy str(dict) messages)
+#   1       1     version
+#   2       1     channels per sample C
+#   3       1     reserved (0)
+#   4       4     sample count N (uint32)
+#   8       4     userid (uint32)
+#   12      8     server receive time of the newest sample (float64, seconds since epoch)
+#   20      8*N   device millis per sample (int64)
+#   20+8N   4*N*C samples (float32), sample-major
+#
+# Every message carries samples for a single user, in device order.
+CODEC_MAGIC = 0xC5
+CODEC_VERSION = 1
+HEADER = struct.Struct('<BBBxIId')
+
+SensorBatch = namedtuple('SensorBatch', ['userid', 'millis', 'samples', 'timestamp'])
+
+
+# Pack millis[N] and samples[N, C] for one user into a single message
+def encode_samples(userid, millis, samples, timestamp):
+    millis = np.ascontiguousarray(millis, dtype='<i8')
+    samples = np.ascontiguousarray(samples, dtype='<f4')
+    if samples.ndim != 2 or samples.shape[0] != millis.shape[0]:
+        raise ValueError(f"Expected samples of shape ({millis.shape[0]}, C), got {samples.shape}")
+    header = HEADER.pack(CODEC_MAGIC, CODEC_VERSION, samples.shape[1], samples.shape[0], userid, timestamp)
+    return b''.join((header, millis.tobytes(), samples.tobytes()))
+
+
+# Unpack a message into a SensorBatch of NumPy views over the payload
+def decode_samples(payload):
+    if len(payload) < HEADER.size:
+        raise ValueError(f"Message too short: {len(payload)} bytes")
+    magic, version, channels, count, userid, timestamp = HEADER.unpack_from(payload)
+    if magic != CODEC_MAGIC:
+        raise ValueError("Not a sensor codec message")
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported sensor codec version {version}")
+    expected = HEADER.size + 8 * count + 4 * count * channels
+    if len(payload) != expected:
+        raise ValueError(f"Message length {len(payload)} does not match header (expected {expected})")
+    millis = np.frombuffer(payload, dtype='<i8', count=count, offset=HEADER.size)
+    samples = np.frombuffer(payload, dtype='<f4', count=count * channels,
+                            offset=HEADER.size + 8 * count).reshape(count, channels)
+    return SensorBatch(userid, millis, samples, timestamp)
+
+
+def is_legacy_message(payload):
+    return payload[:1] == b'{'
+
+
+# Decode a pre-codec str(dict) message without executing it
+def decode_legacy_message(payload):
+    message = ast.literal_eval(payload.decode())
+    millis = np.array([message["millis"]], dtype=np.int64)
+    samples = np.array([message["sensor_values"]], dtype=np.float32)
+    return SensorBatch(message["userid"], millis, samples, None)
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# Pre-aggregated sensor rollups: user_sensor_rollups holds, per user, per resolution
+# and per time bucket, the sample count and the min, max and sum of every channel.
+# Partial aggregates for the same bucket are merged on insert (counts and sums add,
+# min/max take the extremes), so the ingest path can flush open buckets as often as
+# it likes and readers always see up-to-date buckets. Mean is sum / sample_count.
+NUM_SENSORS = 5
+ROLLUP_RESOLUTIONS_MS = (100, 1000, 60000)
+RAW_SAMPLE_MS = 20  # Nominal sample interval at 50 Hz, used to estimate raw row counts
+
+SENSORS = [f"sensor_a{i}" for i in range(NUM_SENSORS)]
+ROLLUP_KEY = ["userid", "resolution_ms", "bucket_start"]
+ROLLUP_COLUMNS = (ROLLUP_KEY + ["sample_count"] + [f"{s}_min" for s in SENSORS]
+                  + [f"{s}_max" for s in SENSORS] + [f"{s}_sum" for s in SENSORS])
+
+# Merge statement for BatchWriter(merge_sql=...): folds the staged partial aggregates
+# (several may share a bucket) into user_sensor_rollups
+ROLLUP_MERGE_SQL = '''
+    INSERT INTO user_sensor_rollups ({columns})
+    SELECT {key}, sum(sample_count), {min_select}, {max_select}, {sum_select}
+    FROM user_sensor_rollups_staging
+    GROUP BY {key}
+    ON CONFLICT ({key}) DO UPDATE SET
+        sample_count = user_sensor_rollups.sample_count + EXCLUDED.sample_count,
+        {min_update},
+        {max_update},
+        {sum_update}
+'''.format(
+    columns=', '.join(ROLLUP_COLUMNS),
+    key=', '.join(ROLLUP_KEY),
+    min_select=', '.join(f"min({s}_min)" for s in SENSORS),
+    max_select=', '.join(f"max({s}_max)" for s in SENSORS),
+    sum_select=', '.join(f"sum({s}_sum)" for s in SENSORS),
+    min_update=', '.join(f"{s}_min = LEAST(user_sensor_rollups.{s}_min, EXCLUDED.{s}_min)" for s in SENSORS),
+    max_update=', '.join(f"{s}_max = GREATEST(user_sensor_rollups.{s}_max, EXCLUDED.{s}_max)" for s in SENSORS),
+    sum_update=', '.join(f"{s}_sum = user_sensor_rollups.{s}_sum + EXCLUDED.{s}_sum" for s in SENSORS),
+)
+
+
+# Accumulates per-bucket aggregates in memory until the next flush
+class SensorRollupBuilder:
+    def __init__(self, resolutions=ROLLUP_RESOLUTIONS_MS):
+        self.resolutions = resolutions
+        self.open = {}
+
+    # Add samples[N, 5] taken at ts_ms[N] (server time, epoch milliseconds)
+    def add(self, userid, ts_ms, samples):
+        for resolution in self.resolutions:
+            buckets = ts_ms - ts_ms % resolution
+            for bucket in np.unique(buckets):
+                selected = samples[buckets == bucket]
+                key = (userid, resolution, int(bucket))
+                aggregate = self.open.get(key)
+                if aggregate is None:
+                    self.open[key] = [len(selected), selected.min(axis=0), selected.max(axis=0),
+                                      selected.sum(axis=0, dtype=np.float64)]
+                else:
+                    aggregate[0] += len(selected)
+                    np.minimum(aggregate[1], selected.min(axis=0), out=aggregate[1])
+                    np.maximum(aggregate[2], selected.max(axis=0), out=aggregate[2])
+                    aggregate[3] += selected.sum(axis=0, dtype=np.float64)
+
+    # Return rows (in ROLLUP_COLUMNS order) for every open bucket and start afresh
+    def flush(self):
+        rows = []
+        for (userid, resolution, bucket), (count, mins, maxs, sums) in self.open.items():
+            bucket_start = datetime.fromtimestamp(bucket / 1000, tz=timezone.utc).isoformat()
+            rows.append((userid, resolution, bucket_start, count, *mins.tolist(), *maxs.tolist(), *sums.tolist()))
+        self.open = {}
+        return rows
+
+
+# Pick the rollup resolution for plotting the range start..end across width_px pixels:
+# None (raw samples) if the raw data already fits, otherwise the finest resolution
+# with at most one bucket per pixel
+def choose_resolution(start, end, width_px):
+    range_ms = max((end - start).total_seconds() * 1000, 1)
+    if range_ms / RAW_SAMPLE_MS <= width_px:
+        return None
+    for resolution in ROLLUP_RESOLUTIONS_MS:
+        if range_ms / resolution <= width_px:
+            return resolution
+    return ROLLUP_RESOLUTIONS_MS[-1]
+
+
+# Fetch one user's buckets at resolution_ms overlapping start..end. Returns rows of
+# (bucket_start, sample_count, min x5, max x5, mean x5).
+def fetch_sensor_rollups(conn, userid, start, end, resolution_ms):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT bucket_start, sample_count, {mins}, {maxs}, {means}
+        FROM user_sensor_rollups
+        WHERE userid = %s AND resolution_ms = %s AND bucket_start > %s AND bucket_start <= %s
+        ORDER BY bucket_start
+    '''.format(
+        mins=', '.join(f"{s}_min" for s in SENSORS),
+        maxs=', '.join(f"{s}_max" for s in SENSORS),
+        means=', '.join(f"{s}_sum / sample_count" for s in SENSORS),
+    ), (userid, resolution_ms, start - timedelta(milliseconds=resolution_ms), end))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
@@ -0,0 +1,18 @@
+-- One row per classified window, replacing the stringified api_responses.response text.
+-- Apply to an existing sensordb with: psql -d sensordb -f db/migrations/001_gesture_predictions.sql
+
+CREATE TABLE IF NOT EXISTS gesture_predictions (
+	id serial8 NOT NULL,
+	userid int4 NOT NULL,
+	window_end_millis int8 NOT NULL,
+	ts timestamptz NOT NULL,
+	class_index int2 NOT NULL,
+	confidence float4 NOT NULL,
+	job_id int4 NOT NULL,
+	CONSTRAINT gesture_predictions_pkey PRIMARY KEY (id),
+	CONSTRAINT gesture_predictions_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_gesture_predictions_userid_ts ON gesture_predictions(userid, ts);
+
+ALTER TABLE gesture_predictions OWNER TO semguser;
+GRANT ALL ON TABLE gesture_predictions TO semguser;
@@ -0,0 +1,72 @@
+-- Convert user_sensor into a table range-partitioned by day on ts, with a
+-- (userid, ts) index on every partition, and copy the existing rows across.
+-- millis and id are widened to int8 (device and simulator millis overflow int4).
+-- Apply to an existing sensordb with: psql -d sensordb -f db/migrations/002_partition_user_sensor.sql
+-- Stop the UDP server first; the old table is kept as user_sensor_unpartitioned
+-- until the copy has been verified.
+
+BEGIN;
+
+ALTER TABLE user_sensor RENAME TO user_sensor_unpartitioned;
+ALTER TABLE user_sensor_unpartitioned RENAME CONSTRAINT user_sensor_pkey TO user_sensor_unpartitioned_pkey;
+ALTER TABLE user_sensor_unpartitioned RENAME CONSTRAINT user_sensor_userid_fkey TO user_sensor_unpartitioned_userid_fkey;
+ALTER TABLE user_sensor_unpartitioned ALTER COLUMN id DROP DEFAULT;
+
+ALTER SEQUENCE user_sensor_id_seq AS int8 MAXVALUE 9223372036854775807;
+
+CREATE TABLE user_sensor (
+	id int8 DEFAULT nextval('user_sensor_id_seq'::regclass) NOT NULL,
+	userid int4 NULL,
+	millis int8 NOT NULL,
+	sensor_a0 float4 DEFAULT 0 NULL,
+	sensor_a1 float4 DEFAULT 0 NULL,
+	sensor_a2 float4 DEFAULT 0 NULL,
+	sensor_a3 float4 DEFAULT 0 NULL,
+	sensor_a4 float4 DEFAULT 0 NULL,
+	ts timestamptz DEFAULT CURRENT_TIMESTAMP NOT NULL,
+	CONSTRAINT user_sensor_pkey PRIMARY KEY (id, ts),
+	CONSTRAINT user_sensor_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
+) PARTITION BY RANGE (ts);
+CREATE INDEX idx_user_sensor_userid_ts ON user_sensor(userid, ts);
+CREATE TABLE user_sensor_default PARTITION OF user_sensor DEFAULT;
+
+CREATE OR REPLACE FUNCTION create_user_sensor_partitions(from_day date, num_days int)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+	day date;
+BEGIN
+	FOR i IN 0 .. num_days - 1 LOOP
+		day := from_day + i;
+		EXECUTE format(
+			'CREATE TABLE IF NOT EXISTS %I PARTITION OF user_sensor FOR VALUES FROM (%L) TO (%L)',
+			'user_sensor_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+		);
+	END LOOP;
+END;
+$$;
+
+-- One partition per day from the oldest existing row through a week ahead
+SELECT create_user_sensor_partitions(
+	COALESCE((SELECT min(ts)::date FROM user_sensor_unpartitioned), CURRENT_DATE) - 1,
+	(CURRENT_DATE + 8) - (COALESCE((SELECT min(ts)::date FROM user_sensor_unpartitioned), CURRENT_DATE) - 1)
+);
+
+INSERT INTO user_sensor (id, userid, millis, sensor_a0, sensor_a1, sensor_a2, sensor_a3, sensor_a4, ts)
+SELECT id, userid, millis, sensor_a0, sensor_a1, sensor_a2, sensor_a3, sensor_a4, ts
+FROM user_sensor_unpartitioned;
+
+ALTER SEQUENCE user_sensor_id_seq OWNED BY user_sensor.id;
+SELECT setval('user_sensor_id_seq', GREATEST((SELECT max(id) FROM user_sensor), 1));
+
+ALTER TABLE user_sensor OWNER TO semguser;
+GRANT ALL ON TABLE user_sensor TO semguser;
+ALTER FUNCTION create_user_sensor_partitions(date, int) OWNER TO semguser;
+
+ANALYZE user_sensor;
+
+COMMIT;
+
+-- After verifying the copy:
+-- DROP TABLE user_sensor_unpartitioned;
@@ -0,0 +1,23 @@
+-- Columnar per-user sample chunks written alongside user_sensor by the UDP server.
+-- Apply to an existing sensordb with: psql -d sensordb -f db/migrations/003_user_sensor_chunks.sql
+
+CREATE TABLE IF NOT EXISTS user_sensor_chunks (
+	id serial8 NOT NULL,
+	userid int4 NOT NULL,
+	millis_base int8 NOT NULL,
+	sample_count int2 NOT NULL,
+	ts_start timestamptz NOT NULL,
+	ts_end timestamptz NOT NULL,
+	millis_offsets bytea NOT NULL,
+	sensor_a0 bytea NOT NULL,
+	sensor_a1 bytea NOT NULL,
+	sensor_a2 bytea NOT NULL,
+	sensor_a3 bytea NOT NULL,
+	sensor_a4 bytea NOT NULL,
+	CONSTRAINT user_sensor_chunks_pkey PRIMARY KEY (id),
+	CONSTRAINT user_sensor_chunks_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_user_sensor_chunks_userid_ts_start ON user_sensor_chunks(userid, ts_start);
+
+ALTER TABLE user_sensor_chunks OWNER TO semguser;
+GRANT ALL ON TABLE user_sensor_chunks TO semguser;
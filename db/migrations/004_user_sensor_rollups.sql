@@ -0,0 +1,58 @@
+-- Pre-aggregated min/max/sum rollups of user_sensor maintained by the UDP server.
+-- Apply to an existing sensordb with: psql -d sensordb -f db/migrations/004_user_sensor_rollups.sql
+-- Run it before starting the upgraded UDP server: it backfills rollups from existing rows.
+
+CREATE TABLE IF NOT EXISTS user_sensor_rollups (
+	userid int4 NOT NULL,
+	resolution_ms int4 NOT NULL,
+	bucket_start timestamptz NOT NULL,
+	sample_count int4 NOT NULL,
+	sensor_a0_min float4 NOT NULL,
+	sensor_a1_min float4 NOT NULL,
+	sensor_a2_min float4 NOT NULL,
+	sensor_a3_min float4 NOT NULL,
+	sensor_a4_min float4 NOT NULL,
+	sensor_a0_max float4 NOT NULL,
+	sensor_a1_max float4 NOT NULL,
+	sensor_a2_max float4 NOT NULL,
+	sensor_a3_max float4 NOT NULL,
+	sensor_a4_max float4 NOT NULL,
+	sensor_a0_sum float8 NOT NULL,
+	sensor_a1_sum float8 NOT NULL,
+	sensor_a2_sum float8 NOT NULL,
+	sensor_a3_sum float8 NOT NULL,
+	sensor_a4_sum float8 NOT NULL,
+	CONSTRAINT user_sensor_rollups_pkey PRIMARY KEY (userid, resolution_ms, bucket_start),
+	CONSTRAINT user_sensor_rollups_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
+);
+
+ALTER TABLE user_sensor_rollups OWNER TO semguser;
+GRANT ALL ON TABLE user_sensor_rollups TO semguser;
+
+-- Backfill from user_sensor at every resolution
+INSERT INTO user_sensor_rollups (userid, resolution_ms, bucket_start, sample_count, sensor_a0_min, sensor_a1_min, sensor_a2_min, sensor_a3_min, sensor_a4_min, sensor_a0_max, sensor_a1_max, sensor_a2_max, sensor_a3_max, sensor_a4_max, sensor_a0_sum, sensor_a1_sum, sensor_a2_sum, sensor_a3_sum, sensor_a4_sum)
+SELECT
+	s.userid,
+	r.resolution_ms,
+	to_timestamp(floor(extract(epoch FROM s.ts) * 1000 / r.resolution_ms) * r.resolution_ms / 1000.0) AS bucket_start,
+	count(*),
+	min(coalesce(sensor_a0, 0)),
+	min(coalesce(sensor_a1, 0)),
+	min(coalesce(sensor_a2, 0)),
+	min(coalesce(sensor_a3, 0)),
+	min(coalesce(sensor_a4, 0)),
+	max(coalesce(sensor_a0, 0)),
+	max(coalesce(sensor_a1, 0)),
+	max(coalesce(sensor_a2, 0)),
+	max(coalesce(sensor_a3, 0)),
+	max(coalesce(sensor_a4, 0)),
+	sum(coalesce(sensor_a0, 0)),
+	sum(coalesce(sensor_a1, 0)),
+	sum(coalesce(sensor_a2, 0)),
+	sum(coalesce(sensor_a3, 0)),
+	sum(coalesce(sensor_a4, 0))
+FROM user_sensor s
+CROSS JOIN (VALUES (100), (1000), (60000)) AS r(resolution_ms)
+WHERE s.userid IS NOT NULL
+GROUP BY s.userid, r.resolution_ms, bucket_start
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,6 @@
+-- StandardScaler mean/scale stored as JSON next to the pickled scaler, so the inference
+-- API can build its preprocessing module without unpickling sklearn objects.
+-- Apply to an existing sensordb with: psql -d sensordb -f db/migrations/005_training_job_artifacts_scaler_params.sql
+-- Rows from earlier jobs keep scaler_params NULL; the API falls back to the pickled scaler for them.
+
+ALTER TABLE training_job_artifacts ADD COLUMN IF NOT EXISTS scaler_params jsonb NULL;
@@ -0,0 +1,6 @@
+-- Flat model artifact (ml_model/artifact_format.py): header, JSON metadata and aligned raw
+-- tensors, loaded by the inference API without unpickling.
+-- Apply to an existing sensordb with: psql -d sensordb -f db/migrations/006_training_job_artifacts_artifact.sql
+-- Rows from earlier jobs keep artifact NULL; the API falls back to the pickled model for them.
+
+ALTER TABLE training_job_artifacts ADD COLUMN IF NOT EXISTS artifact bytea NULL;
@@ -0,0 +1,5 @@
+-- Widen user_sensor_chunks.sample_count from int2: a chunk of CHUNK_MILLIS at a high sample
+-- rate can hold more than 32,767 samples, and one out-of-range row fails its whole COPY batch.
+-- Apply to an existing sensordb with: psql -d sensordb -f db/migrations/007_user_sensor_chunks_sample_count.sql
+
+ALTER TABLE user_sensor_chunks ALTER COLUMN sample_count TYPE int4;
@@ -99,9 +99,10 @@ GRANT ALL ON SEQUENCE user_gestures_gestureid_seq TO semguser;
 -- DROP SEQUENCE user_sensor_id_seq;
 
 CREATE SEQUENCE user_sensor_id_seq
+	AS int8
 	INCREMENT BY 1
 	MINVALUE 1
-	MAXVALUE 2147483647
+	MAXVALUE 9223372036854775807
 	START 1
 	CACHE 1
 	NO CYCLE;
@@ -207,6 +208,31 @@ ALTER TABLE api_responses OWNER TO semguser;
 GRANT ALL ON TABLE api_responses TO semguser;
 
 
+-- public.gesture_predictions definition
+
+-- Drop table
+
+-- DROP TABLE gesture_predictions;
+
+CREATE TABLE gesture_predictions (
+	id serial8 NOT NULL,
+	userid int4 NOT NULL,
+	window_end_millis int8 NOT NULL,
+	ts timestamptz NOT NULL,
+	class_index int2 NOT NULL,
+	confidence float4 NOT NULL,
+	job_id int4 NOT NULL,
+	CONSTRAINT gesture_predictions_pkey PRIMARY KEY (id),
+	CONSTRAINT gesture_predictions_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
+);
+CREATE INDEX idx_gesture_predictions_userid_ts ON gesture_predictions(userid, ts);
+
+-- Permissions
+
+ALTER TABLE gesture_predictions OWNER TO semguser;
+GRANT ALL ON TABLE gesture_predictions TO semguser;
+
+
 -- public.training_job_schedule definition
 
 -- Drop table
@@ -270,24 +296,128 @@ GRANT ALL ON TABLE user_gestures TO semguser;
 
 -- DROP TABLE user_sensor;
 
+-- Range-partitioned by ts into one partition per day. Every hot query filters on
+-- userid and a ts range, so the planner prunes to the days in range and uses the
+-- (userid, ts) index on each remaining partition.
 CREATE TABLE user_sensor (
-	id serial4 NOT NULL,
+	id int8 DEFAULT nextval('user_sensor_id_seq'::regclass) NOT NULL,
 	userid int4 NULL,
-	millis int4 NOT NULL,
+	millis int8 NOT NULL,
 	sensor_a0 float4 DEFAULT 0 NULL,
 	sensor_a1 float4 DEFAULT 0 NULL,
 	sensor_a2 float4 DEFAULT 0 NULL,
 	sensor_a3 float4 DEFAULT 0 NULL,
 	sensor_a4 float4 DEFAULT 0 NULL,
 	ts timestamptz DEFAULT CURRENT_TIMESTAMP NOT NULL,
-	CONSTRAINT user_sensor_pkey PRIMARY KEY (id),
+	CONSTRAINT user_sensor_pkey PRIMARY KEY (id, ts),
 	CONSTRAINT user_sensor_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
-);
+) PARTITION BY RANGE (ts);
+CREATE INDEX idx_user_sensor_userid_ts ON user_sensor(userid, ts);
+
+-- Catches rows outside every daily partition. Keep it empty: a day's partition
+-- cannot be created while the default partition holds rows for that day.
+CREATE TABLE user_sensor_default PARTITION OF user_sensor DEFAULT;
+
+-- Create the daily partitions user_sensor_pYYYYMMDD for num_days days from from_day.
+-- The UDP server calls this at startup and daily to stay ahead of incoming data.
+CREATE OR REPLACE FUNCTION create_user_sensor_partitions(from_day date, num_days int)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+	day date;
+BEGIN
+	FOR i IN 0 .. num_days - 1 LOOP
+		day := from_day + i;
+		EXECUTE format(
+			'CREATE TABLE IF NOT EXISTS %I PARTITION OF user_sensor FOR VALUES FROM (%L) TO (%L)',
+			'user_sensor_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+		);
+	END LOOP;
+END;
+$$;
+
+SELECT create_user_sensor_partitions(CURRENT_DATE - 1, 9);
 
 -- Permissions
 
+ALTER SEQUENCE user_sensor_id_seq OWNED BY user_sensor.id;
 ALTER TABLE user_sensor OWNER TO semguser;
 GRANT ALL ON TABLE user_sensor TO semguser;
+ALTER FUNCTION create_user_sensor_partitions(date, int) OWNER TO semguser;
+
+
+-- public.user_sensor_chunks definition
+
+-- Drop table
+
+-- DROP TABLE user_sensor_chunks;
+
+-- Columnar copy of user_sensor: one row per user per ~1 s block of samples. millis_offsets
+-- holds int32 offsets from millis_base and each sensor_aN column a packed float32 array
+-- (little-endian), so a range read touches one row per second instead of one per sample.
+-- Written by the UDP server, read with common/sensor_chunks.py.
+CREATE TABLE user_sensor_chunks (
+	id serial8 NOT NULL,
+	userid int4 NOT NULL,
+	millis_base int8 NOT NULL,
+	sample_count int4 NOT NULL,
+	ts_start timestamptz NOT NULL,
+	ts_end timestamptz NOT NULL,
+	millis_offsets bytea NOT NULL,
+	sensor_a0 bytea NOT NULL,
+	sensor_a1 bytea NOT NULL,
+	sensor_a2 bytea NOT NULL,
+	sensor_a3 bytea NOT NULL,
+	sensor_a4 bytea NOT NULL,
+	CONSTRAINT user_sensor_chunks_pkey PRIMARY KEY (id),
+	CONSTRAINT user_sensor_chunks_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
+);
+CREATE INDEX idx_user_sensor_chunks_userid_ts_start ON user_sensor_chunks(userid, ts_start);
+
+-- Permissions
+
+ALTER TABLE user_sensor_chunks OWNER TO semguser;
+GRANT ALL ON TABLE user_sensor_chunks TO semguser;
+
+
+-- public.user_sensor_rollups definition
+
+-- Drop table
+
+-- DROP TABLE user_sensor_rollups;
+
+-- Per-channel min/max/sum of user_sensor per user at 100 ms, 1 s and 1 min buckets,
+-- maintained incrementally by the UDP server (see common/sensor_rollups.py). Mean is
+-- sum / sample_count. Dashboards read these for long time ranges instead of raw rows.
+CREATE TABLE user_sensor_rollups (
+	userid int4 NOT NULL,
+	resolution_ms int4 NOT NULL,
+	bucket_start timestamptz NOT NULL,
+	sample_count int4 NOT NULL,
+	sensor_a0_min float4 NOT NULL,
+	sensor_a1_min float4 NOT NULL,
+	sensor_a2_min float4 NOT NULL,
+	sensor_a3_min float4 NOT NULL,
+	sensor_a4_min float4 NOT NULL,
+	sensor_a0_max float4 NOT NULL,
+	sensor_a1_max float4 NOT NULL,
+	sensor_a2_max float4 NOT NULL,
+	sensor_a3_max float4 NOT NULL,
+	sensor_a4_max float4 NOT NULL,
+	sensor_a0_sum float8 NOT NULL,
+	sensor_a1_sum float8 NOT NULL,
+	sensor_a2_sum float8 NOT NULL,
+	sensor_a3_sum float8 NOT NULL,
+	sensor_a4_sum float8 NOT NULL,
+	CONSTRAINT user_sensor_rollups_pkey PRIMARY KEY (userid, resolution_ms, bucket_start),
+	CONSTRAINT user_sensor_rollups_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid) ON DELETE CASCADE
+);
+
+-- Permissions
+
+ALTER TABLE user_sensor_rollups OWNER TO semguser;
+GRANT ALL ON TABLE user_sensor_rollups TO semguser;
 
 
 -- public.user_video definition
@@ -344,6 +474,8 @@ CREATE TABLE training_job_artifacts (
 	class_mapping jsonb NOT NULL,
 	scaler bytea NOT NULL,
 	sensors_used jsonb NOT NULL,
+	scaler_params jsonb NULL,
+	artifact bytea NULL,
 	CONSTRAINT training_job_artifacts_pkey PRIMARY KEY (job_id),
 	CONSTRAINT training_job_artifacts_job_id_fkey FOREIGN KEY (job_id) REFERENCES training_job_schedule(job_id),
 	CONSTRAINT training_job_artifacts_userid_fkey FOREIGN KEY (userid) REFERENCES users(userid)
@@ -12,8 +12,15 @@ import json
 from datetime import datetime
 import traceback
 import pickle
+import sys
 import fire
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from artifact_format import MODEL_ARCHITECTURE, MODEL_ARCHITECTURE_VERSION, encode_artifact
+
+# Postgres NOTIFY channel the inference API listens on for newly stored models
+MODEL_ARTIFACTS_CHANNEL = 'model_artifacts'
+
 def get_training_job_data(job_id):
     conn = psycopg2.connect(
         host="localhost",
@@ -200,21 +207,42 @@ def store_artifacts_in_db(job_id, userid, model, class_mapping, scaler, sensors_
     # Convert sensors used and class mapping to JSON
     sensors_used_json = json.dumps(sensors_used)
     class_mapping_json = json.dumps(class_mapping)
+    # Scaler parameters as JSON, so the API can scale inputs without unpickling sklearn objects
+    scaler_params = {"mean": scaler.mean_.tolist(), "scale": scaler.scale_.tolist()}
+    scaler_params_json = json.dumps(scaler_params)
+
+    # Flat artifact the inference API loads without unpickling: raw weights (without the
+    # torch.compile '_orig_mod.' prefix) plus everything needed to serve them
+    state_dict = {key.replace("_orig_mod.", ""): value for key, value in model.state_dict().items()}
+    artifact = encode_artifact(state_dict, {
+        "architecture": MODEL_ARCHITECTURE,
+        "architecture_version": MODEL_ARCHITECTURE_VERSION,
+        "job_id": job_id,
+        "userid": userid,
+        "class_mapping": {str(index): name for index, name in class_mapping.items()},
+        "sensors_used": sensors_used,
+        "scaler_params": scaler_params
+    })
     
     # Insert or update the artifacts in the database
     cursor = conn.cursor()
     query = """
-    INSERT INTO public.training_job_artifacts (job_id, userid, model, class_mapping, scaler, sensors_used)
-    VALUES (%s, %s, %s, %s, %s, %s)
+    INSERT INTO public.training_job_artifacts (job_id, userid, model, class_mapping, scaler, sensors_used, scaler_params, artifact)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
     ON CONFLICT (job_id)
     DO UPDATE SET
         model = EXCLUDED.model,
         class_mapping = EXCLUDED.class_mapping,
         scaler = EXCLUDED.scaler,
         sensors_used = EXCLUDED.sensors_used,
+        scaler_params = EXCLUDED.scaler_params,
+        artifact = EXCLUDED.artifact,
         userid = EXCLUDED.userid;
     """
-    cursor.execute(query, (job_id, userid, model_blob, class_mapping_json, scaler_blob, sensors_used_json))
+    cursor.execute(query, (job_id, userid, model_blob, class_mapping_json, scaler_blob, sensors_used_json,
+                           scaler_params_json, artifact))
+    # Tell the inference API to hot-load this model; delivered when the transaction commits
+    cursor.execute("SELECT pg_notify(%s, %s)", (MODEL_ARTIFACTS_CHANNEL, json.dumps({"job_id": job_id, "userid": userid})))
     conn.commit()
     cursor.close()
 
@@ -1,19 +1,186 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import pandas as pd
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import joblib
 import psycopg2
 import json
 import pickle
 import os
+import sys
 import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.predict_codec import BINARY_CONTENT_TYPE, decode_predict_request, encode_predict_response
+from artifact_format import (MODEL_ARCHITECTURE, MODEL_ARCHITECTURE_VERSION, decode_artifact,
+                             map_cached_artifact, write_cached_artifact)
+from model_cache import ModelCache
+from serving_formats import PARITY_MIN_AGREEMENT, ServingFormatSelector
+from stacked_inference import StackedModelEngine
+
+# msgpack responses are optional; without the package, clients get 406 for them
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
 
 app = FastAPI()
 
+# New models are pushed with NOTIFY on MODEL_ARTIFACTS_CHANNEL by TrainMLJob.py;
+# polling every MODEL_POLL_INTERVAL seconds is only a fallback for missed notifications
+MODEL_ARTIFACTS_CHANNEL = 'model_artifacts'
+MODEL_POLL_INTERVAL = float(os.environ.get('MODEL_POLL_INTERVAL', 600))
+LISTEN_RETRY_SECONDS = 5
+
+SEQUENCE_LENGTH = 32  # Samples per model input window
+
+# Model residency: at most MODEL_CACHE_MAX_MODELS models / MODEL_CACHE_MAX_MB of
+# weights stay loaded (0 = unbounded), least recently used first out, and models idle
+# for MODEL_CACHE_IDLE_SECONDS are dropped (0 = never). Evicted models are loaded
+# again on their user's next request.
+MODEL_CACHE_MAX_MODELS = int(os.environ.get('MODEL_CACHE_MAX_MODELS', 0))
+MODEL_CACHE_MAX_MB = float(os.environ.get('MODEL_CACHE_MAX_MB', 0))
+MODEL_CACHE_IDLE_SECONDS = float(os.environ.get('MODEL_CACHE_IDLE_SECONDS', 0))
+MODEL_CACHE_SWEEP_INTERVAL = 60
+
+# How loaded models are served (see serving_formats.py): "eager", "torchscript",
+# "int8", "int8-torchscript", or "auto" for the fastest variant that matches the eager
+# model. Stacked inference needs the eager weights, so it always serves eager.
+MODEL_SERVING_FORMAT = os.environ.get('MODEL_SERVING_FORMAT', 'eager')
+# Smallest share of parity windows on which a non-eager format must predict the same
+# class as the eager model
+MODEL_PARITY_MIN_AGREEMENT = float(os.environ.get('MODEL_PARITY_MIN_AGREEMENT', PARITY_MIN_AGREEMENT))
+
+# Directory for a local copy of each resident user's flat model artifact (see
+# artifact_format.py); cached artifacts are memory-mapped instead of fetched from the
+# database. Empty disables the cache.
+MODEL_ARTIFACT_CACHE_DIR = os.environ.get('MODEL_ARTIFACT_CACHE_DIR', '')
+
+# Models are fetched and deserialized MODEL_LOAD_BATCH jobs at a time on
+# MODEL_LOAD_WORKERS threads, each with its own database connection; every batch is
+# servable as soon as it is loaded. The startup warm-up runs in the background, so
+# the API answers (and lazily loads) while it is in progress; /ready reports it.
+MODEL_LOAD_WORKERS = int(os.environ.get('MODEL_LOAD_WORKERS', 4))
+MODEL_LOAD_BATCH = int(os.environ.get('MODEL_LOAD_BATCH', 16))
+
+# Preprocessing and forward passes run on a dedicated thread pool so the event loop
+# (health checks, model reloads, other requests) stays responsive; torch releases the
+# GIL inside its kernels, so workers run concurrently. Requests beyond
+# INFERENCE_MAX_PENDING queued or running are rejected with 503.
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 2))
+INFERENCE_MAX_PENDING = int(os.environ.get('INFERENCE_MAX_PENDING', 64))
+TORCH_NUM_THREADS = int(os.environ.get('TORCH_NUM_THREADS', 1))  # Intra-op threads per forward pass
+
+# Opt-in micro-batching: requests for the same model arriving within
+# INFERENCE_BATCH_WAIT_MS of each other share one forward pass (up to
+# INFERENCE_MAX_BATCH requests)
+INFERENCE_BATCHING = os.environ.get('INFERENCE_BATCHING', '0') == '1'
+INFERENCE_MAX_BATCH = int(os.environ.get('INFERENCE_MAX_BATCH', 16))
+INFERENCE_BATCH_WAIT_MS = float(os.environ.get('INFERENCE_BATCH_WAIT_MS', 5))
+# With batching on, INFERENCE_STACKED=1 batches requests across users instead of per
+# model and scores them with batched matrix multiplies (convolutions as im2col + bmm)
+# over the per-user weights stacked along a model dimension (see stacked_inference.py)
+INFERENCE_STACKED = os.environ.get('INFERENCE_STACKED', '0') == '1'
+STACKED_INFERENCE_ENABLED = INFERENCE_BATCHING and INFERENCE_STACKED
+
+torch.set_num_threads(TORCH_NUM_THREADS)
+serving_selector = ServingFormatSelector('eager' if INFERENCE_STACKED else MODEL_SERVING_FORMAT,
+                                         min_agreement=MODEL_PARITY_MIN_AGREEMENT)
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+model_load_executor = ThreadPoolExecutor(max_workers=MODEL_LOAD_WORKERS, thread_name_prefix="model-load")
+
+# Counters for /stats; only touched from the event loop
+class InferenceStats:
+    def __init__(self):
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+        self.compute_seconds_total = 0.0
+        self.compute_seconds_max = 0.0
+        self.batch_sizes = {}  # Requests per forward pass -> number of forward passes
+
+    def record_batch(self, size):
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+
+    def record(self, queue_seconds, compute_seconds):
+        self.completed += 1
+        self.queue_seconds_total += queue_seconds
+        self.queue_seconds_max = max(self.queue_seconds_max, queue_seconds)
+        self.compute_seconds_total += compute_seconds
+        self.compute_seconds_max = max(self.compute_seconds_max, compute_seconds)
+
+    def snapshot(self):
+        completed = self.completed or 1
+        return {
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_queue_ms": 1000 * self.queue_seconds_total / completed,
+            "max_queue_ms": 1000 * self.queue_seconds_max,
+            "avg_compute_ms": 1000 * self.compute_seconds_total / completed,
+            "max_compute_ms": 1000 * self.compute_seconds_max,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+inference_stats = InferenceStats()
+
+# Progress of the startup warm-up, for /ready; updated from the model-load threads
+class ModelLoadProgress:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = None  # Unknown until the job list has been fetched
+        self.loaded = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None  # Why the last attempt to fetch the job list failed
+
+    def begin(self, total):
+        with self.lock:
+            self.total = total
+            self.error = None
+
+    def fail(self, error):
+        with self.lock:
+            self.error = error
+
+    def advance(self, loaded, failed):
+        with self.lock:
+            self.loaded += loaded
+            self.failed += failed
+
+    def finish(self):
+        with self.lock:
+            self.finished = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "ready": self.finished is not None,
+                "models_total": self.total,
+                "models_loaded": self.loaded,
+                "models_failed": self.failed,
+                "elapsed_seconds": (self.finished or time.monotonic()) - self.started,
+                "error": self.error,
+            }
+
+warmup_progress = ModelLoadProgress()
+
+# Set once the latest job_id of every user has been fetched; until then a user missing
+# from latest_job_ids may have a model that is not known yet, so requests get 503, not 404
+job_ids_fetched = threading.Event()
+
 # Define input data schema
 class InputData(BaseModel):
     userid: int
@@ -54,139 +221,737 @@ class EnhancedAudioCNN(nn.Module):
         x = self.fc2(x)
         return x
 
-# Dictionary to hold the models, scalers, sensor configurations, and class mappings for all users
-user_artifacts = {}
+# Raw samples -> model inputs, in front of EnhancedAudioCNN: selects the channels the
+# model was trained on, applies the training StandardScaler and cuts overlapping
+# SEQUENCE_LENGTH-sample windows, flattened channel-major. The scaler parameters are
+# buffers, so the module is scriptable and exports together with the model.
+class SensorPreprocessor(nn.Module):
+    def __init__(self, mean, scale, channels=None, sequence_length=SEQUENCE_LENGTH):
+        super(SensorPreprocessor, self).__init__()
+        channels = range(len(mean)) if channels is None else channels
+        self.register_buffer("channels", torch.as_tensor(list(channels), dtype=torch.long))
+        self.register_buffer("mean", torch.as_tensor(mean, dtype=torch.float32))
+        self.register_buffer("scale", torch.as_tensor(scale, dtype=torch.float32))
+        self.sequence_length = sequence_length
 
-# Load the most recent model, scaler, and sensor configurations for each user
-def load_latest_user_artifacts():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Select and standardize the model's channels: [N, C_in] -> [N, C]
+    def standardize(self, samples):
+        return (samples.index_select(1, self.channels) - self.mean) / self.scale
+
+    # Every window of standardized samples [N, C], flattened channel-major:
+    # [N - sequence_length + 1, 1, C * sequence_length]
+    def windows(self, x):
+        windows = x.t().unfold(1, self.sequence_length, 1)  # [C, windows, sequence_length] view
+        return windows.transpose(0, 1).reshape(windows.size(1), 1, -1)
+
+    # samples: [N, C_in] -> [N - sequence_length, 1, C * sequence_length]
+    def forward(self, samples):
+        # The last full window is not used, as in training
+        return self.windows(self.standardize(samples))[:-1]
+
+# Models, scalers, sensor configurations, and class mappings of the resident users
+# (model_cache.models), plus the latest job_id of every user with a model, resident or
+# not. A user missing from latest_job_ids has no model and gets a 404 without a query.
+model_cache = ModelCache(MODEL_CACHE_MAX_MODELS, int(MODEL_CACHE_MAX_MB * 1024 * 1024), MODEL_CACHE_IDLE_SECONDS)
+latest_job_ids = {}
+# Serializes the job_id refresh and diff of concurrent reloads so they cannot lose
+# updates; the models themselves load outside it
+artifacts_lock = threading.Lock()
+loading_job_ids = set()  # Jobs being loaded by load_latest_user_artifacts, so no other reload repeats them
+model_loads = {}  # userid -> future of an in-progress lazy load, shared by concurrent misses
 
-    query = """
-    SELECT DISTINCT ON (userid) userid, model, class_mapping, scaler, sensors_used
+# Latest job_id per user (optionally only for userids), without fetching the artifact BLOBs
+def fetch_latest_job_ids(cursor, userids=None):
+    where = "WHERE userid = ANY(%s)" if userids is not None else ""
+    cursor.execute(f"""
+    SELECT DISTINCT ON (userid) userid, job_id
     FROM public.training_job_artifacts
+    {where}
     ORDER BY userid, job_id DESC;
-    """
-    cursor.execute(query)
-    results = cursor.fetchall()
-    conn.close()
-
-    if not results:
-        print("Warning: No models found in the database.")
-        return
-
-    for userid, model_blob, class_mapping_json, scaler_blob, sensors_used_json in results:
-        # Deserialize the model state_dict
-        state_dict = pickle.loads(model_blob)
-        
-        # Remove '_orig_mod.' prefix from keys if present
-        new_state_dict = {}
-        for key, value in state_dict.items():
-            new_key = key.replace("_orig_mod.", "")
-            new_state_dict[new_key] = value
-
-        num_classes = len(class_mapping_json)  # Since class_mapping_json is already a dict
-        model = EnhancedAudioCNN(num_classes=num_classes)
-        model.load_state_dict(new_state_dict)  # Load the adjusted state_dict
-        model.eval()
-
-        # Load the scaler
-        scaler = pickle.loads(scaler_blob)
-
-        # Load sensors used (assuming this is a JSON string)
-        sensors_used = json.loads(sensors_used_json) if isinstance(sensors_used_json, str) else sensors_used_json
-
-        # Load class mapping
-        class_mapping = json.loads(class_mapping_json) if isinstance(class_mapping_json, str) else class_mapping_json
-
-        # Store artifacts in the dictionary
-        user_artifacts[userid] = {
-            "model": model,
-            "scaler": scaler,
-            "sensors_used": sensors_used,
-            "class_mapping": class_mapping
-        }
-    print("Loaded models for users:", list(user_artifacts.keys()))
+    """, (userids,) if userids is not None else None)
+    return dict(cursor.fetchall())
+
+# Per-feature mean and scale of a fitted StandardScaler as float32 arrays (jobs trained
+# before scaler_params was stored only have the pickled scaler). The scaler keeps mean_
+# even with with_mean=False, when transform does not subtract it.
+def scaler_params(scaler):
+    mean = scaler.mean_ if scaler.with_mean and scaler.mean_ is not None else np.zeros(scaler.n_features_in_)
+    scale = scaler.scale_ if scaler.scale_ is not None else np.ones_like(mean)
+    return mean.astype(np.float32), scale.astype(np.float32)
+
+# Build the artifacts used by /predict from a model state_dict and its metadata. With
+# assign=True the model adopts the given tensors as its parameters instead of copying
+# them in, and its freshly initialized ones are released straight away. (Building on
+# the meta device would skip those too, but its first use costs about a second of
+# one-off setup, which lands on every cold start.)
+def assemble_user_artifacts(job_id, state_dict, class_mapping, sensors_used, scaler_mean, scaler_scale, assign=False):
+    model = EnhancedAudioCNN(num_classes=len(class_mapping))
+    model.load_state_dict(state_dict, assign=assign)
+    model.eval()
+    serving_model, serving_format, model_bytes = serving_selector.convert(model)
+    preprocessor = SensorPreprocessor(scaler_mean, scaler_scale)
+
+    artifacts = {
+        "job_id": job_id,
+        "model": serving_model,
+        "preprocessor": preprocessor,
+        "pipeline": nn.Sequential(preprocessor, serving_model),  # Raw samples -> logits
+        "serving_format": serving_format,
+        "model_bytes": model_bytes,
+        "scaler_mean": scaler_mean,
+        "scaler_scale": scaler_scale,
+        "sensors_used": sensors_used,
+        "class_mapping": class_mapping
+    }
+    if STACKED_INFERENCE_ENABLED:
+        # The stacked engine keeps a second copy of the weights (serving is eager when stacking)
+        artifacts["stacked_bytes"] = model_bytes
+    return artifacts
+
+# Artifacts from a flat artifact buffer (artifact_format.py). The model's parameters
+# are views over the buffer, which must be writable (a bytearray or copy-on-write mmap).
+def build_artifacts_from_flat(buffer):
+    tensors, metadata = decode_artifact(buffer)
+    if (metadata.get("architecture"), metadata.get("architecture_version")) != (MODEL_ARCHITECTURE, MODEL_ARCHITECTURE_VERSION):
+        raise ValueError(f"Unsupported model architecture {metadata.get('architecture')} "
+                         f"version {metadata.get('architecture_version')}")
+    state_dict = {name: torch.from_numpy(array) for name, array in tensors.items()}
+    params = metadata["scaler_params"]
+    return assemble_user_artifacts(metadata["job_id"], state_dict, metadata["class_mapping"], metadata["sensors_used"],
+                                   np.asarray(params["mean"], dtype=np.float32),
+                                   np.asarray(params["scale"], dtype=np.float32), assign=True)
+
+# Deserialize a training_job_artifacts row from before the flat artifact format
+# (pickled state_dict and, before scaler_params, a pickled scaler)
+def build_user_artifacts(job_id, model_blob, class_mapping_json, scaler_blob, sensors_used_json, scaler_params_json=None):
+    # Deserialize the model state_dict
+    state_dict = pickle.loads(model_blob)
+
+    # Remove '_orig_mod.' prefix from keys if present
+    new_state_dict = {}
+    for key, value in state_dict.items():
+        new_key = key.replace("_orig_mod.", "")
+        new_state_dict[new_key] = value
+
+    # Scaler parameters, from JSON when the job stored them, else from the pickled scaler
+    # (unpickling it is the only thing that imports sklearn)
+    if scaler_params_json is not None:
+        params = json.loads(scaler_params_json) if isinstance(scaler_params_json, str) else scaler_params_json
+        scaler_mean = np.asarray(params["mean"], dtype=np.float32)
+        scaler_scale = np.asarray(params["scale"], dtype=np.float32)
+    else:
+        scaler_mean, scaler_scale = scaler_params(pickle.loads(scaler_blob))
+
+    # Load sensors used (assuming this is a JSON string)
+    sensors_used = json.loads(sensors_used_json) if isinstance(sensors_used_json, str) else sensors_used_json
+
+    # Load class mapping
+    class_mapping = json.loads(class_mapping_json) if isinstance(class_mapping_json, str) else class_mapping_json
+
+    return assemble_user_artifacts(job_id, new_state_dict, class_mapping, sensors_used, scaler_mean, scaler_scale)
+
+# Load the given training jobs from the local artifact cache where possible; returns
+# (userid -> artifacts, {job_id: (userid, row version)} of the jobs still to fetch)
+def load_cached_artifacts(cursor, job_ids):
+    cursor.execute("""
+    SELECT userid, job_id, xmin::text
+    FROM public.training_job_artifacts
+    WHERE job_id = ANY(%s) AND artifact IS NOT NULL;
+    """, (job_ids,))
+    loaded, missing = {}, {}
+    for userid, job_id, row_version in cursor.fetchall():
+        mapped = map_cached_artifact(MODEL_ARTIFACT_CACHE_DIR, userid, job_id, row_version)
+        if mapped is not None:
+            try:
+                loaded[userid] = build_artifacts_from_flat(mapped)
+                continue
+            except Exception as e:
+                print(f"Ignoring unreadable cached artifact for job {job_id}: {e}")
+        missing[job_id] = (userid, row_version)
+    return loaded, missing
+
+# Fetch and deserialize the artifacts of the given training jobs; returns userid -> artifacts.
+# Rows with a flat artifact are loaded without unpickling anything (and, with
+# MODEL_ARTIFACT_CACHE_DIR, memory-mapped from the local cache); older rows fall back
+# to the pickled state_dict.
+def fetch_user_artifacts(cursor, job_ids):
+    loaded, to_cache = {}, {}
+    if MODEL_ARTIFACT_CACHE_DIR:
+        loaded, to_cache = load_cached_artifacts(cursor, job_ids)
+        cached_jobs = {info["job_id"] for info in loaded.values()}
+        job_ids = [job_id for job_id in job_ids if job_id not in cached_jobs]
+        if not job_ids:
+            return loaded
+
+    # Legacy columns are only fetched for rows without a flat artifact
+    cursor.execute("""
+    SELECT userid, job_id, artifact,
+           CASE WHEN artifact IS NULL THEN model END, class_mapping,
+           CASE WHEN artifact IS NULL AND scaler_params IS NULL THEN scaler END, sensors_used, scaler_params
+    FROM public.training_job_artifacts
+    WHERE job_id = ANY(%s);
+    """, (job_ids,))
+    for userid, job_id, artifact, *columns in cursor.fetchall():
+        try:
+            if artifact is None:
+                loaded[userid] = build_user_artifacts(job_id, *columns)
+            elif job_id in to_cache:
+                write_cached_artifact(MODEL_ARTIFACT_CACHE_DIR, userid, job_id, to_cache[job_id][1], artifact)
+                mapped = map_cached_artifact(MODEL_ARTIFACT_CACHE_DIR, userid, job_id, to_cache[job_id][1])
+                loaded[userid] = build_artifacts_from_flat(mapped)
+            else:
+                loaded[userid] = build_artifacts_from_flat(bytearray(artifact))
+        except Exception as e:
+            print(f"Failed to load model {job_id} for user {userid}: {e}")
+    return loaded
+
+# Load one batch of jobs on its own connection and make the models servable right away
+def load_job_batch(job_ids, progress=None):
+    conn = get_db_connection()
+    try:
+        loaded = fetch_user_artifacts(conn.cursor(), job_ids)
+    finally:
+        conn.close()
+    if loaded:
+        model_cache.put_many(loaded)
+    if progress is not None:
+        progress.advance(len(loaded), len(job_ids) - len(loaded))
+    return loaded
+
+# Load jobs in MODEL_LOAD_BATCH-sized batches on the model-load pool; returns userid -> artifacts
+def load_jobs_parallel(job_ids, progress=None):
+    batches = [job_ids[i:i + MODEL_LOAD_BATCH] for i in range(0, len(job_ids), MODEL_LOAD_BATCH)]
+    futures = [model_load_executor.submit(load_job_batch, batch, progress) for batch in batches]
+    loaded = {}
+    for batch, future in zip(batches, futures):
+        try:
+            loaded.update(future.result())
+        except Exception as e:
+            print(f"Failed to load models for jobs {batch}: {e}")
+            if progress is not None:
+                progress.advance(0, len(batch))
+    return loaded
+
+# Refresh the latest job_id of every user (or only the given userids) and load the
+# models that need it: resident models whose job_id changed, the given userids (new
+# models are loaded as soon as they are announced), and with warm=True or an unbounded
+# cache, non-resident users up to the cache's free slots, newest jobs first. Jobs that
+# another call is already loading are skipped. artifacts_lock is only held to refresh
+# and diff the job_ids, so a notified reload never waits for a long warm-up load.
+# Returns the userids loaded.
+def load_latest_user_artifacts(userids=None, warm=False, progress=None):
+    global latest_job_ids
+    with artifacts_lock:
+        conn = get_db_connection()
+        try:
+            latest = fetch_latest_job_ids(conn.cursor(), userids)
+        finally:
+            conn.close()
+        if userids is None:
+            latest_job_ids = latest
+            job_ids_fetched.set()
+        else:
+            latest_job_ids = {**latest_job_ids, **latest}
+        if not latest:
+            print("Warning: No models found in the database.")
+
+        resident = model_cache.models
+        changed_jobs = [job_id for userid, job_id in latest.items()
+                        if job_id not in loading_job_ids
+                        and (userid in resident and resident[userid]["job_id"] != job_id
+                             or userid not in resident and userids is not None)]
+        free_slots = model_cache.free_slots()
+        if warm or free_slots is None:
+            absent = sorted((job_id for userid, job_id in latest.items()
+                             if userid not in resident and job_id not in changed_jobs
+                             and job_id not in loading_job_ids), reverse=True)
+            if free_slots is not None:
+                absent = absent[:max(free_slots - len(loading_job_ids) - len(changed_jobs), 0)]
+            changed_jobs += absent
+        loading_job_ids.update(changed_jobs)
+
+    if progress is not None:
+        progress.begin(len(changed_jobs))
+    if not changed_jobs:
+        return []
+    try:
+        loaded = load_jobs_parallel(changed_jobs, progress)
+    finally:
+        with artifacts_lock:
+            loading_job_ids.difference_update(changed_jobs)
+    if loaded:
+        print("Loaded models for users:", {userid: info["job_id"] for userid, info in loaded.items()})
+    return list(loaded)
+
+# Load one non-resident user's latest model into the cache; returns its artifacts
+def load_user_model(userid):
+    job_id = latest_job_ids.get(userid)
+    if job_id is None:
+        return None
+    conn = get_db_connection()
+    try:
+        loaded = fetch_user_artifacts(conn.cursor(), [job_id])
+    finally:
+        conn.close()
+    if userid not in loaded:
+        return None
+    model_cache.put(userid, loaded[userid])
+    print(f"Loaded model {job_id} for user {userid} on demand")
+    return loaded[userid]
 
-# Periodically poll for new models
+# Artifacts for userid, loading them off the event loop if they were evicted (or never
+# loaded). Concurrent misses for the same user share one load. Returns None if the
+# user has no model.
+async def get_model_info(userid):
+    if userid not in latest_job_ids and userid not in model_cache:
+        return None
+    model_info = model_cache.get(userid)
+    if model_info is not None:
+        return model_info
+    load = model_loads.get(userid)
+    if load is None:
+        load = model_loads[userid] = asyncio.get_running_loop().run_in_executor(None, load_user_model, userid)
+        load.add_done_callback(lambda _: model_loads.pop(userid, None))
+    return await asyncio.shield(load)
+
+# Periodically drop models that have been idle for MODEL_CACHE_IDLE_SECONDS
+async def evict_idle_models():
+    while True:
+        await asyncio.sleep(min(MODEL_CACHE_SWEEP_INTERVAL, MODEL_CACHE_IDLE_SECONDS))
+        evicted = model_cache.evict_idle()
+        if evicted:
+            print(f"Evicted idle models for users: {evicted}")
+
+# Periodically poll for new models as a fallback; the reload runs off the event loop
 async def poll_new_models():
+    loop = asyncio.get_running_loop()
     while True:
+        await asyncio.sleep(MODEL_POLL_INTERVAL)
         try:
-            load_latest_user_artifacts()
-            print("Polled for new models; current artifacts:", list(user_artifacts.keys()))
+            await loop.run_in_executor(None, load_latest_user_artifacts)
         except Exception as e:
             print("Error during polling for new models:", e)
-        await asyncio.sleep(60)  # Poll every 60 seconds
 
-# Preprocessing function
-def preprocess(data, scaler, sensors_used):
+# Reload the models named in a batch of NOTIFY payloads
+async def reload_notified_models(userids):
+    loop = asyncio.get_running_loop()
     try:
-        # Determine which sensors to use
-        columns_to_use = [col for col, used in sensors_used.items() if used]
-        
-        # Create DataFrame and preprocess the data
-        df = pd.DataFrame(data)
-        df = df.loc[:, 0:len(columns_to_use) - 1]  # Adjust the range to match the length of columns_to_use
-        df.columns = columns_to_use
-        df = scaler.transform(df.values)
-        
-        sequences = []
-        for row in range(32, df.shape[0]):
-            sequence = df[row-32:row].T.flatten()
-            sequences.append(sequence)
-
-        sequences = np.array(sequences)
-        return torch.tensor(sequences, dtype=torch.float32)
-    
-    except ValueError as ve:
-        print(f"ValueError occurred: {ve}")
-        raise ve
-    except IndexError as ie:
-        print(f"IndexError occurred: {ie}")
-        raise ie
+        await loop.run_in_executor(None, load_latest_user_artifacts, userids)
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        raise e
+        print(f"Error loading notified models for users {userids}:", e)
+
+# LISTEN for new-model notifications on a dedicated autocommit connection and hot-load
+# the notified users' models. Reconnects on failure and then does a full check, since
+# notifications sent while disconnected are lost.
+async def listen_for_new_models():
+    loop = asyncio.get_running_loop()
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {MODEL_ARTIFACTS_CHANNEL};")
+            cursor.close()
+            print(f"Listening for new models on channel {MODEL_ARTIFACTS_CHANNEL}")
+            await loop.run_in_executor(None, load_latest_user_artifacts)
+
+            lost = loop.create_future()
+
+            def on_readable():
+                try:
+                    conn.poll()
+                except Exception as e:
+                    if not lost.done():
+                        lost.set_exception(e)
+                    return
+                userids = set()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        userids.add(int(json.loads(notify.payload)["userid"]))
+                    except (ValueError, KeyError, TypeError):
+                        print(f"Ignoring malformed model notification: {notify.payload}")
+                if userids:
+                    loop.create_task(reload_notified_models(sorted(userids)))
+
+            loop.add_reader(conn.fileno(), on_readable)
+            try:
+                await lost
+            finally:
+                loop.remove_reader(conn.fileno())
+        except Exception as e:
+            print(f"Model notification listener failed, retrying in {LISTEN_RETRY_SECONDS} s:", e)
+        finally:
+            if conn is not None:
+                conn.close()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
+
+# Check a request's samples against the model's preprocessor and return them as a
+# float32 tensor [N, C_in]. The samples are copied: binary request bodies decode to
+# read-only views, which torch can only wrap with a warning.
+def request_samples(data, preprocessor):
+    samples = torch.from_numpy(np.array(data, dtype=np.float32))
+    num_channels = int(preprocessor.channels.max()) + 1
+    if samples.dim() != 2 or samples.shape[1] < num_channels:
+        raise ValueError(f"Expected rows of at least {num_channels} sensor values, got shape {tuple(samples.shape)}")
+    if samples.shape[0] <= SEQUENCE_LENGTH:
+        raise ValueError(f"Need more than {SEQUENCE_LENGTH} samples, got {samples.shape[0]}")
+    return samples
 
-# Prediction endpoint
+# Model inputs [windows, 1, C * SEQUENCE_LENGTH] for one request's samples
+def preprocess(data, preprocessor):
+    samples = request_samples(data, preprocessor)
+    with torch.no_grad():
+        return preprocessor(samples)
+
+# Preprocess and classify one request's samples; runs on the inference executor.
+# Returns (class indices, confidences, queue wait seconds, compute seconds).
+def run_inference(model_info, data, submitted):
+    started = time.perf_counter()
+    samples = request_samples(data, model_info["preprocessor"])
+    with torch.no_grad():
+        outputs = model_info["pipeline"](samples)
+        confidences, predicted = torch.max(F.softmax(outputs, dim=1), 1)
+    return predicted.tolist(), confidences.tolist(), started - submitted, time.perf_counter() - started
+
+# Classify a batch of (model_info, data, submitted) requests; runs on the inference
+# executor. Requests for one model share a forward pass; with stacked_engine, requests
+# for different users share one as well. Returns one (class indices, confidences,
+# queue wait seconds, compute seconds) tuple or exception per request, so a bad
+# request fails alone.
+def run_batched_inference(batch, artifacts=None, stacked_engine=None):
+    started = time.perf_counter()
+    results = [None] * len(batch)
+    inputs, valid = [], []
+    for i, (model_info, data, submitted) in enumerate(batch):
+        try:
+            inputs.append(preprocess(data, model_info["preprocessor"]))
+            valid.append(i)
+        except Exception as e:
+            results[i] = e
+    if not valid:
+        return results
+
+    with torch.no_grad():
+        if stacked_engine is None:
+            outputs = [batch[0][0]["model"](torch.cat(inputs))]
+        else:
+            # Logits per request; widths differ between models with different class counts
+            outputs = stacked_engine.forward(artifacts, [(batch[i][0], x) for i, x in zip(valid, inputs)])
+        best = [torch.max(F.softmax(output, dim=1), 1) for output in outputs]
+        confidences = torch.cat([request_confidences for request_confidences, _ in best])
+        predicted = torch.cat([request_predicted for _, request_predicted in best])
+    compute_seconds = time.perf_counter() - started
+
+    offset = 0
+    for i, request_inputs in zip(valid, inputs):
+        end = offset + len(request_inputs)
+        results[i] = (predicted[offset:end].tolist(), confidences[offset:end].tolist(),
+                      started - batch[i][2], compute_seconds)
+        offset = end
+    return results
+
+# Coalesces concurrent requests per model (userid, job_id), or across all users when
+# stacked_engine is set, into batches that are flushed to the inference executor when
+# INFERENCE_MAX_BATCH requests are waiting or INFERENCE_BATCH_WAIT_MS after the first
+# one, whichever comes first
+class InferenceBatcher:
+    def __init__(self, max_batch, wait_seconds, stacked_engine=None):
+        self.max_batch = max_batch
+        self.wait_seconds = wait_seconds
+        self.stacked_engine = stacked_engine
+        self.pending = {}  # key -> ([(model_info, data, submitted, future)], timer)
+
+    def submit(self, userid, model_info, data):
+        loop = asyncio.get_running_loop()
+        key = None if self.stacked_engine is not None else (userid, model_info["job_id"])
+        future = loop.create_future()
+        if key not in self.pending:
+            timer = loop.call_later(self.wait_seconds, self._flush, key)
+            self.pending[key] = ([], timer)
+        requests = self.pending[key][0]
+        requests.append((model_info, data, time.perf_counter(), future))
+        if len(requests) >= self.max_batch:
+            self._flush(key)
+        return future
+
+    def _flush(self, key):
+        requests, timer = self.pending.pop(key)
+        timer.cancel()
+        inference_stats.record_batch(len(requests))
+        batch = [(model_info, data, submitted) for model_info, data, submitted, _ in requests]
+        task = asyncio.get_running_loop().run_in_executor(
+            inference_executor, run_batched_inference, batch, model_cache.models, self.stacked_engine)
+        task.add_done_callback(lambda done: self._scatter(done, requests))
+
+    @staticmethod
+    def _scatter(done, requests):
+        for i, (_, _, _, future) in enumerate(requests):
+            if future.cancelled():
+                continue
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+            elif isinstance(done.result()[i], Exception):
+                future.set_exception(done.result()[i])
+            else:
+                future.set_result(done.result()[i])
+
+inference_batcher = InferenceBatcher(INFERENCE_MAX_BATCH, INFERENCE_BATCH_WAIT_MS / 1000,
+                                     StackedModelEngine() if STACKED_INFERENCE_ENABLED else None)
+
+# Read a /predict body: JSON InputData, or the binary format in common/predict_codec.py
+# when sent as application/octet-stream. Returns (userid, rows of sensor values).
+async def parse_predict_request(request):
+    if request.headers.get("content-type", "").startswith(BINARY_CONTENT_TYPE):
+        try:
+            return decode_predict_request(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    try:
+        input_data = InputData(**await request.json())
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return input_data.userid, input_data.data
+
+# Encode a /predict result as JSON (default), binary or msgpack, per the Accept header
+def predict_response(result, accept):
+    if BINARY_CONTENT_TYPE in accept:
+        return Response(content=encode_predict_response(result["class_indices"], result["confidences"], result["job_id"]),
+                        media_type=BINARY_CONTENT_TYPE)
+    for content_type in MSGPACK_CONTENT_TYPES:
+        if content_type in accept:
+            if msgpack is None:
+                raise HTTPException(status_code=406, detail="msgpack responses are not available on this server.")
+            return Response(content=msgpack.packb(result), media_type=content_type)
+    return result
+
+# Prediction endpoint. Accepts JSON or application/octet-stream request bodies; send
+# Accept: application/octet-stream or application/msgpack for a compact response.
 @app.post("/predict")
-async def predict(input_data: InputData):
+async def predict(request: Request):
+    userid, data = await parse_predict_request(request)
+
+    # Retrieve the model, scaler, and sensors used for the given user ID
     try:
-        # Retrieve the model, scaler, and sensors used for the given user ID
-        if input_data.userid not in user_artifacts:
-            raise HTTPException(status_code=404, detail="No model found for the given user.")
-
-        model_info = user_artifacts[input_data.userid]
-        model = model_info["model"]
-        scaler = model_info["scaler"]
-        sensors_used = model_info["sensors_used"]
-        class_mapping = model_info["class_mapping"]
-        
-        # Preprocess the input data
-        data = input_data.data
-        inputs = preprocess(data, scaler, sensors_used)
-        inputs = inputs.unsqueeze(1)
-        
-        # Make predictions
-        with torch.no_grad():
-            outputs = model(inputs)
-            _, predicted = torch.max(outputs, 1)
-            # Convert predicted indices to gesture descriptions
-            predicted_gestures = [class_mapping[str(idx)] for idx in predicted.tolist()]
-            return {"predictions": predicted_gestures}
-    
+        model_info = await get_model_info(userid)
+    except Exception as e:
+        print(f"Failed to load model for user {userid}: {e}")
+        raise HTTPException(status_code=503, detail="Model could not be loaded, retry later.")
+    if model_info is None:
+        if not job_ids_fetched.is_set():
+            raise HTTPException(status_code=503, detail="Models are still loading, retry later.")
+        raise HTTPException(status_code=404, detail="No model found for the given user.")
+    if inference_stats.pending >= INFERENCE_MAX_PENDING:
+        inference_stats.rejected += 1
+        raise HTTPException(status_code=503, detail="Inference queue is full, retry later.")
+
+    loop = asyncio.get_running_loop()
+    inference_stats.pending += 1
+    try:
+        if INFERENCE_BATCHING:
+            result = await inference_batcher.submit(userid, model_info, data)
+        else:
+            inference_stats.record_batch(1)
+            result = await loop.run_in_executor(
+                inference_executor, run_inference, model_info, data, time.perf_counter())
+        class_indices, confidences, queue_seconds, compute_seconds = result
     except Exception as e:
+        inference_stats.failed += 1
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        inference_stats.pending -= 1
+    inference_stats.record(queue_seconds, compute_seconds)
+
+    # Convert predicted indices to gesture descriptions
+    class_mapping = model_info["class_mapping"]
+    return predict_response({
+        "predictions": [class_mapping[str(idx)] for idx in class_indices],
+        "class_indices": class_indices,
+        "confidences": confidences,
+        "job_id": model_info["job_id"]
+    }, request.headers.get("accept", ""))
+
+# Carry-over state of one /stream connection: its last SEQUENCE_LENGTH - 1 samples,
+# raw and already standardized, so each frame only standardizes and windows its new
+# samples. Both steps are the model's SensorPreprocessor, as for /predict.
+class StreamState:
+    def __init__(self):
+        self.job_id = None
+        self.raw = None
+        self.scaled = None
+        self.samples_seen = 0
+
+    # Append samples[k, C_in] and return the model inputs [k', 1, C * SEQUENCE_LENGTH] of
+    # the windows they complete (each window is the SEQUENCE_LENGTH samples ending at a new one)
+    def push(self, model_info, samples):
+        preprocessor = model_info["preprocessor"]
+        num_channels = int(preprocessor.channels.max()) + 1
+        if samples.ndim != 2 or samples.shape[1] < num_channels:
+            raise ValueError(f"Expected rows of at least {num_channels} sensor values, got shape {samples.shape}")
+        samples = torch.from_numpy(np.ascontiguousarray(samples[:, :num_channels], dtype=np.float32))
+        if self.raw is None or self.raw.shape[1] != num_channels:
+            self.raw = samples.new_empty((0, num_channels))
+            self.job_id = None
+        if self.job_id != model_info["job_id"]:
+            # First frame or a newly deployed model: restandardize the carry with its scaler
+            self.scaled = preprocessor.standardize(self.raw)
+            self.job_id = model_info["job_id"]
+
+        raw = torch.cat((self.raw, samples))
+        scaled = torch.cat((self.scaled, preprocessor.standardize(samples)))
+        self.raw = raw[-(SEQUENCE_LENGTH - 1):]
+        self.scaled = scaled[-(SEQUENCE_LENGTH - 1):]
+        self.samples_seen += len(samples)
+
+        if len(scaled) < SEQUENCE_LENGTH:
+            return None
+        return preprocessor.windows(scaled)
+
+# Preprocess and classify one /stream frame; runs on the inference executor
+def run_stream_inference(model_info, state, samples, submitted):
+    started = time.perf_counter()
+    with torch.no_grad():
+        inputs = state.push(model_info, samples)
+        if inputs is None:
+            return None
+        outputs = model_info["model"](inputs)
+        confidences, predicted = torch.max(F.softmax(outputs, dim=1), 1)
+    return predicted.tolist(), confidences.tolist(), started - submitted, time.perf_counter() - started
+
+# Streaming inference. The client sends frames of new samples, either binary
+# (little-endian float32, sample-major, one value per model channel) or JSON text
+# {"data": [[...], ...]}. The server keeps the overlap with earlier frames and replies
+# with predictions for just the windows the frame completed:
+# {"first_window_end", "predictions", "class_indices", "confidences", "job_id"}, where
+# window i ends at sample first_window_end + i (counted from the start of the stream).
+# Like /predict, a frame arriving while INFERENCE_MAX_PENDING requests are queued or
+# running gets an error reply; it is not consumed, so the client can send it again.
+@app.websocket("/stream/{userid}")
+async def stream(websocket: WebSocket, userid: int):
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    state = StreamState()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                model_info = await get_model_info(userid)
+            except Exception as e:
+                await websocket.send_json({"error": f"Model could not be loaded: {e}"})
+                continue
+            if model_info is None:
+                if not job_ids_fetched.is_set():
+                    await websocket.send_json({"error": "Models are still loading, retry later."})
+                    continue
+                await websocket.send_json({"error": "No model found for the given user."})
+                continue
+            try:
+                if message.get("bytes") is not None:
+                    num_channels = len(model_info["scaler_mean"])
+                    samples = np.frombuffer(message["bytes"], dtype='<f4').reshape(-1, num_channels)
+                else:
+                    samples = np.asarray(json.loads(message["text"])["data"], dtype=np.float32)
+            except (ValueError, KeyError, TypeError) as e:
+                await websocket.send_json({"error": f"Malformed frame: {e}"})
+                continue
+
+            if inference_stats.pending >= INFERENCE_MAX_PENDING:
+                inference_stats.rejected += 1
+                await websocket.send_json({"error": "Inference queue is full, retry later."})
+                continue
+
+            first_window_end = max(state.samples_seen, SEQUENCE_LENGTH - 1)
+            inference_stats.pending += 1
+            try:
+                result = await loop.run_in_executor(
+                    inference_executor, run_stream_inference, model_info, state, samples, time.perf_counter())
+            except Exception as e:
+                inference_stats.failed += 1
+                await websocket.send_json({"error": str(e)})
+                continue
+            finally:
+                inference_stats.pending -= 1
+            if result is None:
+                continue  # Not enough samples for a window yet
+
+            class_indices, confidences, queue_seconds, compute_seconds = result
+            inference_stats.record(queue_seconds, compute_seconds)
+            class_mapping = model_info["class_mapping"]
+            await websocket.send_json({
+                "first_window_end": first_window_end,
+                "predictions": [class_mapping[str(idx)] for idx in class_indices],
+                "class_indices": class_indices,
+                "confidences": confidences,
+                "job_id": model_info["job_id"]
+            })
+    except WebSocketDisconnect:
+        pass
+
+# Readiness: 503 until the startup warm-up has finished, with its progress either way
+# (including the error while the job list cannot be fetched). Requests are served
+# during the warm-up; models not loaded yet are loaded on demand.
+@app.get("/ready")
+async def ready():
+    progress = warmup_progress.snapshot()
+    progress["models_resident"] = len(model_cache)
+    if not progress["ready"]:
+        return JSONResponse(status_code=503, content=progress)
+    return progress
+
+# Liveness check; answered on the event loop, so it stays fast while inference is busy
+@app.get("/health")
+async def health():
+    return {"status": "ok", "models_loaded": len(model_cache), "models_known": len(latest_job_ids)}
+
+# Inference queue and latency statistics
+@app.get("/stats")
+async def stats():
+    return {
+        "inference": inference_stats.snapshot(),
+        "inference_workers": INFERENCE_WORKERS,
+        "inference_max_pending": INFERENCE_MAX_PENDING,
+        "inference_batching": INFERENCE_BATCHING,
+        "inference_stacked": INFERENCE_STACKED,
+        "torch_num_threads": torch.get_num_threads(),
+        "models_loaded": len(model_cache),
+        "models_known": len(latest_job_ids),
+        "model_cache": model_cache.stats(),
+        "serving_formats": serving_selector.stats()
+    }
 
-# On startup, try loading models and start polling for new models
+# Resident models with their memory footprint, most recently used first
+@app.get("/models")
+async def models():
+    return {"models": model_cache.resident_models(), "bytes": model_cache.bytes}
+
+# Warm the cache with the newest models in parallel, off the event loop, retrying
+# until the job list can be fetched
+async def warm_model_cache():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, load_latest_user_artifacts, None, True, warmup_progress)
+            break
+        except Exception as e:
+            warmup_progress.fail(str(e))
+            print(f"Model warm-up failed, retrying in {LISTEN_RETRY_SECONDS} s:", e)
+            await asyncio.sleep(LISTEN_RETRY_SECONDS)
+    warmup_progress.finish()
+    print(f"Model warm-up finished: {warmup_progress.snapshot()}")
+
+# On startup, start warming the cache with the newest models without waiting for it,
+# then listen for new ones with polling as a fallback
 @app.on_event("startup")
 async def startup_event():
-    try:
-        load_latest_user_artifacts()
-    except Exception as e:
-        print("Startup warning: No models loaded initially. Polling will continue. Error:", e)
-    # Start background task to poll for new models
+    asyncio.create_task(warm_model_cache())
+    # Start background tasks that pick up new models
+    asyncio.create_task(listen_for_new_models())
     asyncio.create_task(poll_new_models())
+    if MODEL_CACHE_IDLE_SECONDS:
+        asyncio.create_task(evict_idle_models())
 
 def get_db_connection():
     return psycopg2.connect(
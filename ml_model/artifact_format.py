@@ -0,0 +1,137 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import tempfile
+import numpy as np
+
+# Flat model artifact (training_job_artifacts.artifact), little-endian:
+#
+#   offset  size  field
+#   0       8     magic b"SEMGART\0"
+#   8       4     format version (uint32)
+#   12      4     header length H (uint32)
+#   16      H     header: UTF-8 JSON {"metadata": {...}, "tensors": [{"name", "dtype",
+#                 "shape", "offset", "nbytes"}, ...]}
+#   ...           zero padding to the next TENSOR_ALIGNMENT boundary, then the raw
+#                 tensors, each starting on a TENSOR_ALIGNMENT boundary; tensor
+#                 offsets are from the start of the artifact
+#
+# Metadata holds everything the API needs besides the weights (architecture and its
+# version, class_mapping, sensors_used, scaler_params, job_id, userid), so a cached
+# file is loaded without fetching anything but its row version from the database.
+# Decoding returns NumPy views over the buffer: nothing is unpickled and, for a
+# memory-mapped file, nothing is copied.
+ARTIFACT_MAGIC = b"SEMGART\0"
+ARTIFACT_VERSION = 1
+ARTIFACT_PREAMBLE = struct.Struct('<8sII')
+TENSOR_ALIGNMENT = 64
+ARTIFACT_SUFFIX = '.semgart'
+
+# The network the weights belong to; bump the version when EnhancedAudioCNN changes
+# shape so that old artifacts are rejected instead of loaded into the wrong layers
+MODEL_ARCHITECTURE = "EnhancedAudioCNN"
+MODEL_ARCHITECTURE_VERSION = 1
+
+
+def _align(offset):
+    return -(-offset // TENSOR_ALIGNMENT) * TENSOR_ALIGNMENT
+
+
+# Serialize named arrays (NumPy arrays or CPU tensors) and JSON metadata into bytes
+def encode_artifact(tensors, metadata):
+    arrays = {name: np.ascontiguousarray(value.detach().cpu().numpy() if hasattr(value, 'detach') else value)
+              for name, value in tensors.items()}
+    entries = []
+    offset = 0
+    for name, array in arrays.items():
+        array = arrays[name] = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        entries.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape),
+                        "offset": offset, "nbytes": array.nbytes})
+        offset = _align(offset + array.nbytes)
+
+    # Tensor offsets depend on the header length, which depends on the offsets' digits;
+    # grow the reserved header space until it fits
+    data_start = _align(ARTIFACT_PREAMBLE.size + 256)
+    while True:
+        header = json.dumps({"metadata": metadata, "tensors": [
+            dict(entry, offset=entry["offset"] + data_start) for entry in entries]}).encode()
+        if ARTIFACT_PREAMBLE.size + len(header) <= data_start:
+            break
+        data_start = _align(ARTIFACT_PREAMBLE.size + len(header))
+
+    buffer = bytearray(data_start + offset)
+    buffer[:ARTIFACT_PREAMBLE.size] = ARTIFACT_PREAMBLE.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, len(header))
+    buffer[ARTIFACT_PREAMBLE.size:ARTIFACT_PREAMBLE.size + len(header)] = header
+    for entry, array in zip(entries, arrays.values()):
+        start = data_start + entry["offset"]
+        buffer[start:start + array.nbytes] = array.tobytes()
+    return bytes(buffer)
+
+
+# Parse an artifact buffer (bytes, bytearray, memoryview or mmap). Returns
+# (name -> NumPy array view, metadata); arrays are writable only if the buffer is.
+def decode_artifact(buffer):
+    if len(buffer) < ARTIFACT_PREAMBLE.size:
+        raise ValueError(f"Artifact too short: {len(buffer)} bytes")
+    magic, version, header_length = ARTIFACT_PREAMBLE.unpack_from(buffer)
+    if magic != ARTIFACT_MAGIC:
+        raise ValueError("Not a model artifact")
+    if version != ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported artifact version {version}")
+    header_end = ARTIFACT_PREAMBLE.size + header_length
+    if header_end > len(buffer):
+        raise ValueError("Artifact header is truncated")
+    header = json.loads(bytes(buffer[ARTIFACT_PREAMBLE.size:header_end]))
+
+    tensors = {}
+    for entry in header["tensors"]:
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        if entry["offset"] < header_end or entry["offset"] + count * dtype.itemsize > len(buffer):
+            raise ValueError(f"Tensor {entry['name']} lies outside the artifact")
+        tensors[entry["name"]] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                               offset=entry["offset"]).reshape(entry["shape"])
+    return tensors, header["metadata"]
+
+
+# Local cache files are named by userid, job_id and a row version (the row's xmin), so
+# an artifact rewritten in place under the same job_id is fetched again
+def artifact_path(cache_dir, userid, job_id, row_version):
+    return os.path.join(cache_dir, f"{userid}-{job_id}-{row_version}{ARTIFACT_SUFFIX}")
+
+
+# Write an artifact into the local cache directory and remove the user's older ones.
+# Each writer gets its own temporary file (loads run on several threads and processes)
+# and the rename makes the complete file appear atomically.
+def write_cached_artifact(cache_dir, userid, job_id, row_version, artifact):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = artifact_path(cache_dir, userid, job_id, row_version)
+    fd, temporary = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(artifact)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    for stale in glob.glob(os.path.join(cache_dir, f"{userid}-*{ARTIFACT_SUFFIX}")):
+        if stale != path:
+            try:
+                os.remove(stale)  # Safe while mapped: the mapping outlives the directory entry
+            except OSError:
+                pass
+    return path
+
+
+# Memory-map a cached artifact, or return None if there is none. The mapping is
+# copy-on-write, so arrays decoded from it are writable (torch can wrap them without
+# copying) while the file itself is never modified and clean pages stay shared.
+def map_cached_artifact(cache_dir, userid, job_id, row_version):
+    path = artifact_path(cache_dir, userid, job_id, row_version)
+    try:
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (FileNotFoundError, ValueError):  # ValueError: empty file
+        return None
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+
+# Bounded residency for per-user model artifacts. At most max_models artifacts (and
+# at most max_bytes of tensors and arrays) stay in memory; the least recently used
+# ones are evicted to make room, and with idle_seconds set, models not used for that
+# long are evicted by evict_idle(). A limit of 0 means unbounded.
+#
+# `models` is a plain dict of the resident artifacts. Like the dict it replaces, it is
+# never mutated: every insert or eviction builds a new one and rebinds the attribute,
+# so readers (and the stacked engine, which rebuilds when it sees a new dict) always
+# get a consistent set.
+
+
+# Bytes held by the tensors and arrays of one user's artifacts. A "model_bytes" entry,
+# if present, stands in for the model (frozen TorchScript modules have no state_dict),
+# and "stacked_bytes" is the model's share of the stacked inference weights.
+def artifact_nbytes(info):
+    total = info.get("model_bytes", 0) + info.get("stacked_bytes", 0)
+    for value in info.values():
+        if isinstance(value, torch.nn.Module) and "model_bytes" not in info:
+            total += sum(_tensor_nbytes(tensor) for tensor in value.state_dict().values())
+        elif isinstance(value, (np.ndarray, torch.Tensor)):
+            total += _tensor_nbytes(value)
+    return total
+
+
+def _tensor_nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):  # e.g. packed parameters of quantized layers
+        return sum(_tensor_nbytes(item) for item in value)
+    return 0
+
+
+class ModelCache:
+    def __init__(self, max_models=0, max_bytes=0, idle_seconds=0):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.models = {}  # userid -> artifacts, rebound on every change
+        self.last_used = OrderedDict()  # userid -> monotonic time of last use, least recent first
+        self.sizes = {}  # userid -> artifact_nbytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.idle_evictions = 0
+
+    def __len__(self):
+        return len(self.models)
+
+    def __contains__(self, userid):
+        return userid in self.models
+
+    # Resident artifacts for userid, or None on a miss; a hit marks the model as used
+    def get(self, userid):
+        with self.lock:
+            info = self.models.get(userid)
+            if info is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.last_used[userid] = time.monotonic()
+            self.last_used.move_to_end(userid)
+            return info
+
+    # Number of models that can be added before LRU eviction starts (None if unbounded)
+    def free_slots(self):
+        if not self.max_models:
+            return None
+        return max(self.max_models - len(self.models), 0)
+
+    # Add or replace the artifacts of several users, then evict down to the limits.
+    # Artifacts older than the resident ones (a lazy load racing a reload) are ignored.
+    def put_many(self, loaded):
+        with self.lock:
+            models = dict(self.models)
+            now = time.monotonic()
+            for userid, info in loaded.items():
+                current = models.get(userid)
+                if current is not None and current["job_id"] > info["job_id"]:
+                    continue
+                models[userid] = info
+                size = artifact_nbytes(info)
+                self.bytes += size - self.sizes.get(userid, 0)
+                self.sizes[userid] = size
+                self.last_used[userid] = now
+                self.last_used.move_to_end(userid)
+                self.loads += 1
+            self._evict(models, protect=set(loaded))
+            self.models = models
+
+    def put(self, userid, info):
+        self.put_many({userid: info})
+
+    # Evict least recently used models until within the limits, older models before the
+    # ones just added. The newest model always stays, even if it alone exceeds max_bytes.
+    def _evict(self, models, protect):
+        candidates = [userid for userid in self.last_used if userid not in protect]
+        candidates += [userid for userid in self.last_used if userid in protect][:-1]
+        for userid in candidates:
+            if not self._over_limits(models):
+                return
+            self._remove(models, userid)
+            self.evictions += 1
+
+    def _over_limits(self, models):
+        return bool(self.max_models and len(models) > self.max_models
+                    or self.max_bytes and self.bytes > self.max_bytes)
+
+    def _remove(self, models, userid):
+        del models[userid]
+        del self.last_used[userid]
+        self.bytes -= self.sizes.pop(userid)
+
+    # Evict models not used for idle_seconds; returns the evicted userids
+    def evict_idle(self):
+        if not self.idle_seconds:
+            return []
+        with self.lock:
+            cutoff = time.monotonic() - self.idle_seconds
+            idle = [userid for userid, used in self.last_used.items() if used < cutoff]
+            if idle:
+                models = dict(self.models)
+                for userid in idle:
+                    self._remove(models, userid)
+                self.idle_evictions += len(idle)
+                self.models = models
+            return idle
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "resident": len(self.models),
+                "bytes": self.bytes,
+                "max_models": self.max_models,
+                "max_bytes": self.max_bytes,
+                "idle_seconds": self.idle_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "idle_evictions": self.idle_evictions,
+            }
+
+    # Per-model memory and recency, most recently used first
+    def resident_models(self):
+        with self.lock:
+            now = time.monotonic()
+            return [{"userid": userid, "job_id": self.models[userid]["job_id"], "bytes": self.sizes[userid],
+                     "serving_format": self.models[userid].get("serving_format"), "idle_seconds": now - used}
+                    for userid, used in reversed(self.last_used.items())]
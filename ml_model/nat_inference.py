@@ -1,95 +1,232 @@
 import asyncio
-import requests
+import time
+import numpy as np
+import aiohttp
 import psycopg2
 from nats.aio.client import Client as NATS
 from datetime import datetime
 import os 
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.batch_writer import BatchWriter
+from common.sensor_codec import decode_samples, is_legacy_message, decode_legacy_message
+from common.predict_codec import BINARY_CONTENT_TYPE, encode_predict_request, decode_predict_response
+
 NATS_SERVER = os.environ['NATS_SERVER']
 NATS_USER = os.environ['NATS_USER']
 NATS_PASSWORD = os.environ['NATS_PASSWORD']
 NATS_TOPIC = os.environ['NATS_TOPIC']
-API_URL = "http://127.0.0.1:8000/predict"
-BATCH_SIZE = 64
-
-
-
-# List to store received data
-data_list = []
-
-# Store the API response in the PostgreSQL database
-async def store_api_response(userid, response):
-    try:
-        conn = psycopg2.connect(
-            host=os.environ['POSTGRES_HOST'],
-            database=os.environ['POSTGRES_DB'],
-            user=os.environ['POSTGRES_USER'],
-            password=os.environ['POSTGRES_PASSWORD']
-        )
-        cursor = conn.cursor()
-        timestamp = datetime.now().isoformat()
-        cursor.execute('''
-            INSERT INTO api_responses (userid, response, timestamp)
-            VALUES (%s, %s, %s)
-        ''', (userid, response, timestamp))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Failed to store API response in PostgreSQL. Error: {e}")
+API_URL = os.environ.get('API_URL', "http://127.0.0.1:8000/predict")
+# 'binary' sends windows in the compact format from common/predict_codec.py; set
+# 'json' for APIs that predate it
+API_FORMAT = os.environ.get('API_FORMAT', 'binary')
+BINARY_HEADERS = {"Content-Type": BINARY_CONTENT_TYPE, "Accept": BINARY_CONTENT_TYPE}
+
+# Prediction requests share one pooled HTTP session; at most MAX_INFLIGHT_REQUESTS
+# are outstanding at once and each user has at most one in flight
+MAX_INFLIGHT_REQUESTS = int(os.environ.get('MAX_INFLIGHT_REQUESTS', 16))
+API_TIMEOUT = float(os.environ.get('API_TIMEOUT', 10))
+
+# Batched gesture_predictions writer: flush when PREDICTION_WRITER_BATCH_SIZE rows are
+# pending or PREDICTION_WRITER_FLUSH_INTERVAL seconds after the first pending one
+PREDICTION_WRITER_BATCH_SIZE = int(os.environ.get('PREDICTION_WRITER_BATCH_SIZE', 500))
+PREDICTION_WRITER_FLUSH_INTERVAL = float(os.environ.get('PREDICTION_WRITER_FLUSH_INTERVAL', 1.0))
+PREDICTION_WRITER_MAX_QUEUE = int(os.environ.get('PREDICTION_WRITER_MAX_QUEUE', 10000))
+PREDICTION_WRITER_STATS_INTERVAL = float(os.environ.get('PREDICTION_WRITER_STATS_INTERVAL', 10))
+
+# Each prediction request covers the newest WINDOW_SIZE samples of one user and is
+# scheduled after every HOP_SIZE new samples from that user
+WINDOW_SIZE = int(os.environ.get('BATCH_SIZE', 64))
+HOP_SIZE = int(os.environ.get('HOP_SIZE', 16))
+RING_CAPACITY = 2 * WINDOW_SIZE  # Extra room lets late, out-of-order samples be sorted into place
+# A frame ending more than CLOCK_RESET_MILLIS before the user's newest sample means the
+# armband restarted and its millis() began again from 0; the user's buffer is cleared
+CLOCK_RESET_MILLIS = int(os.environ.get('CLOCK_RESET_MILLIS', 1000))
+API_CHANNELS = 4  # The API is sent the first 4 sensor values of each sample
+MODEL_WINDOW = 32  # Samples per model input window in api.preprocess
+
+
+
+# Preallocated ring buffer of one user's most recent samples
+class UserRingBuffer:
+    def __init__(self, capacity, channels):
+        self.capacity = capacity
+        self.millis = np.zeros(capacity, dtype=np.int64)
+        self.samples = np.zeros((capacity, channels), dtype=np.float32)
+        self.head = 0  # Next write position
+        self.size = 0
+        self.pending = 0  # Samples received since the last scheduled prediction
+        # Device millis and server receive time of the newest sample, used to date windows
+        self.anchor_millis = None
+        self.anchor_timestamp = None
+        self.last_stored_millis = -1  # End millis of the newest window already stored
+        self.epoch = 0  # Incremented when the device clock restarts
+
+    def append(self, millis, samples):
+        if self.size and millis[-1] < self.newest_millis() - CLOCK_RESET_MILLIS:
+            self.reset()
+        count = len(millis)
+        if count > self.capacity:
+            millis = millis[-self.capacity:]
+            samples = samples[-self.capacity:]
+            count = self.capacity
+        positions = (self.head + np.arange(count)) % self.capacity
+        self.millis[positions] = millis
+        self.samples[positions] = samples[:, :self.samples.shape[1]]
+        self.head = (self.head + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        self.pending += count
+
+    # Drop every buffered sample and start dating windows afresh, e.g. after the
+    # device clock restarted
+    def reset(self):
+        self.head = 0
+        self.size = 0
+        self.pending = 0
+        self.anchor_millis = None
+        self.anchor_timestamp = None
+        self.last_stored_millis = -1
+        self.epoch += 1
+
+    def newest_millis(self):
+        return int(self.millis[:self.size].max())
+
+    def set_anchor(self, millis, timestamp):
+        if self.anchor_millis is None or millis >= self.anchor_millis:
+            self.anchor_millis = millis
+            self.anchor_timestamp = timestamp
+
+    # Return copies of the newest `length` samples, ordered by device millis
+    def window(self, length):
+        if self.size < self.capacity:
+            millis = self.millis[:self.size]
+            samples = self.samples[:self.size]
+        else:
+            millis = self.millis
+            samples = self.samples
+        order = np.argsort(millis, kind='stable')[-length:]
+        return millis[order], samples[order]
+
+
+# Per-user ring buffers of received samples, keyed by userid
+user_buffers = {}
+
+# Users with a prediction request in flight
+inflight_users = set()
+
+# Created in main() on the running loop
+http_session = None
+request_slots = None
+prediction_writer = None
+
+# Initialize PostgreSQL database connection
+def initialize_db():
+    return psycopg2.connect(
+        host=os.environ['POSTGRES_HOST'],
+        database=os.environ['POSTGRES_DB'],
+        user=os.environ['POSTGRES_USER'],
+        password=os.environ['POSTGRES_PASSWORD']
+    )
 
-# Function to process the sensor data and make API call
-async def process_sensor_data():
+# Queue one gesture_predictions row per window that ends after the last stored one.
+# Prediction i covers samples i..i+MODEL_WINDOW-1 (see api.preprocess), so windows
+# overlapping the previous request are skipped. Results for a window taken before the
+# device clock restarted (epoch) are dropped: their millis belong to the old clock.
+def store_predictions(userid, buffer, epoch, millis, result):
+    if epoch != buffer.epoch:
+        return
+    end_millis = millis[MODEL_WINDOW - 1:MODEL_WINDOW - 1 + len(result["class_indices"])].tolist()
+    for window_end, class_index, confidence in zip(end_millis, result["class_indices"], result["confidences"]):
+        if window_end <= buffer.last_stored_millis:
+            continue
+        ts = datetime.fromtimestamp(buffer.anchor_timestamp - (buffer.anchor_millis - window_end) / 1000).isoformat()
+        if not prediction_writer.enqueue((userid, window_end, ts, class_index, confidence, result["job_id"])):
+            print(f"Prediction writer queue full; dropped prediction for user {userid} at {window_end}")
+        buffer.last_stored_millis = window_end
+
+# Function to process one user's sensor window and make API call
+# The caller adds userid to inflight_users when it schedules this task
+async def process_sensor_data(userid, buffer, epoch, millis, samples):
     try:
-        # Extract the user ID from the first entry (assuming it's the same for all entries in the batch)
-        userid = data_list[0]["userid"]
-
-        # Sort data_list by millis
-        sorted_data = sorted(data_list, key=lambda x: x["millis"])
-
-        # Extract the first 4 sensor values for each entry
-        sorted_sensor_values = [entry["sensor_values"][:4] for entry in sorted_data]
-
-        # Prepare the payload for the API call
-        payload = {
-            "userid": userid,
-            "data": sorted_sensor_values
-        }
-
         try:
-            # Send the POST request to the /predict endpoint
-            response = requests.post(API_URL, json=payload)
-            response.raise_for_status()  # Raise an HTTPError for bad responses (4xx and 5xx)
-
-            # Print the response
-            print(datetime.now().isoformat(), response.json())
-
-            # Store the response in the PostgreSQL database
-            await store_api_response(userid, str(response.json()))
-
-        except requests.exceptions.RequestException as e:
+            # Send the POST request to the /predict endpoint over the shared connection pool
+            async with request_slots:
+                start = time.perf_counter()
+                if API_FORMAT == 'binary':
+                    async with http_session.post(API_URL, data=encode_predict_request(userid, samples),
+                                                 headers=BINARY_HEADERS) as response:
+                        response.raise_for_status()  # Raise for bad responses (4xx and 5xx)
+                        result = decode_predict_response(await response.read())
+                else:
+                    payload = {"userid": userid, "data": samples.tolist()}
+                    async with http_session.post(API_URL, json=payload) as response:
+                        response.raise_for_status()
+                        result = await response.json()
+
+            # Print the response (binary responses carry class indices only)
+            print(datetime.now().isoformat(), f"user {userid} ({1000 * (time.perf_counter() - start):.1f} ms)",
+                  result.get("predictions", result["class_indices"]))
+
+            # Store the predictions in the PostgreSQL database
+            store_predictions(userid, buffer, epoch, millis, result)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             # Handle any exceptions that occur during the request
-            print(f"Failed to send request to the API. Error: {e}")
-            await store_api_response(userid, f"Request failed: {e}")
+            print(f"Failed to send request to the API for user {userid}. Error: {e!r}")
 
     except Exception as e:
         print(f"Failed to process sensor data. Error: {e}")
+    finally:
+        inflight_users.discard(userid)
 
 # Callback function to handle messages from NATS
 async def message_handler(msg):
     try:
-        data_str = msg.data.decode()
-        data = eval(data_str)  # Use json.loads for a more secure conversion if the data is JSON formatted
-        data_list.append(data)
-
-        # Process data if we have accumulated enough messages
-        if len(data_list) >= BATCH_SIZE:
-            await process_sensor_data()
-            data_list.clear()
+        if is_legacy_message(msg.data):
+            batch = decode_legacy_message(msg.data)  # Publisher predates the binary codec
+        else:
+            batch = decode_samples(msg.data)
+
+        buffer = user_buffers.get(batch.userid)
+        if buffer is None:
+            buffer = user_buffers[batch.userid] = UserRingBuffer(RING_CAPACITY, API_CHANNELS)
+        buffer.append(batch.millis, batch.samples)
+        buffer.set_anchor(int(batch.millis[-1]), batch.timestamp if batch.timestamp is not None else time.time())
+
+        # Schedule a prediction once this user has a full window and HOP_SIZE new samples.
+        # While the user's previous request is in flight, new samples keep accumulating
+        # and the next request covers them all.
+        if buffer.size >= WINDOW_SIZE and buffer.pending >= HOP_SIZE and batch.userid not in inflight_users:
+            buffer.pending = 0
+            millis, samples = buffer.window(WINDOW_SIZE)
+            # Mark the user before the task starts: callbacks for a backlog of messages
+            # run back to back, and each would otherwise schedule its own request
+            inflight_users.add(batch.userid)
+            asyncio.create_task(process_sensor_data(batch.userid, buffer, buffer.epoch, millis, samples))
     except Exception as e:
         print(f"Failed to handle message. Error: {e}")
 
 # Main function to subscribe to NATS topic and process data
 async def main():
+    global http_session, request_slots, prediction_writer
+    prediction_writer = BatchWriter(
+        "gesture_predictions",
+        initialize_db,
+        "gesture_predictions",
+        ["userid", "window_end_millis", "ts", "class_index", "confidence", "job_id"],
+        batch_size=PREDICTION_WRITER_BATCH_SIZE,
+        flush_interval=PREDICTION_WRITER_FLUSH_INTERVAL,
+        max_queue=PREDICTION_WRITER_MAX_QUEUE,
+        report_interval=PREDICTION_WRITER_STATS_INTERVAL
+    )
+    prediction_writer.start()  # Background COPY writer for gesture_predictions
+    request_slots = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=MAX_INFLIGHT_REQUESTS),
+        timeout=aiohttp.ClientTimeout(total=API_TIMEOUT)
+    )
+
     nc = NATS()
 
     # Connect to the NATS server with authentication
@@ -108,6 +245,7 @@ async def main():
             await asyncio.sleep(0.2)  # Sleep for a second and keep checking
     finally:
         await nc.drain()
+        await http_session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,214 @@
+import threading
+import time
+import warnings
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# Optimized serving variants of a loaded model. Besides the eager module, a model can
+# be served as a frozen TorchScript trace, with its Linear layers dynamically
+# quantized to int8, or both. Each variant is checked against the eager model on a
+# fixed, varied set of synthetic windows (see parity_windows) before it is used: the
+# softmax probabilities must stay within PARITY_TOLERANCE and the predicted class must
+# agree on at least PARITY_MIN_AGREEMENT of the windows. The measured agreement is
+# logged either way; a variant that fails falls through to the next choice, down to eager.
+#
+# In "auto" mode the variants are timed once per model architecture (ignoring the
+# number of classes) and every model of that architecture uses the fastest variant
+# that passes its own parity check.
+SERVING_FORMATS = ("eager", "torchscript", "int8", "int8-torchscript")
+PARITY_WINDOWS = 1024
+PARITY_TOLERANCE = 0.01
+PARITY_MIN_AGREEMENT = 0.999
+BENCH_WINDOWS = 32  # Windows per forward pass when timing; a 64-sample request has 32
+BENCH_REPEATS = 20
+
+
+def _quantize(model):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # quantize_dynamic deprecation notices
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def _trace(model, example):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # TracerWarning for the fixed-length residual branch
+        return torch.jit.freeze(torch.jit.trace(model, example))
+
+
+def _state_nbytes(model):
+    total = 0
+    for value in model.state_dict().values():
+        for tensor in value if isinstance(value, tuple) else (value,):
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+# Build one serving variant of an eager model in eval mode. Returns (module, bytes of
+# weights); frozen TorchScript keeps no state_dict, so the size is taken before freezing.
+def build_variant(model, name, input_length):
+    example = torch.zeros(2, 1, input_length)
+    with torch.no_grad():
+        if name == "eager":
+            return model, _state_nbytes(model)
+        if name == "torchscript":
+            return _trace(model, example), _state_nbytes(model)
+        if name == "int8":
+            quantized = _quantize(model)
+            return quantized, _state_nbytes(quantized)
+        if name == "int8-torchscript":
+            quantized = _quantize(model)
+            return _trace(quantized, example), _state_nbytes(quantized)
+    raise ValueError(f"Unknown serving format {name!r}")
+
+
+# count synthetic standardized windows [count, 1, input_length] in equal shares of:
+# unit Gaussian noise, Gaussian noise at log-uniform scales from 0.1 to 10, heavy-tailed
+# (Student t, 3 degrees of freedom) noise, noise under a single activation burst,
+# offset noise, and smooth signals (random walks and sinusoids). Models see all of
+# these in real sensor data; unit noise alone rarely lands near a decision boundary.
+def parity_windows(count, input_length, generator):
+    def randn(n):
+        return torch.randn(n, input_length, generator=generator)
+
+    def rand(n):
+        return torch.rand(n, 1, generator=generator)
+
+    shares = [count // 6 + (i < count % 6) for i in range(6)]
+    positions = torch.arange(input_length, dtype=torch.float32) / input_length
+    centers, widths = rand(shares[3]), 0.05 + 0.2 * rand(shares[3])
+    chi2 = (randn(shares[2]).narrow(1, 0, 3) ** 2).sum(1, keepdim=True) / 3
+    walks = randn(shares[5] // 2).cumsum(1)
+    frequencies, phases = 1 + 15 * rand(shares[5] - shares[5] // 2), 2 * torch.pi * rand(shares[5] - shares[5] // 2)
+    families = [
+        randn(shares[0]),
+        randn(shares[1]) * 10 ** (2 * rand(shares[1]) - 1),
+        randn(shares[2]) / chi2.sqrt(),
+        randn(shares[3]) * (0.2 + 4 * torch.exp(-((positions - centers) / widths) ** 2)),
+        randn(shares[4]) + 6 * rand(shares[4]) - 3,
+        torch.cat([walks / walks.std(1, keepdim=True),
+                   torch.sin(2 * torch.pi * frequencies * positions + phases) * (0.5 + 2 * rand(len(phases)))]),
+    ]
+    return torch.cat(families).unsqueeze(1)
+
+
+# Compare a serving variant with the eager model on inputs. Returns (fraction of windows
+# with the same predicted class, largest softmax probability difference).
+def parity_stats(reference, candidate, inputs):
+    with torch.no_grad():
+        expected = F.softmax(reference(inputs), dim=1)
+        actual = F.softmax(candidate(inputs), dim=1)
+    if actual.shape != expected.shape:
+        return 0.0, float("inf")
+    agreement = (actual.argmax(1) == expected.argmax(1)).float().mean().item()
+    return agreement, (actual - expected).abs().max().item()
+
+
+def parity_ok(reference, candidate, inputs, tolerance=PARITY_TOLERANCE, min_agreement=PARITY_MIN_AGREEMENT):
+    agreement, max_difference = parity_stats(reference, candidate, inputs)
+    return agreement >= min_agreement and max_difference <= tolerance
+
+
+# Best-of-BENCH_REPEATS seconds per forward pass
+def time_forward(module, inputs):
+    best = float("inf")
+    with torch.no_grad():
+        module(inputs)  # Warm up (TorchScript profiles its first calls)
+        module(inputs)
+        for _ in range(BENCH_REPEATS):
+            started = time.perf_counter()
+            module(inputs)
+            best = min(best, time.perf_counter() - started)
+    return best
+
+
+# Turns eager models into their serving variant. mode is "eager", "auto" or one of
+# SERVING_FORMATS; a fixed format falls back to eager if it fails parity.
+class ServingFormatSelector:
+    def __init__(self, mode="eager", input_length=128, tolerance=PARITY_TOLERANCE,
+                 min_agreement=PARITY_MIN_AGREEMENT):
+        if mode != "auto" and mode not in SERVING_FORMATS:
+            raise ValueError(f"Unknown serving format {mode!r}; expected auto or one of {SERVING_FORMATS}")
+        self.mode = mode
+        self.input_length = input_length
+        self.tolerance = tolerance
+        self.min_agreement = min_agreement
+        self.lock = threading.Lock()
+        self.rankings = {}  # architecture signature -> [(format, ms per forward)], fastest first
+        self.counts = {}  # format -> models converted to it
+        self.parity = {}  # format -> {"checked", "rejected", "min_agreement", "max_difference"}
+        generator = torch.Generator().manual_seed(0)
+        self.parity_inputs = parity_windows(PARITY_WINDOWS, input_length, generator)
+        self.bench_inputs = torch.randn(BENCH_WINDOWS, 1, input_length, generator=generator)
+
+    @staticmethod
+    def _signature(model):
+        return tuple((name, tuple(value.shape)) for name, value in model.state_dict().items()
+                     if not name.startswith("fc2."))
+
+    # Time every variant that can be built for this model; called once per architecture
+    def _rank(self, model):
+        timings = []
+        for name in SERVING_FORMATS:
+            try:
+                module, _ = build_variant(model, name, self.input_length)
+                timings.append((name, 1000 * time_forward(module, self.bench_inputs)))
+            except Exception as e:
+                print(f"Serving format {name} unavailable: {e}")
+        timings.sort(key=lambda timing: timing[1])
+        print("Serving format timings (ms per forward):", {name: round(ms, 3) for name, ms in timings})
+        return timings
+
+    def _candidates(self, model):
+        if self.mode == "eager":
+            return ["eager"]
+        if self.mode != "auto":
+            return [self.mode, "eager"]
+        signature = self._signature(model)
+        with self.lock:
+            if signature not in self.rankings:
+                self.rankings[signature] = self._rank(model)
+            ranking = self.rankings[signature]
+        candidates = [name for name, _ in ranking]
+        return candidates if "eager" in candidates else candidates + ["eager"]
+
+    # Check a variant against the eager model, record and log the result
+    def _check_parity(self, model, module, name):
+        agreement, max_difference = parity_stats(model, module, self.parity_inputs)
+        passed = agreement >= self.min_agreement and max_difference <= self.tolerance
+        with self.lock:
+            parity = self.parity.setdefault(name, {"checked": 0, "rejected": 0, "min_agreement": 1.0,
+                                                   "max_difference": 0.0})
+            parity["checked"] += 1
+            parity["rejected"] += not passed
+            parity["min_agreement"] = min(parity["min_agreement"], agreement)
+            parity["max_difference"] = max(parity["max_difference"], max_difference)
+        disagreeing = round((1 - agreement) * len(self.parity_inputs))
+        print(f"Serving format {name} {'accepted' if passed else 'rejected'}: predicted class differs from "
+              f"eager on {disagreeing} of {len(self.parity_inputs)} windows ({100 * (1 - agreement):.2f}%, "
+              f"limit {100 * (1 - self.min_agreement):.2f}%), max probability difference {max_difference:.4f}")
+        return passed
+
+    # Returns (serving module, format name, bytes of weights)
+    def convert(self, model):
+        for name in self._candidates(model):
+            try:
+                module, nbytes = build_variant(model, name, self.input_length)
+            except Exception as e:
+                print(f"Could not build serving format {name}: {e}")
+                continue
+            if name == "eager" or self._check_parity(model, module, name):
+                with self.lock:
+                    self.counts[name] = self.counts.get(name, 0) + 1
+                return module, name, nbytes
+        raise RuntimeError("No serving format available")  # Unreachable: eager always passes
+
+    def stats(self):
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "models": dict(self.counts),
+                "parity": {name: dict(parity) for name, parity in self.parity.items()},
+                "timings_ms": [dict(ranking) for ranking in self.rankings.values()],
+            }
@@ -0,0 +1,263 @@
+import threading
+import time
+import torch
+import torch.nn.functional as F
+
+# Cross-user inference: every user's EnhancedAudioCNN has the same architecture apart
+# from the number of classes, so their weights are stacked along a leading model
+# dimension and the windows of a block of users are scored with one set of batched
+# matrix multiplies (convolutions as im2col + bmm) instead of one module call per model.
+# fc2 is padded to the largest class count; padded classes get a large negative bias
+# so they never win the softmax/argmax.
+#
+# stacked_forward() mirrors EnhancedAudioCNN.forward. Every model is checked against
+# its module when it joins a group; models whose outputs do not match are left
+# unstacked and run on their own.
+PAD_LOGIT = -1e9
+PADDED_LAYER = "fc2"
+PARITY_INPUT_LENGTH = 128  # Model input length: 32 samples x 4 channels
+PARITY_TOLERANCE = 1e-4
+
+
+# Conv1d(kernel_size=3, padding=1) per model. x: [M, B, L, Cin] channels-last,
+# weight: [M, Cout, Cin, 3], bias: [M, Cout]; returns [M, B, L, Cout].
+def _conv1d_k3(x, weight, bias):
+    models, batch, length, in_channels = x.shape
+    cols = F.pad(x, (0, 0, 1, 1)).unfold(2, 3, 1).reshape(models, batch * length, in_channels * 3)
+    out = torch.baddbmm(bias.unsqueeze(1), cols, weight.reshape(models, weight.shape[1], -1).transpose(1, 2))
+    return out.reshape(models, batch, length, -1)
+
+
+# MaxPool1d(kernel_size=2, stride=2) over the length dimension of [M, B, L, C]
+def _max_pool2(x):
+    models, batch, length, channels = x.shape
+    return x[:, :, :length // 2 * 2].reshape(models, batch, length // 2, 2, channels).amax(3)
+
+
+# EnhancedAudioCNN.forward for M models at once. params: stacked parameters [M, ...],
+# x: [M, B, 1, L]; returns logits [M, B, max classes].
+def stacked_forward(params, x):
+    models, batch = x.shape[:2]
+    x = x.transpose(2, 3)  # [M, B, L, 1]
+    residual = (x[:, :, ::4] * params["residual_conv.weight"].reshape(models, 1, 1, -1)
+                + params["residual_conv.bias"].reshape(models, 1, 1, -1))
+    x = _max_pool2(F.relu(_conv1d_k3(x, params["conv1.weight"], params["conv1.bias"])))
+    x = _max_pool2(F.relu(_conv1d_k3(x, params["conv2.weight"], params["conv2.bias"])))
+    if residual.size(2) != x.size(2):
+        residual = F.adaptive_avg_pool1d(residual.transpose(2, 3).flatten(0, 1), x.size(2))
+        residual = residual.reshape(models, batch, -1, x.size(2)).transpose(2, 3)
+    x = x + residual
+    x = x.transpose(2, 3).reshape(models, batch, -1)  # Channel-major flatten, like x.view(B, -1)
+    x = F.relu(torch.baddbmm(params["fc1.bias"].unsqueeze(1), x, params["fc1.weight"].transpose(1, 2)))
+    return torch.baddbmm(params["fc2.bias"].unsqueeze(1), x, params["fc2.weight"].transpose(1, 2))
+
+
+# Measured on one CPU thread (100 models, 8-model blocks): a block scored together
+# takes about as long for 1 active model as for 8, and beats one module call per model
+# by up to 2x (1 window each) or 1.8x (4-8 windows) once half the block is active. From
+# about 16 windows per model the module calls are faster even for a full block, so
+# larger requests (e.g. nat_inference's 32-window ones) always run per model.
+STACK_BLOCK_SIZE = 8  # Models per stacked forward pass
+STACK_MAX_WINDOWS = 8  # Models with more windows in a batch run on their own module
+STACK_MIN_ACTIVE = 4  # Blocks with fewer models in a batch run them on their own modules
+STACK_REBUILD_INTERVAL = 1.0  # Seconds between background rebuilds
+
+
+# Models sharing one signature, their parameters stacked once ([M, ...], fc2 padded to
+# num_classes) and scored in blocks of block_size consecutive rows. Groups are never
+# modified: a membership change builds a new one.
+class _StackedGroup:
+    def __init__(self, job_ids, params, num_classes, block_size):
+        self.index = {job_id: i for i, job_id in enumerate(job_ids)}
+        self.params = params
+        self.num_classes = num_classes
+        self.block_size = block_size
+
+    def block(self, job_id):
+        return self.index[job_id] // self.block_size
+
+    # Score the models of one block; inputs: job_id -> tensor[N_i, 1, L] for some of its
+    # models. Inactive rows get no windows, so no weights are gathered or copied.
+    # Returns job_id -> logits[N_i, num_classes].
+    def forward_block(self, block, inputs):
+        start = block * self.block_size
+        params = {name: value[start:start + self.block_size] for name, value in self.params.items()}  # Views
+        rows = len(next(iter(params.values())))
+        example = next(iter(inputs.values()))
+        padded = example.new_zeros((rows, max(len(x) for x in inputs.values())) + tuple(example.shape[1:]))
+        for job_id, x in inputs.items():
+            padded[self.index[job_id] - start, :len(x)] = x
+        logits = stacked_forward(params, padded)
+        return {job_id: logits[self.index[job_id] - start, :len(x)] for job_id, x in inputs.items()}
+
+
+# Stacked weights for the loaded models, grouped by parameter shapes (other than the
+# padded layer). Stacks are built on a background thread, at most once per
+# STACK_REBUILD_INTERVAL, from the newest artifacts dict passed in: loads, reloads and
+# evictions in the model cache never stall an inference thread, and models that are not
+# stacked yet run on their own modules meanwhile. Only models new to the engine are
+# parity-checked. The stacks are a second copy of the stacked models' weights, which
+# api.py counts towards the model cache's byte budget ("stacked_bytes"); while a
+# group is restacked, its old and new stacks coexist.
+class StackedModelEngine:
+    def __init__(self, block_size=STACK_BLOCK_SIZE, max_windows=STACK_MAX_WINDOWS, min_active=STACK_MIN_ACTIVE,
+                 rebuild_interval=STACK_REBUILD_INTERVAL):
+        self.block_size = block_size
+        self.max_windows = max_windows
+        self.min_active = min_active
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.Lock()
+        self.source = None  # Newest artifacts dict seen
+        self.built = None  # Artifacts dict the current groups were built from
+        self.rebuilding = False
+        self.by_signature = {}  # signature -> _StackedGroup
+        self.signatures = {}  # job_id -> signature, for stacked models
+        self.unstacked = set()  # job_ids that failed the parity check
+        self.groups = {}  # job_id -> _StackedGroup
+
+    @staticmethod
+    def _signature(model):
+        return tuple((name, tuple(value.shape)) for name, value in model.state_dict().items()
+                     if not name.startswith(PADDED_LAYER + "."))
+
+    @staticmethod
+    def _pad_classes(tensor, num_classes, value):
+        padded = tensor.new_full((num_classes,) + tuple(tensor.shape[1:]), value)
+        padded[:len(tensor)] = tensor
+        return padded
+
+    # Parameters of models sharing a signature, stacked [M, ...] with fc2 padded to num_classes
+    def _stack(self, models, num_classes):
+        pad_values = {PADDED_LAYER + ".weight": 0.0, PADDED_LAYER + ".bias": PAD_LOGIT}
+        model_params = [dict(model.named_parameters()) for model in models]
+        params = {}
+        for name in model_params[0]:
+            tensors = [named[name].detach() for named in model_params]
+            if name in pad_values:
+                tensors = [self._pad_classes(tensor, num_classes, pad_values[name]) for tensor in tensors]
+            params[name] = torch.stack(tensors)
+        return params
+
+    # Indices of models whose own forward disagrees with the stacked forward on random windows
+    @staticmethod
+    def _parity_failures(models, params):
+        x = torch.randn(len(models), 2, 1, PARITY_INPUT_LENGTH)
+        with torch.no_grad():
+            stacked = stacked_forward(params, x)
+            failures = []
+            for i, model in enumerate(models):
+                expected = model(x[i])
+                if not torch.allclose(stacked[i, :, :expected.shape[1]], expected, atol=PARITY_TOLERANCE):
+                    failures.append(i)
+        return failures
+
+    # Parity-check models new to the engine; returns the job_ids of those that fail
+    def _check_new(self, infos):
+        models = [info["model"] for info in infos]
+        num_classes = max(getattr(model, PADDED_LAYER).out_features for model in models)
+        try:
+            failures = self._parity_failures(models, self._stack(models, num_classes))
+        except Exception as e:
+            print(f"Stacked inference cannot run {len(models)} models, running them unstacked: {e}")
+            failures = range(len(models))
+        if failures:
+            print(f"Stacked inference does not match {len(failures)} of {len(models)} models; running them unstacked")
+        return {infos[i]["job_id"] for i in failures}
+
+    # Bring the groups in line with user_artifacts, restacking only the signatures whose
+    # members changed. Called with the lock released; only one update runs at a time.
+    def update(self, user_artifacts):
+        current = {info["job_id"]: info for info in user_artifacts.values()}
+        changed = {self.signatures.pop(job_id) for job_id in list(self.signatures) if job_id not in current}
+        self.unstacked.intersection_update(current)
+
+        added = {}
+        for job_id, info in current.items():
+            if job_id not in self.signatures and job_id not in self.unstacked:
+                added.setdefault(self._signature(info["model"]), []).append(info)
+        for signature, infos in added.items():
+            self.unstacked |= self._check_new(infos)
+            for info in infos:
+                if info["job_id"] not in self.unstacked:
+                    self.signatures[info["job_id"]] = signature
+                    changed.add(signature)
+
+        members = {}
+        for job_id, signature in self.signatures.items():
+            if signature in changed:
+                members.setdefault(signature, []).append(current[job_id])
+        for signature in changed:
+            infos = members.get(signature)
+            if not infos:
+                self.by_signature.pop(signature, None)
+                continue
+            models = [info["model"] for info in infos]
+            num_classes = max(getattr(model, PADDED_LAYER).out_features for model in models)
+            self.by_signature[signature] = _StackedGroup([info["job_id"] for info in infos],
+                                                         self._stack(models, num_classes), num_classes, self.block_size)
+
+        groups = {job_id: self.by_signature[signature] for job_id, signature in self.signatures.items()}
+        with self.lock:
+            self.groups = groups
+            self.built = user_artifacts
+
+    def _rebuild_loop(self):
+        while True:
+            with self.lock:
+                target = self.source
+            started = time.monotonic()
+            try:
+                self.update(target)
+            except Exception as e:
+                print(f"Failed to rebuild stacked models: {e}")
+            time.sleep(max(self.rebuild_interval - (time.monotonic() - started), 0))
+            with self.lock:
+                if self.source is target:
+                    self.rebuilding = False
+                    return
+
+    # Current groups; a new artifacts dict (reload, lazy load or eviction) schedules a
+    # background rebuild and the previous groups stay in use until it is done
+    def groups_for(self, user_artifacts):
+        with self.lock:
+            if user_artifacts is not self.source:
+                self.source = user_artifacts
+                if not self.rebuilding and user_artifacts is not self.built:
+                    self.rebuilding = True
+                    threading.Thread(target=self._rebuild_loop, name="stacked-rebuild", daemon=True).start()
+            return self.groups
+
+    # inputs: list of (model_info, tensor[N_i, 1, L]) for any mix of users; returns the
+    # logits for each entry (for stacked models, classes beyond the model's count hold
+    # PAD_LOGIT). Each model's windows are concatenated; blocks with at least min_active
+    # models of at most max_windows windows are scored stacked, the rest per model.
+    def forward(self, user_artifacts, inputs):
+        groups = self.groups_for(user_artifacts)
+        per_model = {}
+        for i, (info, _) in enumerate(inputs):
+            per_model.setdefault(info["job_id"], []).append(i)
+        model_inputs = {job_id: torch.cat([inputs[i][1] for i in members]) for job_id, members in per_model.items()}
+
+        blocks = {}
+        for job_id, x in model_inputs.items():
+            group = groups.get(job_id)
+            # Unstacked models, ones from an older artifacts dict (reloaded mid-request) or
+            # not stacked yet, and large inputs run on their own module
+            if group is not None and len(x) <= self.max_windows:
+                blocks.setdefault((id(group), group.block(job_id)), (group, []))[1].append(job_id)
+
+        logits = {}
+        for group, job_ids in blocks.values():
+            if len(job_ids) >= self.min_active:
+                logits.update(group.forward_block(group.block(job_ids[0]), {job_id: model_inputs[job_id] for job_id in job_ids}))
+        for job_id, members in per_model.items():
+            if job_id not in logits:
+                logits[job_id] = inputs[members[0]][0]["model"](model_inputs[job_id])
+
+        outputs = [None] * len(inputs)
+        for job_id, members in per_model.items():
+            offset = 0
+            for i in members:
+                outputs[i] = logits[job_id][offset:offset + len(inputs[i][1])]
+                offset += len(inputs[i][1])
+        return outputs
@@ -7,7 +7,6 @@ from datetime import datetime, timedelta
 from scipy.interpolate import interp1d
 import numpy as np
 from collections import Counter
-import re
 import os
 # Initialize PostgreSQL connection
 def init_connection():
@@ -47,10 +46,11 @@ async def fetch_gesture_data(conn, user_id, time_window):
     cursor = conn.cursor()
     time_threshold = (datetime.now() - timedelta(seconds=time_window / 1000)).isoformat()
     cursor.execute('''
-        SELECT response, timestamp 
-        FROM api_responses 
-        WHERE userid = %s AND timestamp > %s
-        ORDER BY timestamp DESC
+        SELECT p.ts, tja.class_mapping ->> p.class_index::text AS prediction
+        FROM gesture_predictions p
+        JOIN training_job_artifacts tja ON tja.job_id = p.job_id
+        WHERE p.userid = %s AND p.ts > %s
+        ORDER BY p.ts
     ''', (user_id, time_threshold))
     rows = cursor.fetchall()
     cursor.close()
@@ -75,30 +75,8 @@ def round_up(value, base=50):
 
 # Transform gesture data for plotting
 def transform_gesture_data(gesture_data):
-    def extract_predictions(s):
-        match = re.search(r"\[(.*?)\]", s)
-        if match:
-            predictions_str = match.group(1)
-            # Extract predictions as strings
-            predictions = [x.strip().strip("'") for x in predictions_str.split(",")]
-            return predictions
-        return []
-
-    parsed_data = []
-    for row in gesture_data:
-        predictions = extract_predictions(row[0])
-        timestamp = pd.to_datetime(row[1])
-        parsed_data.append((predictions, timestamp))
-
-    transformed_data = []
-    for predictions, timestamp in parsed_data:
-        num_predictions = len(predictions)
-        start_time = timestamp - timedelta(milliseconds=num_predictions)
-        time_delta = timedelta(milliseconds=1)
-        for i, prediction in enumerate(predictions):
-            transformed_data.append((start_time + i * time_delta, prediction))
-
-    df = pd.DataFrame(transformed_data, columns=['timestamp', 'prediction'])
+    df = pd.DataFrame(gesture_data, columns=['timestamp', 'prediction'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
 
     # Apply moving window manually to get the most frequent gesture
     window_size = 5
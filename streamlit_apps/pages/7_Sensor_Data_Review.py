@@ -7,8 +7,23 @@ from datetime import datetime, timedelta
 from scipy.interpolate import interp1d
 import numpy as np
 from collections import Counter
-import re
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.sensor_rollups import choose_resolution, fetch_sensor_rollups
+
+SENSORS = ['sensor_a0', 'sensor_a1', 'sensor_a2', 'sensor_a3', 'sensor_a4']
+PLOT_WIDTH_PX = 1000  # Approximate sensor plot width; rollups are chosen for at most one bucket per pixel
+REVIEW_RANGES = {  # Seconds of history to review; None uses the Time Window slider
+    'Time Window': None,
+    'Last minute': 60,
+    'Last 15 minutes': 15 * 60,
+    'Last hour': 60 * 60,
+    'Last 6 hours': 6 * 60 * 60,
+    'Last 24 hours': 24 * 60 * 60,
+}
+
 # Initialize PostgreSQL connection
 def init_connection():
     return psycopg2.connect(
@@ -27,30 +42,43 @@ def fetch_users():
     cursor.close()
     return users
 
-# Fetch sensor data for a specific user within a time window
+# Fetch sensor data for a specific user within a time window (ms). Short windows
+# return raw samples sorted by millis; longer ones return min/max/mean rollup buckets
+# (columns ts, sample_count, sensor_aN_min, sensor_aN_max and the mean as sensor_aN).
+# Returns (DataFrame, rollup resolution in ms or None for raw samples).
 async def fetch_sensor_data(conn, user_id, time_window):
+    end = datetime.now()
+    start = end - timedelta(seconds=time_window / 1000)
+    resolution = choose_resolution(start, end, PLOT_WIDTH_PX)
+    if resolution is not None:
+        rows = fetch_sensor_rollups(conn, user_id, start, end, resolution)
+        columns = (['ts', 'sample_count'] + [f'{sensor}_min' for sensor in SENSORS]
+                   + [f'{sensor}_max' for sensor in SENSORS] + SENSORS)
+        return pd.DataFrame(rows, columns=columns), resolution
+
     cursor = conn.cursor()
-    time_threshold = (datetime.now() - timedelta(seconds=time_window / 1000)).isoformat()
-    cursor.execute(f'''
-        SELECT millis, sensor_a0, sensor_a1, sensor_a2, sensor_a3, sensor_a4, ts 
-        FROM user_sensor 
-        WHERE userid = {user_id}
+    cursor.execute('''
+        SELECT millis, sensor_a0, sensor_a1, sensor_a2, sensor_a3, sensor_a4, ts
+        FROM user_sensor
+        WHERE userid = %s AND ts >= %s
         ORDER BY millis DESC
-    ''')
+    ''', (user_id, start))
     rows = cursor.fetchall()
     cursor.close()
-    return rows
+    df = pd.DataFrame(rows, columns=['millis'] + SENSORS + ['ts'])
+    return df.sort_values(by='millis'), None
 
 # Fetch gesture data for a specific user within a time window
 async def fetch_gesture_data(conn, user_id, time_window):
     cursor = conn.cursor()
     time_threshold = (datetime.now() - timedelta(seconds=time_window / 1000)).isoformat()
-    cursor.execute(f'''
-        SELECT response, timestamp 
-        FROM api_responses 
-        WHERE userid = {user_id}
-        ORDER BY timestamp DESC
-    ''')
+    cursor.execute('''
+        SELECT p.ts, tja.class_mapping ->> p.class_index::text AS prediction
+        FROM gesture_predictions p
+        JOIN training_job_artifacts tja ON tja.job_id = p.job_id
+        WHERE p.userid = %s AND p.ts > %s
+        ORDER BY p.ts
+    ''', (user_id, time_threshold))
     rows = cursor.fetchall()
     cursor.close()
     return rows
@@ -74,30 +102,8 @@ def round_up(value, base=50):
 
 # Transform gesture data for plotting
 def transform_gesture_data(gesture_data):
-    def extract_predictions(s):
-        match = re.search(r"\[(.*?)\]", s)
-        if match:
-            predictions_str = match.group(1)
-            # Extract predictions as strings
-            predictions = [x.strip().strip("'") for x in predictions_str.split(",")]
-            return predictions
-        return []
-
-    parsed_data = []
-    for row in gesture_data:
-        predictions = extract_predictions(row[0])
-        timestamp = pd.to_datetime(row[1])
-        parsed_data.append((predictions, timestamp))
-
-    transformed_data = []
-    for predictions, timestamp in parsed_data:
-        num_predictions = len(predictions)
-        start_time = timestamp - timedelta(milliseconds=num_predictions)
-        time_delta = timedelta(milliseconds=1)
-        for i, prediction in enumerate(predictions):
-            transformed_data.append((start_time + i * time_delta, prediction))
-
-    df = pd.DataFrame(transformed_data, columns=['timestamp', 'prediction'])
+    df = pd.DataFrame(gesture_data, columns=['timestamp', 'prediction'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
 
     # Apply moving window manually to get the most frequent gesture
     window_size = 5
@@ -152,17 +158,21 @@ def plot_gestures(gesture_df):
     return fig
 
 
-# Plot sensor data
-def plot_data(df, paused, sensors_to_display, show_interpolated, auto_y, manual_y_min, manual_y_max):
+# Plot sensor data; rollup buckets are drawn as the mean with a shaded min/max band
+def plot_data(df, resolution, paused, sensors_to_display, show_interpolated, auto_y, manual_y_min, manual_y_max):
     if paused:
         return None
 
-    if show_interpolated:
+    if show_interpolated and resolution is None:
         df = interpolate_data(df)
 
     if auto_y:
-        y_min = df[sensors_to_display].min().min()
-        y_max = df[sensors_to_display].max().max()
+        if resolution is None:
+            y_min = df[sensors_to_display].min().min()
+            y_max = df[sensors_to_display].max().max()
+        else:
+            y_min = df[[f'{sensor}_min' for sensor in sensors_to_display]].min().min()
+            y_max = df[[f'{sensor}_max' for sensor in sensors_to_display]].max().max()
         y_min_rounded = round_down(y_min, 50)
         y_max_rounded = round_up(y_max, 50)
     else:
@@ -170,12 +180,22 @@ def plot_data(df, paused, sensors_to_display, show_interpolated, auto_y, manual_
         y_max_rounded = manual_y_max
 
     fig = go.Figure()
-    for sensor in sensors_to_display:
-        fig.add_trace(go.Scatter(x=df['millis'], y=df[sensor], mode='lines', name=sensor))
+    if resolution is None:
+        for sensor in sensors_to_display:
+            fig.add_trace(go.Scatter(x=df['millis'], y=df[sensor], mode='lines', name=sensor))
+        xaxis_title = 'Milliseconds since start'
+    else:
+        for sensor in sensors_to_display:
+            fig.add_trace(go.Scatter(x=df['ts'], y=df[f'{sensor}_max'], mode='lines', line=dict(width=0),
+                                     showlegend=False, hoverinfo='skip', legendgroup=sensor))
+            fig.add_trace(go.Scatter(x=df['ts'], y=df[f'{sensor}_min'], mode='lines', line=dict(width=0),
+                                     fill='tonexty', showlegend=False, hoverinfo='skip', legendgroup=sensor))
+            fig.add_trace(go.Scatter(x=df['ts'], y=df[sensor], mode='lines', name=sensor, legendgroup=sensor))
+        xaxis_title = f'Timestamp ({resolution} ms min/max/mean buckets)'
 
     fig.update_layout(
         title='Real-time Sensor Data and Classified Gestures',
-        xaxis_title='Milliseconds since start',
+        xaxis_title=xaxis_title,
         yaxis_title='Sensor Value',
         yaxis=dict(range=[y_min_rounded, y_max_rounded]),
         template='plotly_white'
@@ -207,6 +227,9 @@ async def main():
             show_interpolated = st.checkbox('Show Interpolated Data', value=False)
         with col3:
             time_window = st.slider('Time Window (ms)', min_value=10, max_value=10000, value=10000, step=10)
+            review_range = st.selectbox('Review Range', list(REVIEW_RANGES.keys()), index=0)
+            if REVIEW_RANGES[review_range] is not None:
+                time_window = REVIEW_RANGES[review_range] * 1000
 
         auto_y = st.checkbox('Auto Y-Axis Scaling', value=True)
         if not auto_y:
@@ -218,21 +241,18 @@ async def main():
 
         st.subheader('Select Sensors to Display')
         sensor_cols = st.columns(5)
-        sensors = ['sensor_a0', 'sensor_a1', 'sensor_a2', 'sensor_a3', 'sensor_a4']
-        sensor_checkboxes = {sensor: sensor_cols[i].checkbox(sensor, value=True) for i, sensor in enumerate(sensors)}
+        sensor_checkboxes = {sensor: sensor_cols[i].checkbox(sensor, value=True) for i, sensor in enumerate(SENSORS)}
 
         sensors_to_display = [sensor for sensor, checked in sensor_checkboxes.items() if checked]
 
-        sensor_data = await fetch_sensor_data(conn, selected_user_id, time_window)
+        df, resolution = await fetch_sensor_data(conn, selected_user_id, time_window)
         gesture_data = await fetch_gesture_data(conn, selected_user_id, time_window)
         
         sensors_to_display = [sensor for sensor, checked in sensor_checkboxes.items() if checked]
-        df = pd.DataFrame(sensor_data, columns=['millis', 'sensor_a0', 'sensor_a1', 'sensor_a2', 'sensor_a3', 'sensor_a4', 'ts'])
-        df = df.sort_values(by='millis')
-        
+
         gesture_df = transform_gesture_data(gesture_data)
 
-        sensor_fig.plotly_chart(plot_data(df, paused, sensors_to_display, show_interpolated, auto_y, manual_y_min, manual_y_max), use_container_width=True)
+        sensor_fig.plotly_chart(plot_data(df, resolution, paused, sensors_to_display, show_interpolated, auto_y, manual_y_min, manual_y_max), use_container_width=True)
         gesture_fig.plotly_chart(plot_gestures(gesture_df), use_container_width=True)
         
 
@@ -0,0 +1,67 @@
+import os
+import sys
+import timeit
+import random
+from datetime import datetime
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.sensor_codec import encode_samples, decode_samples
+
+# Micro-benchmark: the legacy str(dict) + eval NATS path vs the binary sensor codec
+NUM_SAMPLES = 10000
+FRAME_SAMPLES = 10  # samples per datagram from the binary firmware
+USER_ID = 1
+
+
+def legacy_round_trip(millis, samples):
+    decoded = []
+    for sample_millis, sensor_values in zip(millis, samples):
+        message = {
+            "userid": USER_ID,
+            "millis": sample_millis,
+            "sensor_values": sensor_values,
+            "timestamp": datetime.now().isoformat()
+        }
+        payload = str(message).encode()
+        decoded.append(eval(payload.decode()))
+    return decoded
+
+
+def codec_round_trip(millis, samples, frame_samples):
+    decoded = []
+    now = datetime.now().timestamp()
+    for start in range(0, len(millis), frame_samples):
+        payload = encode_samples(USER_ID, millis[start:start + frame_samples],
+                                 samples[start:start + frame_samples], now)
+        decoded.append(decode_samples(payload))
+    return decoded
+
+
+def main():
+    millis_list = [i * 20 for i in range(NUM_SAMPLES)]
+    samples_list = [[random.uniform(0, 1023) for _ in range(5)] for _ in range(NUM_SAMPLES)]
+    millis = np.array(millis_list, dtype=np.int64)
+    samples = np.array(samples_list, dtype=np.float32)
+
+    legacy_size = len(str({"userid": USER_ID, "millis": millis_list[-1], "sensor_values": samples_list[-1],
+                           "timestamp": datetime.now().isoformat()}).encode())
+    cases = [
+        ("str(dict) + eval, 1 sample/msg", lambda: legacy_round_trip(millis_list, samples_list), legacy_size),
+        ("codec, 1 sample/msg", lambda: codec_round_trip(millis, samples, 1),
+         len(encode_samples(USER_ID, millis[:1], samples[:1], 0.0))),
+        (f"codec, {FRAME_SAMPLES} samples/msg", lambda: codec_round_trip(millis, samples, FRAME_SAMPLES),
+         len(encode_samples(USER_ID, millis[:FRAME_SAMPLES], samples[:FRAME_SAMPLES], 0.0)) / FRAME_SAMPLES),
+    ]
+
+    print(f"Encode + decode of {NUM_SAMPLES} samples (best of 5)")
+    baseline = None
+    for name, func, bytes_per_sample in cases:
+        seconds = min(timeit.repeat(func, number=1, repeat=5))
+        baseline = baseline or seconds
+        print(f"  {name:<32} {seconds * 1e6 / NUM_SAMPLES:8.2f} us/sample  "
+              f"{bytes_per_sample:6.1f} bytes/sample  {baseline / seconds:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import socket
+import struct
+import time
+import random
+import numpy as np
+
+# Reference encoder for the binary multi-sample sensor frame (see udpserver/sensor_frames.py)
+# and a simulator that streams frames to the UDP server.
+DEST_IP = "127.0.0.1"
+DEST_PORT = 8081
+USER_ID = 1
+SAMPLE_RATE = 50  # samples per second
+FRAME_SAMPLES = 10  # samples per datagram
+CHANNEL_MASK = 0b01111  # sensor_a0..sensor_a3, like the Arduino sketch
+
+FRAME_MAGIC = b'\xa5\x5e'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<2sBBIIHBx')
+DTYPE_CODES = {'int16': (0, '<i2'), 'float32': (1, '<f4')}
+
+
+def encode_frame(userid, millis, samples, channel_mask=CHANNEL_MASK, dtype='int16'):
+    """Encode samples[N][channels] taken at millis[N] into one binary frame."""
+    dtype_code, np_dtype = DTYPE_CODES[dtype]
+    millis = np.asarray(millis, dtype=np.int64)
+    samples = np.asarray(samples)
+    num_channels = bin(channel_mask).count('1')
+    if samples.shape != (len(millis), num_channels):
+        raise ValueError(f"Expected samples of shape ({len(millis)}, {num_channels}), got {samples.shape}")
+
+    start_millis = int(millis[0]) & 0xFFFFFFFF
+    offsets = millis - millis[0]
+    if offsets.min() < 0 or offsets.max() > 0xFFFF:
+        raise ValueError("Sample millis must be ascending and span less than 65536 ms")
+
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, dtype_code, userid, start_millis,
+                               len(millis), channel_mask)
+    return header + offsets.astype('<u2').tobytes() + samples.astype(np_dtype).tobytes()
+
+
+def main():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    interval_ms = 1000 // SAMPLE_RATE
+    num_channels = bin(CHANNEL_MASK).count('1')
+    millis = 0
+    frames_sent = 0
+
+    try:
+        while True:
+            frame_millis = [millis + i * interval_ms for i in range(FRAME_SAMPLES)]
+            samples = [[random.randint(0, 1023) for _ in range(num_channels)] for _ in range(FRAME_SAMPLES)]
+            frame = encode_frame(USER_ID, frame_millis, samples)
+            sock.sendto(frame, (DEST_IP, DEST_PORT))
+            frames_sent += 1
+            if frames_sent % SAMPLE_RATE == 0:
+                print(f"Sent {frames_sent} frames ({len(frame)} bytes each, {FRAME_SAMPLES} samples per frame)")
+
+            millis += FRAME_SAMPLES * interval_ms
+            time.sleep(FRAME_SAMPLES / SAMPLE_RATE)
+
+    except KeyboardInterrupt:
+        print("UDP client stopped.")
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+# The services import their sibling modules by name (see ml_model/api.py), and common/ as a package
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'ml_model'))
+sys.path.append(os.path.join(ROOT, 'udpserver'))
+
+
+# One resident model for a user, served without the app's startup tasks (and so
+# without the database). Returns (userid, artifacts).
+@pytest.fixture
+def served_model(monkeypatch):
+    import api
+    from model_cache import ModelCache
+
+    userid, job_id = 5, 50
+    api.torch.manual_seed(0)
+    model = api.EnhancedAudioCNN(num_classes=3)
+    scaler = StandardScaler().fit(np.random.default_rng(0).random((100, 4)) * 1000)
+    mean, scale = api.scaler_params(scaler)
+    info = api.assemble_user_artifacts(job_id, model.state_dict(), {"0": "g0", "1": "g1", "2": "g2"},
+                                       {f"sensor_a{i}": i < 4 for i in range(5)}, mean, scale)
+    monkeypatch.setattr(api, "model_cache", ModelCache())
+    monkeypatch.setattr(api, "latest_job_ids", {userid: job_id})
+    monkeypatch.setattr(api, "job_ids_fetched", threading.Event())
+    api.model_cache.put(userid, info)
+    api.job_ids_fetched.set()
+    return userid, info
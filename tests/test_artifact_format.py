@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import torch
+
+import api
+from artifact_format import (ARTIFACT_PREAMBLE, TENSOR_ALIGNMENT, artifact_path, decode_artifact, encode_artifact,
+                             map_cached_artifact, write_cached_artifact)
+
+
+def model_artifact(job_id=10, userid=1):
+    torch.manual_seed(0)
+    model = api.EnhancedAudioCNN(num_classes=3).eval()
+    metadata = {"architecture": api.MODEL_ARCHITECTURE, "architecture_version": api.MODEL_ARCHITECTURE_VERSION,
+                "job_id": job_id, "userid": userid, "class_mapping": {"0": "g0", "1": "g1", "2": "g2"},
+                "sensors_used": {f"sensor_a{i}": True for i in range(4)},
+                "scaler_params": {"mean": [1.0, 2.0, 3.0, 4.0], "scale": [2.0, 2.0, 2.0, 2.0]}}
+    return model, encode_artifact(model.state_dict(), metadata)
+
+
+def test_round_trip_keeps_values_and_alignment():
+    tensors = {"weight": np.arange(12, dtype=np.float32).reshape(3, 4), "index": np.arange(5, dtype=np.int64),
+               "empty": np.zeros((0, 2), dtype=np.float32)}
+    artifact = encode_artifact(tensors, {"job_id": 3})
+    decoded, metadata = decode_artifact(artifact)
+    assert metadata == {"job_id": 3}
+    for name, array in tensors.items():
+        np.testing.assert_array_equal(decoded[name], array)
+        assert decoded[name].dtype == array.dtype
+    offsets = [array.__array_interface__["data"][0] - np.frombuffer(artifact, np.uint8).ctypes.data
+               for array in decoded.values() if array.size]
+    assert all(offset % TENSOR_ALIGNMENT == 0 for offset in offsets)
+
+
+@pytest.mark.parametrize("corrupt, message", [
+    (lambda artifact: artifact[:8], "too short"),
+    (lambda artifact: b"NOTSEMG\0" + artifact[8:], "Not a model artifact"),
+    (lambda artifact: ARTIFACT_PREAMBLE.pack(b"SEMGART\0", 2, 0) + artifact[16:], "version"),
+    (lambda artifact: artifact[:ARTIFACT_PREAMBLE.size + 4], "truncated"),
+    (lambda artifact: artifact[:-4], "outside the artifact"),
+])
+def test_decode_rejects_damaged_artifacts(corrupt, message):
+    artifact = encode_artifact({"weight": np.ones(16, dtype=np.float32)}, {})
+    with pytest.raises(ValueError, match=message):
+        decode_artifact(corrupt(artifact))
+
+
+def test_flat_artifact_serves_like_the_model():
+    model, artifact = model_artifact()
+    info = api.build_artifacts_from_flat(bytearray(artifact))
+    assert info["job_id"] == 10
+    samples = torch.rand(40, 5) * 10
+    with torch.no_grad():
+        expected = model(api.SensorPreprocessor([1.0, 2.0, 3.0, 4.0], [2.0, 2.0, 2.0, 2.0])(samples))
+        torch.testing.assert_close(info["pipeline"](samples), expected)
+
+
+def test_cached_artifacts(tmp_path):
+    _, artifact = model_artifact()
+    cache_dir = str(tmp_path)
+    assert map_cached_artifact(cache_dir, 1, 10, "5") is None
+
+    old = write_cached_artifact(cache_dir, 1, 9, "4", artifact)
+    other_user = write_cached_artifact(cache_dir, 2, 9, "4", artifact)
+    path = write_cached_artifact(cache_dir, 1, 10, "5", artifact)
+    assert path == artifact_path(cache_dir, 1, 10, "5")
+    assert not os.path.exists(old) and os.path.exists(other_user)
+
+    mapped = map_cached_artifact(cache_dir, 1, 10, "5")
+    tensors, metadata = decode_artifact(mapped)
+    assert metadata["job_id"] == 10
+    tensors["fc2.bias"][:] = 0  # Copy-on-write: the file is not modified
+    assert open(path, "rb").read() == artifact
+
+
+def test_concurrent_cache_writes_leave_one_complete_file(tmp_path):
+    _, artifact = model_artifact()
+    with ThreadPoolExecutor(8) as pool:
+        paths = set(pool.map(lambda _: write_cached_artifact(str(tmp_path), 1, 10, "5", artifact), range(32)))
+    assert len(paths) == 1
+    assert os.listdir(tmp_path) == [os.path.basename(paths.pop())]
+    assert open(artifact_path(str(tmp_path), 1, 10, "5"), "rb").read() == artifact
@@ -0,0 +1,95 @@
+import asyncio
+
+from common.batch_writer import BatchWriter
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def copy_expert(self, sql, buffer):
+        if self.conn.failures:
+            self.conn.failures -= 1
+            raise RuntimeError("connection lost")
+        self.conn.copies.append((sql, buffer.read()))
+
+    def execute(self, sql):
+        self.conn.statements.append(sql)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.copies = []
+        self.statements = []
+        self.closed = 0
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+def test_rows_are_written_as_copy_csv():
+    conn = FakeConnection()
+    writer = BatchWriter("test", lambda: conn, "user_sensor", ["userid", "note", "blob", "value"])
+    asyncio.run(writer.flush([(1, 'say "hi", then go', b"\x00\xff", None), (2, "", bytearray(b"a"), 1.5)]))
+    sql, data = conn.copies[0]
+    assert sql == "COPY user_sensor (userid, note, blob, value) FROM STDIN WITH (FORMAT csv)"
+    assert data == '1,"say ""hi"", then go",\\x00ff,\n2,"",\\x61,1.5\n'
+    assert writer.rows_written == 2 and conn.commits == 1
+
+
+def test_run_batches_queued_rows():
+    conn = FakeConnection()
+
+    async def main():
+        writer = BatchWriter("test", lambda: conn, "t", ["a"], batch_size=3, flush_interval=0.05, max_queue=10)
+        for i in range(7):
+            assert writer.enqueue((i,))
+        task = asyncio.ensure_future(writer.run())
+        await asyncio.sleep(0.2)
+        task.cancel()
+        return writer
+
+    writer = asyncio.run(main())
+    assert [data.count("\n") for _, data in conn.copies] == [3, 3, 1]
+    assert writer.rows_written == 7 and writer.batch_size_max == 3
+
+
+def test_full_queue_drops_rows():
+    async def main():
+        writer = BatchWriter("test", FakeConnection, "t", ["a"], max_queue=2)
+        return [writer.enqueue((i,)) for i in range(3)], writer
+
+    accepted, writer = asyncio.run(main())
+    assert accepted == [True, True, False] and writer.rows_dropped == 1
+
+
+def test_failed_flush_reconnects_and_retries_once():
+    connections = [FakeConnection(failures=1), FakeConnection(failures=1)]
+    writer = BatchWriter("test", lambda: connections.pop(0), "t", ["a"])
+    asyncio.run(writer.flush([(1,)]))
+    assert writer.rows_written == 0 and writer.rows_failed == 1
+    asyncio.run(writer.flush([(2,)]))
+    assert writer.rows_written == 1
+
+
+def test_merge_sql_runs_after_the_staged_copy():
+    conn = FakeConnection()
+    writer = BatchWriter("test", lambda: conn, "rollups", ["a"], merge_sql="INSERT INTO rollups SELECT 1")
+    asyncio.run(writer.flush([(1,)]))
+    assert conn.statements[0].startswith("CREATE TEMP TABLE rollups_staging (LIKE rollups)")
+    assert conn.copies[0][0].startswith("COPY rollups_staging (a)")
+    assert conn.statements[-1] == "INSERT INTO rollups SELECT 1"
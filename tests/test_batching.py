@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import numpy as np
+
+import api
+from stacked_inference import StackedModelEngine
+
+
+def requests(info, row_counts, seed=1):
+    rng = np.random.default_rng(seed)
+    return [(info, (rng.random((rows, 5)) * 1000).tolist(), time.perf_counter()) for rows in row_counts]
+
+
+def test_batched_requests_match_single_requests(served_model):
+    _, info = served_model
+    batch = requests(info, [40, 33, 64])
+    results = api.run_batched_inference(batch)
+    for (model_info, data, submitted), result in zip(batch, results):
+        class_indices, confidences, _, _ = api.run_inference(model_info, data, submitted)
+        assert result[0] == class_indices
+        np.testing.assert_allclose(result[1], confidences, rtol=1e-5)
+
+
+def test_a_bad_request_fails_alone(served_model):
+    _, info = served_model
+    batch = requests(info, [40, 10, 40])
+    results = api.run_batched_inference(batch)
+    assert isinstance(results[1], ValueError)
+    assert len(results[0][0]) == len(results[2][0]) == 40 - 32
+
+
+def test_stacked_batches_match_single_requests(served_model):
+    userid, info = served_model
+    other = api.assemble_user_artifacts(60, api.EnhancedAudioCNN(num_classes=5).state_dict(),
+                                        {str(i): f"g{i}" for i in range(5)}, {}, info["scaler_mean"],
+                                        info["scaler_scale"])
+    user_artifacts = {userid: info, userid + 1: other}
+    engine = StackedModelEngine(min_active=1)
+    engine.update(user_artifacts)
+    batch = requests(info, [34, 40]) + requests(other, [36], seed=2)
+    results = api.run_batched_inference(batch, user_artifacts, engine)
+    for (model_info, data, submitted), result in zip(batch, results):
+        assert result[0] == api.run_inference(model_info, data, submitted)[0]
+
+
+def test_batcher_coalesces_concurrent_requests(served_model, monkeypatch):
+    userid, info = served_model
+    stats = api.InferenceStats()
+    monkeypatch.setattr(api, "inference_stats", stats)
+
+    async def main():
+        batcher = api.InferenceBatcher(max_batch=3, wait_seconds=0.05)
+        futures = [batcher.submit(userid, info, data) for _, data, _ in requests(info, [40, 40, 40, 40, 10])]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert stats.batch_sizes == {3: 1, 2: 1}
+    assert all(len(result[0]) == 8 for result in results[:4])
+    assert isinstance(results[4], ValueError)
@@ -0,0 +1,86 @@
+import numpy as np
+import torch
+
+import api
+from model_cache import ModelCache, artifact_nbytes
+
+
+def info(job_id, nbytes=0):
+    return {"job_id": job_id, "scaler_mean": np.zeros(nbytes // 4, dtype=np.float32)}
+
+
+def test_least_recently_used_models_are_evicted_first():
+    cache = ModelCache(max_models=2)
+    cache.put(1, info(10))
+    cache.put(2, info(20))
+    assert cache.get(1)["job_id"] == 10
+    cache.put(3, info(30))
+    assert sorted(cache.models) == [1, 3]
+    assert cache.get(2) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["loads"]) == (1, 1, 1, 3)
+
+
+def test_byte_budget():
+    cache = ModelCache(max_bytes=1000)
+    cache.put_many({1: info(10, 400), 2: info(20, 400)})
+    cache.put(3, info(30, 400))
+    assert sorted(cache.models) == [2, 3] and cache.bytes == 800
+
+    # The newest model stays even if it alone is over the budget
+    cache.put(4, info(40, 4000))
+    assert list(cache.models) == [4] and cache.bytes == 4000
+
+
+def test_replacing_a_model_updates_its_size():
+    cache = ModelCache()
+    cache.put(1, info(10, 400))
+    cache.put(1, info(11, 800))
+    assert cache.bytes == 800 and cache.get(1)["job_id"] == 11
+
+
+def test_models_dict_is_rebound_not_mutated():
+    cache = ModelCache(max_models=1)
+    cache.put(1, info(10))
+    before = cache.models
+    cache.put(2, info(20))
+    assert list(before) == [1] and list(cache.models) == [2]
+
+
+def test_idle_models_are_evicted(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("model_cache.time.monotonic", lambda: now[0])
+    cache = ModelCache(idle_seconds=60)
+    cache.put(1, info(10))
+    cache.put(2, info(20))
+    now[0] = 150.0
+    cache.get(2)
+    now[0] = 170.0
+    assert cache.evict_idle() == [1]
+    assert list(cache.models) == [2] and cache.stats()["idle_evictions"] == 1
+    assert ModelCache().evict_idle() == []
+
+
+def test_free_slots():
+    assert ModelCache().free_slots() is None
+    cache = ModelCache(max_models=3)
+    cache.put(1, info(10))
+    assert cache.free_slots() == 2
+
+
+def test_artifact_nbytes_counts_models_arrays_and_stacked_copies():
+    model = torch.nn.Linear(4, 2)
+    assert artifact_nbytes({"model": model, "mean": np.zeros(3, dtype=np.float32)}) == (8 + 2) * 4 + 12
+    assert artifact_nbytes({"model": model, "model_bytes": 100}) == 100
+    assert artifact_nbytes({"model": model, "model_bytes": 100, "stacked_bytes": 100}) == 200
+
+
+def test_stacked_weights_count_towards_the_budget(monkeypatch):
+    state_dict = api.EnhancedAudioCNN(num_classes=3).state_dict()
+    args = (10, state_dict, {"0": "a", "1": "b", "2": "c"}, {}, np.zeros(4, np.float32), np.ones(4, np.float32))
+    monkeypatch.setattr(api, "STACKED_INFERENCE_ENABLED", False)
+    unstacked = api.assemble_user_artifacts(*args)
+    monkeypatch.setattr(api, "STACKED_INFERENCE_ENABLED", True)
+    stacked = api.assemble_user_artifacts(*args)
+    assert "stacked_bytes" not in unstacked
+    assert artifact_nbytes(stacked) == artifact_nbytes(unstacked) + stacked["model_bytes"]
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+import api
+from model_cache import ModelCache
+
+
+# A training_job_artifacts table of userid -> latest job_id; loading jobs in `slow` blocks
+# until `release` is set
+class FakeArtifacts:
+    def __init__(self, latest, slow=()):
+        self.latest = dict(latest)
+        self.slow = set(slow)
+        self.loading = threading.Event()
+        self.release = threading.Event()
+        self.fetched = []
+
+    def fetch_latest_job_ids(self, cursor, userids=None):
+        return {userid: job_id for userid, job_id in self.latest.items() if userids is None or userid in userids}
+
+    def fetch_user_artifacts(self, cursor, job_ids):
+        self.fetched.extend(job_ids)
+        if self.slow.intersection(job_ids):
+            self.loading.set()
+            assert self.release.wait(10)
+        return {userid: {"job_id": job_id} for userid, job_id in self.latest.items() if job_id in job_ids}
+
+
+class FakeConnection:
+    def cursor(self):
+        return None
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def artifacts(monkeypatch):
+    fake = FakeArtifacts({1: 10, 2: 20}, slow={10, 20})
+    monkeypatch.setattr(api, "get_db_connection", FakeConnection)
+    monkeypatch.setattr(api, "fetch_latest_job_ids", fake.fetch_latest_job_ids)
+    monkeypatch.setattr(api, "fetch_user_artifacts", fake.fetch_user_artifacts)
+    monkeypatch.setattr(api, "model_cache", ModelCache())
+    monkeypatch.setattr(api, "latest_job_ids", {})
+    monkeypatch.setattr(api, "job_ids_fetched", threading.Event())
+    monkeypatch.setattr(api, "loading_job_ids", set())
+    yield fake
+    fake.release.set()
+
+
+def test_notified_reload_does_not_wait_for_warm_up(artifacts):
+    warm_up = api.model_load_executor.submit(api.load_latest_user_artifacts, None, True)
+    assert artifacts.loading.wait(10)
+    assert api.job_ids_fetched.is_set()
+
+    # A new user's model is announced while the warm-up load is still running
+    artifacts.latest[3] = 30
+    notified = api.inference_executor.submit(api.load_latest_user_artifacts, [3])
+    assert notified.result(timeout=5) == [3]
+    assert api.model_cache.get(3) == {"job_id": 30}
+
+    # A poll in the meantime does not load the warm-up's jobs a second time
+    polled = api.inference_executor.submit(api.load_latest_user_artifacts)
+    assert polled.result(timeout=5) == []
+
+    artifacts.release.set()
+    assert sorted(warm_up.result(timeout=10)) == [1, 2]
+    assert sorted(artifacts.fetched) == [10, 20, 30]
+    assert api.loading_job_ids == set()
+
+
+def test_older_load_does_not_replace_a_newer_model(artifacts):
+    artifacts.slow.clear()
+    api.model_cache.put(1, {"job_id": 11})
+    api.model_cache.put_many({1: {"job_id": 10}})
+    assert api.model_cache.get(1) == {"job_id": 11}
@@ -0,0 +1,46 @@
+import warnings
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from common.predict_codec import BINARY_CONTENT_TYPE, decode_predict_response, encode_predict_request
+
+
+@pytest.fixture
+def client(served_model):
+    return TestClient(api.app)
+
+
+def samples(rows=40):
+    return (np.random.default_rng(1).random((rows, 5)) * 1000).astype(np.float32)
+
+
+def test_binary_request_matches_json(client, served_model):
+    userid, info = served_model
+    data = samples()
+    expected = client.post("/predict", json={"userid": userid, "data": data.tolist()})
+    assert expected.status_code == 200
+
+    with warnings.catch_warnings():
+        # Wrapping the read-only request body in a tensor used to warn here
+        warnings.simplefilter("error")
+        response = client.post("/predict", content=encode_predict_request(userid, data),
+                               headers={"content-type": BINARY_CONTENT_TYPE, "accept": BINARY_CONTENT_TYPE})
+    assert response.status_code == 200
+    decoded = decode_predict_response(response.content)
+    assert decoded["job_id"] == info["job_id"]
+    assert decoded["class_indices"] == expected.json()["class_indices"]
+    np.testing.assert_allclose(decoded["confidences"], expected.json()["confidences"], rtol=1e-6)
+
+
+def test_binary_request_errors(client, served_model):
+    userid, _ = served_model
+    headers = {"content-type": BINARY_CONTENT_TYPE}
+    assert client.post("/predict", content=b"\x00" * 4, headers=headers).status_code == 400
+    short = client.post("/predict", content=encode_predict_request(userid, samples(10)), headers=headers)
+    assert short.status_code == 400
+    assert "samples" in short.json()["detail"]
+    missing = client.post("/predict", content=encode_predict_request(userid + 1, samples()), headers=headers)
+    assert missing.status_code == 404
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from common.predict_codec import (REQUEST_HEADER, decode_predict_request, decode_predict_response,
+                                  encode_predict_request, encode_predict_response)
+
+
+def test_request_round_trip():
+    samples = np.random.default_rng(0).normal(size=(40, 5)).astype(np.float32)
+    userid, decoded = decode_predict_request(encode_predict_request(7, samples))
+    assert userid == 7
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, samples)
+
+
+def test_request_int16_samples():
+    samples = np.arange(12, dtype='<i2').reshape(4, 3)
+    body = REQUEST_HEADER.pack(0xC7, 1, 0, 3, 4, 3) + samples.tobytes()
+    userid, decoded = decode_predict_request(body)
+    assert userid == 3
+    np.testing.assert_array_equal(decoded, samples)
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"\xc7\x01", "too short"),
+    (REQUEST_HEADER.pack(0xC8, 1, 1, 1, 0, 0), "Not a binary predict request"),
+    (REQUEST_HEADER.pack(0xC7, 2, 1, 1, 0, 0), "version"),
+    (REQUEST_HEADER.pack(0xC7, 1, 9, 1, 0, 0), "dtype"),
+    (REQUEST_HEADER.pack(0xC7, 1, 1, 1, 2, 2) + bytes(12), "does not match header"),
+])
+def test_request_rejects_malformed_bodies(body, message):
+    with pytest.raises(ValueError, match=message):
+        decode_predict_request(body)
+
+
+def test_response_round_trip():
+    body = encode_predict_response([0, 2, 1], [0.5, 0.25, 1.0], 42)
+    assert decode_predict_response(body) == {"class_indices": [0, 2, 1], "confidences": [0.5, 0.25, 1.0], "job_id": 42}
+    with pytest.raises(ValueError, match="does not match header"):
+        decode_predict_response(body[:-1])
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import torch
+from sklearn.preprocessing import StandardScaler
+
+import api
+
+
+@pytest.fixture
+def scaler():
+    return StandardScaler().fit(np.random.default_rng(0).random((200, 4)) * 1000)
+
+
+# The per-window loop /predict used before SensorPreprocessor
+def reference_inputs(data, scaler, num_channels=4):
+    scaled = scaler.transform(np.asarray(data)[:, :num_channels])
+    sequences = [scaled[row - 32:row].T.flatten() for row in range(32, scaled.shape[0])]
+    return torch.tensor(np.array(sequences), dtype=torch.float32).unsqueeze(1)
+
+
+def test_matches_the_scaler_and_window_loop(scaler):
+    data = np.random.default_rng(1).random((50, 5)) * 1000
+    preprocessor = api.SensorPreprocessor(*api.scaler_params(scaler))
+    inputs = api.preprocess(data.tolist(), preprocessor)
+    assert inputs.shape == (50 - 32, 1, 4 * 32)
+    torch.testing.assert_close(inputs, reference_inputs(data, scaler), rtol=1e-5, atol=1e-5)
+
+
+def test_scripted_preprocessor_and_pipeline(scaler):
+    preprocessor = api.SensorPreprocessor(*api.scaler_params(scaler))
+    model = api.EnhancedAudioCNN(num_classes=3).eval()
+    samples = torch.rand(40, 5) * 1000
+    pipeline = torch.nn.Sequential(preprocessor, model)
+    scripted = torch.jit.script(pipeline)
+    with torch.no_grad():
+        torch.testing.assert_close(scripted(samples), model(reference_inputs(samples.numpy(), scaler)),
+                                   rtol=1e-4, atol=1e-5)
+
+
+def test_selected_channels(scaler):
+    preprocessor = api.SensorPreprocessor(*api.scaler_params(scaler), channels=[4, 3, 2, 1])
+    samples = torch.rand(40, 5) * 1000
+    expected = api.SensorPreprocessor(*api.scaler_params(scaler))(samples.flip(1)[:, :4])
+    torch.testing.assert_close(preprocessor(samples), expected)
+
+
+@pytest.mark.parametrize("options", [{}, {"with_mean": False}, {"with_std": False}])
+def test_scaler_params_reproduce_transform(options):
+    data = np.random.default_rng(0).random((20, 3)) * 100
+    scaler = StandardScaler(**options).fit(data)
+    mean, scale = api.scaler_params(scaler)
+    assert mean.dtype == scale.dtype == np.float32
+    np.testing.assert_allclose((data - mean) / scale, scaler.transform(data), rtol=1e-5)
+
+
+@pytest.mark.parametrize("data, message", [
+    (np.zeros((40, 3)), "at least 4 sensor values"),
+    (np.zeros(40), "at least 4 sensor values"),
+    (np.zeros((32, 5)), "more than 32 samples"),
+])
+def test_request_samples_rejects_short_requests(scaler, data, message):
+    preprocessor = api.SensorPreprocessor(*api.scaler_params(scaler))
+    with pytest.raises(ValueError, match=message):
+        api.request_samples(data.tolist(), preprocessor)
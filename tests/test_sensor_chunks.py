@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from common.sensor_chunks import CHUNK_COLUMNS, SensorChunkBuilder, read_sensor_chunks
+
+RECEIVED = datetime(2024, 5, 1, 12, 0, 0)
+
+
+def frame(first_millis, count, step=1):
+    millis = np.arange(first_millis, first_millis + count * step, step, dtype=np.int64)
+    samples = np.arange(count * 5, dtype=np.float32).reshape(count, 5) + first_millis
+    return millis, samples
+
+
+def as_dict(row):
+    return dict(zip(CHUNK_COLUMNS, row))
+
+
+def test_chunks_close_at_chunk_millis():
+    builder = SensorChunkBuilder(chunk_millis=100)
+    millis, samples = frame(0, 250)
+    rows = [as_dict(row) for row in builder.add(1, millis, samples, RECEIVED)]
+    assert [(row["millis_base"], row["sample_count"]) for row in rows] == [(0, 100), (100, 100)]
+    offsets = np.frombuffer(rows[1]["millis_offsets"], dtype='<i4')
+    np.testing.assert_array_equal(offsets, np.arange(100))
+    np.testing.assert_array_equal(np.frombuffer(rows[1]["sensor_a2"], dtype='<f4'), samples[100:200, 2])
+    assert [as_dict(row)["sample_count"] for row in builder.flush_all()] == [50]
+
+
+def test_chunks_close_when_the_clock_goes_backwards():
+    builder = SensorChunkBuilder(chunk_millis=1000)
+    builder.add(1, *frame(500, 10), RECEIVED)
+    rows = builder.add(1, *frame(0, 10), RECEIVED)
+    assert [as_dict(row)["millis_base"] for row in rows] == [500]
+    assert as_dict(builder.flush_all()[0])["millis_base"] == 0
+
+
+def test_chunks_close_at_max_samples():
+    # 2 kHz over a 60 s CHUNK_MILLIS would be 120,000 samples, past sample_count's old int2 range
+    builder = SensorChunkBuilder(chunk_millis=60000, max_samples=32767)
+    counts = []
+    for first in range(0, 80000, 1000):
+        millis = np.arange(first, first + 1000, dtype=np.int64) // 2
+        counts += [as_dict(row)["sample_count"] for row in builder.add(1, millis, np.zeros((1000, 5), np.float32),
+                                                                     RECEIVED)]
+    counts += [as_dict(row)["sample_count"] for row in builder.flush_all()]
+    assert counts == [32767, 32767, 80000 - 2 * 32767]
+
+
+def test_idle_chunks_are_flushed():
+    builder = SensorChunkBuilder(idle_seconds=0)
+    builder.add(1, *frame(0, 5), RECEIVED)
+    builder.add(2, *frame(0, 5), RECEIVED)
+    assert sorted(as_dict(row)["userid"] for row in builder.flush_idle()) == [1, 2]
+    assert builder.flush_all() == []
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params):
+        self.params = params
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+
+def test_read_sensor_chunks_trims_to_the_range():
+    builder = SensorChunkBuilder(chunk_millis=100)
+    millis, samples = frame(0, 300)
+    rows = builder.add(1, millis, samples, RECEIVED) + builder.flush_all()
+    stored = [(row["millis_base"], datetime.fromisoformat(row["ts_start"]), row["millis_offsets"],
+               *(row[f"sensor_a{c}"] for c in range(5))) for row in map(as_dict, rows)]
+
+    first_ts = RECEIVED - timedelta(milliseconds=299)
+    block = read_sensor_chunks(FakeConnection(stored), 1, first_ts + timedelta(milliseconds=50),
+                               first_ts + timedelta(milliseconds=149))
+    np.testing.assert_array_equal(block.millis, np.arange(50, 150))
+    np.testing.assert_array_equal(block.samples, samples[50:150])
+    assert block.ts[0] == np.datetime64(first_ts + timedelta(milliseconds=50), 'us')
+
+
+def test_read_sensor_chunks_empty():
+    block = read_sensor_chunks(FakeConnection([]), 1, RECEIVED, RECEIVED)
+    assert block.millis.shape == (0,) and block.samples.shape == (0, 5)
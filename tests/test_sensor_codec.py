@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from common.sensor_codec import (HEADER, decode_legacy_message, decode_samples, encode_samples,
+                                 is_legacy_message)
+
+
+def test_round_trip():
+    millis = np.arange(1000, 1010, dtype=np.int64)
+    samples = np.random.default_rng(0).normal(size=(10, 5)).astype(np.float32)
+    payload = encode_samples(7, millis, samples, 1714561200.25)
+    assert not is_legacy_message(payload)
+
+    batch = decode_samples(payload)
+    assert batch.userid == 7 and batch.timestamp == 1714561200.25
+    np.testing.assert_array_equal(batch.millis, millis)
+    np.testing.assert_array_equal(batch.samples, samples)
+
+
+def test_encode_rejects_mismatched_shapes():
+    with pytest.raises(ValueError, match="Expected samples"):
+        encode_samples(1, np.arange(3), np.zeros((4, 5)), 0.0)
+
+
+@pytest.mark.parametrize("payload, message", [
+    (b"\xc5\x01", "too short"),
+    (HEADER.pack(0xC6, 1, 5, 0, 1, 0.0), "Not a sensor codec message"),
+    (HEADER.pack(0xC5, 2, 5, 0, 1, 0.0), "version"),
+    (HEADER.pack(0xC5, 1, 5, 2, 1, 0.0) + bytes(8), "does not match header"),
+])
+def test_decode_rejects_malformed_messages(payload, message):
+    with pytest.raises(ValueError, match=message):
+        decode_samples(payload)
+
+
+def test_legacy_messages_are_parsed_without_eval():
+    payload = str({"userid": 3, "millis": 42, "sensor_values": [1, 2, 3, 4, 5]}).encode()
+    assert is_legacy_message(payload)
+    batch = decode_legacy_message(payload)
+    assert batch.userid == 3 and batch.timestamp is None
+    np.testing.assert_array_equal(batch.millis, [42])
+    np.testing.assert_array_equal(batch.samples, [[1, 2, 3, 4, 5]])
+
+    with pytest.raises(ValueError):
+        decode_legacy_message(b"{'userid': __import__('os').getpid()}")
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from sensor_frames import FRAME_HEADER, decode_frame, is_binary_frame, mask_channels, peek_userid
+
+
+def frame(userid, start_millis, offsets, samples, channel_mask, dtype_code=0, dtype='<i2'):
+    header = FRAME_HEADER.pack(b'\xa5\x5e', 1, dtype_code, userid, start_millis, len(offsets), channel_mask)
+    return header + np.asarray(offsets, dtype='<u2').tobytes() + np.asarray(samples, dtype=dtype).tobytes()
+
+
+def test_decode_fills_missing_channels_with_zeros():
+    data = frame(9, 5000, [0, 2, 4], [[1, 2, 3], [4, 5, 6], [7, 8, 9]], 0b10101)
+    assert is_binary_frame(data) and peek_userid(data) == 9
+
+    userid, millis, samples = decode_frame(data)
+    assert userid == 9
+    np.testing.assert_array_equal(millis, [5000, 5002, 5004])
+    np.testing.assert_array_equal(samples, [[1, 0, 2, 0, 3], [4, 0, 5, 0, 6], [7, 0, 8, 0, 9]])
+    assert samples.dtype == np.float32
+
+
+def test_decode_float32_frames():
+    values = np.random.default_rng(0).normal(size=(4, 5)).astype(np.float32)
+    _, _, samples = decode_frame(frame(1, 0, range(4), values, 0b11111, 1, '<f4'))
+    np.testing.assert_array_equal(samples, values)
+
+
+def test_mask_channels():
+    assert mask_channels(0b11111) == [0, 1, 2, 3, 4]
+    assert mask_channels(0b00110) == [1, 2]
+
+
+def test_peek_userid_of_csv_datagrams():
+    assert peek_userid(b"12,1000,1,2,3,4,5") == 12
+    with pytest.raises(ValueError):
+        peek_userid(b",1000")
+
+
+@pytest.mark.parametrize("data, message", [
+    (b"\xa5\x5e\x01", "too short"),
+    (FRAME_HEADER.pack(b'\xa5\x5e', 2, 0, 1, 0, 0, 1), "version"),
+    (FRAME_HEADER.pack(b'\xa5\x5e', 1, 7, 1, 0, 0, 1), "dtype"),
+    (FRAME_HEADER.pack(b'\xa5\x5e', 1, 0, 1, 0, 2, 1) + bytes(5), "does not match header"),
+])
+def test_decode_rejects_malformed_frames(data, message):
+    with pytest.raises(ValueError, match=message):
+        decode_frame(data)
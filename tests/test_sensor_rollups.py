@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from common.sensor_rollups import ROLLUP_COLUMNS, SensorRollupBuilder, choose_resolution
+
+
+def rows_by_key(rows):
+    return {(row[1], row[2]): dict(zip(ROLLUP_COLUMNS, row)) for row in rows}
+
+
+def test_partial_buckets_merge_until_flushed():
+    builder = SensorRollupBuilder(resolutions=(100, 1000))
+    samples = np.arange(20, dtype=np.float32).reshape(4, 5)
+    builder.add(1, np.array([1000, 1050, 1100, 1999]), samples[:4])
+    builder.add(1, np.array([1150]), -samples[3:4])
+    rows = rows_by_key(builder.flush())
+    assert builder.flush() == []
+
+    second = rows[(1000, "1970-01-01T00:00:01+00:00")]
+    assert second["sample_count"] == 5
+    assert second["sensor_a0_min"] == -15 and second["sensor_a0_max"] == 15
+    assert second["sensor_a4_sum"] == samples[:, 4].sum() - 19
+
+    buckets = {bucket: row["sample_count"] for (resolution, bucket), row in rows.items() if resolution == 100}
+    assert buckets == {"1970-01-01T00:00:01+00:00": 2, "1970-01-01T00:00:01.100000+00:00": 2,
+                       "1970-01-01T00:00:01.900000+00:00": 1}
+
+
+def test_choose_resolution():
+    start = datetime(2024, 5, 1)
+    assert choose_resolution(start, start + timedelta(seconds=10), 800) is None  # 500 raw samples
+    assert choose_resolution(start, start + timedelta(seconds=60), 800) == 100
+    assert choose_resolution(start, start + timedelta(minutes=10), 800) == 1000
+    assert choose_resolution(start, start + timedelta(hours=10), 800) == 60000
+    assert choose_resolution(start, start + timedelta(days=365), 800) == 60000
+    assert choose_resolution(start, start, 800) is None
@@ -0,0 +1,64 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from serving_formats import ServingFormatSelector, parity_ok, parity_stats, parity_windows
+
+
+def model():
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Flatten(), nn.Linear(128, 3)).eval()
+
+
+# Eager model whose prediction is moved to another class on the first `flipped` windows
+class Flipped(nn.Module):
+    def __init__(self, reference, flipped):
+        super().__init__()
+        self.reference = reference
+        self.flipped = flipped
+
+    def forward(self, x):
+        logits = self.reference(x).clone()
+        logits[:self.flipped, 0] = logits[:self.flipped].max(1).values + 1
+        logits[:self.flipped, 1] = logits[:self.flipped, 0] + 1
+        return logits
+
+
+def test_parity_windows_are_deterministic_and_varied():
+    windows = parity_windows(1000, 128, torch.Generator().manual_seed(0))
+    assert windows.shape == (1000, 1, 128)
+    assert torch.equal(windows, parity_windows(1000, 128, torch.Generator().manual_seed(0)))
+    scales = windows.std(2).flatten()
+    assert scales.min() < 0.3 and scales.max() > 5
+    assert torch.isfinite(windows).all()
+
+
+def test_parity_stats_measure_class_agreement():
+    reference = model()
+    inputs = parity_windows(100, 128, torch.Generator().manual_seed(0))
+    assert parity_stats(reference, reference, inputs) == (1.0, 0.0)
+    agreement, _ = parity_stats(reference, Flipped(reference, 5), inputs)
+    assert agreement == pytest.approx(0.95)
+    assert parity_ok(reference, reference, inputs)
+    assert not parity_ok(reference, Flipped(reference, 1), inputs, tolerance=1.0, min_agreement=1.0)
+    assert parity_ok(reference, Flipped(reference, 1), inputs, tolerance=1.0, min_agreement=0.99)
+
+
+def test_selector_serves_eager_when_agreement_is_too_low(monkeypatch, capsys):
+    selector = ServingFormatSelector("torchscript")
+    reference = model()
+    monkeypatch.setattr("serving_formats.build_variant",
+                        lambda m, name, length: (m if name == "eager" else Flipped(m, 2), 0))
+    module, name, _ = selector.convert(reference)
+    assert name == "eager" and module is reference
+    assert "Serving format torchscript rejected" in capsys.readouterr().out
+    parity = selector.stats()["parity"]["torchscript"]
+    assert parity["checked"] == parity["rejected"] == 1
+    assert parity["min_agreement"] == pytest.approx(1 - 2 / len(selector.parity_inputs))
+
+
+def test_selector_accepts_matching_torchscript():
+    selector = ServingFormatSelector("torchscript")
+    _, name, _ = selector.convert(model())
+    assert name == "torchscript"
+    assert selector.stats()["parity"]["torchscript"]["min_agreement"] == 1.0
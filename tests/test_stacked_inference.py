@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+import pytest
+import torch
+
+import api
+import stacked_inference
+from stacked_inference import PAD_LOGIT, StackedModelEngine, stacked_forward
+
+
+def artifacts(job_id, num_classes):
+    torch.manual_seed(job_id)
+    model = api.EnhancedAudioCNN(num_classes).eval()
+    return api.assemble_user_artifacts(job_id, model.state_dict(), {str(i): f"g{i}" for i in range(num_classes)},
+                                       {}, np.zeros(4, np.float32), np.ones(4, np.float32))
+
+
+# A model the stacked forward does not reproduce
+class ShiftedCNN(api.EnhancedAudioCNN):
+    def forward(self, x):
+        return super().forward(x) + 1
+
+
+@pytest.fixture
+def user_artifacts():
+    return {userid: artifacts(100 + userid, 3 + userid % 3) for userid in range(20)}
+
+
+def expected_logits(info, x):
+    with torch.no_grad():
+        return info["model"](x)
+
+
+def test_stacked_forward_matches_each_model():
+    models = [api.EnhancedAudioCNN(num_classes).eval() for num_classes in (3, 5)]
+    engine = StackedModelEngine()
+    params = engine._stack(models, 5)
+    x = torch.randn(2, 6, 1, 128)
+    with torch.no_grad():
+        logits = stacked_forward(params, x)
+        torch.testing.assert_close(logits[0, :, :3], models[0](x[0]), atol=1e-4, rtol=1e-4)
+        torch.testing.assert_close(logits[1], models[1](x[1]), atol=1e-4, rtol=1e-4)
+    assert (logits[0, :, 3:] < PAD_LOGIT / 2).all()
+
+
+def test_engine_matches_the_per_model_loop(user_artifacts, monkeypatch):
+    stacked_blocks = []
+    forward_block = stacked_inference._StackedGroup.forward_block
+    monkeypatch.setattr(stacked_inference._StackedGroup, "forward_block",
+                        lambda group, block, inputs: stacked_blocks.append(len(inputs)) or forward_block(group, block, inputs))
+
+    engine = StackedModelEngine(block_size=8, max_windows=8, min_active=4)
+    engine.update(user_artifacts)
+    generator = torch.Generator().manual_seed(0)
+    # Users 0-7 fill a block; 8-9 are too few to stack; user 2 sends two requests and
+    # user 3 one too large to stack
+    requests = [(user_artifacts[userid], torch.randn(windows, 1, 128, generator=generator))
+                for userid, windows in [(0, 2), (1, 1), (2, 3), (2, 2), (3, 20), (4, 4), (5, 1), (6, 8), (7, 2),
+                                        (8, 2), (9, 1)]]
+    with torch.no_grad():
+        outputs = engine.forward(user_artifacts, requests)
+
+    assert stacked_blocks == [7]
+    for (info, x), output in zip(requests, outputs):
+        expected = expected_logits(info, x)
+        assert output.shape[0] == len(x)
+        torch.testing.assert_close(output[:, :expected.shape[1]], expected, atol=1e-4, rtol=1e-4)
+        assert torch.equal(output.argmax(1), expected.argmax(1))
+
+
+def test_models_failing_parity_run_unstacked(user_artifacts):
+    torch.manual_seed(0)
+    shifted = dict(artifacts(999, 3), model=ShiftedCNN(3).eval())
+    user_artifacts = {**user_artifacts, 99: shifted}
+    engine = StackedModelEngine(min_active=1)
+    engine.update(user_artifacts)
+    assert engine.unstacked == {999}
+    x = torch.randn(2, 1, 128)
+    with torch.no_grad():
+        output, = engine.forward(user_artifacts, [(shifted, x)])
+    torch.testing.assert_close(output, expected_logits(shifted, x))
+
+
+def test_updates_follow_loads_and_evictions(user_artifacts):
+    engine = StackedModelEngine()
+    engine.update(user_artifacts)
+    assert set(engine.groups) == {info["job_id"] for info in user_artifacts.values()}
+
+    reloaded = dict(user_artifacts)
+    del reloaded[0]
+    reloaded[1] = artifacts(201, 3)
+    engine.update(reloaded)
+    assert set(engine.groups) == {info["job_id"] for info in reloaded.values()}
+    assert 100 not in engine.groups and 101 not in engine.groups
+
+
+def test_new_artifacts_are_stacked_in_the_background(user_artifacts):
+    engine = StackedModelEngine(rebuild_interval=0)
+    assert engine.groups_for(user_artifacts) == {}  # Served per model until the first build
+    deadline = time.monotonic() + 10
+    while engine.built is not user_artifacts and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert engine.built is user_artifacts
+    assert len(engine.groups_for(user_artifacts)) == len(user_artifacts)
+    while engine.rebuilding and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not engine.rebuilding
@@ -0,0 +1,64 @@
+import numpy as np
+import torch
+from fastapi.testclient import TestClient
+
+import api
+
+
+def frames(sizes, seed=1):
+    data = (np.random.default_rng(seed).random((sum(sizes), 5)) * 1000).astype(np.float32)
+    return data, np.split(data, np.cumsum(sizes)[:-1])
+
+
+def test_stream_state_windows_match_the_whole_sequence(served_model):
+    _, info = served_model
+    data, parts = frames([10, 30, 1, 25])
+    state = api.StreamState()
+    pushed = [state.push(info, part) for part in parts]
+    assert pushed[0] is None
+    windows = torch.cat([inputs for inputs in pushed if inputs is not None])
+    preprocessor = info["preprocessor"]
+    expected = preprocessor.windows(preprocessor.standardize(torch.from_numpy(data)))
+    assert windows.shape == expected.shape == (len(data) - 31, 1, 4 * 32)
+    torch.testing.assert_close(windows, expected)
+
+
+def test_new_model_restandardizes_the_carried_samples(served_model):
+    _, info = served_model
+    data, parts = frames([40, 5])
+    state = api.StreamState()
+    state.push(info, parts[0])
+    rescaled = dict(info, job_id=info["job_id"] + 1,
+                    preprocessor=api.SensorPreprocessor(np.zeros(4, np.float32), np.full(4, 100, np.float32)))
+    expected = rescaled["preprocessor"].windows(rescaled["preprocessor"].standardize(torch.from_numpy(data)))
+    torch.testing.assert_close(state.push(rescaled, parts[1]), expected[-5:])
+
+
+def test_stream_endpoint_matches_predict(served_model):
+    userid, _ = served_model
+    data, parts = frames([20, 33, 7])
+    client = TestClient(api.app)
+    expected = client.post("/predict", json={"userid": userid, "data": data.tolist()}).json()
+
+    replies = []
+    with client.websocket_connect(f"/stream/{userid}") as websocket:
+        websocket.send_bytes(parts[0][:, :4].tobytes())
+        websocket.send_text('{"data": %s}' % parts[1].tolist())
+        replies.append(websocket.receive_json())
+        websocket.send_bytes(parts[2][:, :4].tobytes())
+        replies.append(websocket.receive_json())
+        websocket.send_bytes(b"\x00" * 6)
+        assert "Malformed frame" in websocket.receive_json()["error"]
+
+    assert [reply["first_window_end"] for reply in replies] == [31, 53]
+    class_indices = [index for reply in replies for index in reply["class_indices"]]
+    # /predict leaves out the last full window, the stream scores every window
+    assert class_indices[:-1] == expected["class_indices"]
+    assert len(class_indices) == len(data) - 31
+
+
+def test_stream_for_unknown_user(served_model):
+    userid, _ = served_model
+    with TestClient(api.app).websocket_connect(f"/stream/{userid + 1}") as websocket:
+        websocket.send_text('{"data": []}')
+        assert websocket.receive_json() == {"error": "No model found for the given user."}
@@ -0,0 +1,71 @@
+import struct
+import numpy as np
+
+# Binary multi-sample sensor frame (version 1), all fields little-endian:
+#
+#   offset  size  field
+#   0       2     magic 0xA5 0x5E (never a valid first byte of the CSV format)
+#   2       1     version
+#   3       1     sample dtype code (0 = int16, 1 = float32)
+#   4       4     userid (uint32)
+#   8       4     start millis (uint32, device millis() of the first sample)
+#   12      2     sample count N (uint16)
+#   14      1     channel mask (bit i set = sensor_a<i> present)
+#   15      1     reserved (0)
+#   16      2*N   per-sample millis offsets from start millis (uint16)
+#   16+2N   ...   N * popcount(mask) samples, sample-major, channels in ascending bit order
+FRAME_MAGIC = b'\xa5\x5e'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<2sBBIIHBx')
+FRAME_DTYPES = {0: np.dtype('<i2'), 1: np.dtype('<f4')}
+NUM_SENSORS = 5
+
+
+def is_binary_frame(data):
+    return data[:2] == FRAME_MAGIC
+
+
+# Extract the userid from a binary frame or CSV datagram without decoding the samples
+def peek_userid(data):
+    if is_binary_frame(data):
+        if len(data) < FRAME_HEADER.size:
+            raise ValueError(f"Frame too short: {len(data)} bytes")
+        return struct.unpack_from('<I', data, 4)[0]
+    comma = data.find(b',')
+    if comma <= 0:
+        raise ValueError("Malformed CSV datagram")
+    return int(data[:comma])
+
+
+# Channel indices selected by a channel mask, in ascending order
+def mask_channels(channel_mask):
+    return [i for i in range(NUM_SENSORS) if channel_mask & (1 << i)]
+
+
+# Decode a binary frame into (userid, millis[N] int64, samples[N, 5] float32).
+# Channels missing from the mask are zero-filled, matching the CSV path.
+def decode_frame(data):
+    if len(data) < FRAME_HEADER.size:
+        raise ValueError(f"Frame too short: {len(data)} bytes")
+    magic, version, dtype_code, userid, start_millis, count, channel_mask = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not a binary sensor frame")
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    if dtype_code not in FRAME_DTYPES:
+        raise ValueError(f"Unsupported sample dtype code {dtype_code}")
+
+    dtype = FRAME_DTYPES[dtype_code]
+    channels = mask_channels(channel_mask)
+    samples_offset = FRAME_HEADER.size + 2 * count
+    expected = samples_offset + count * len(channels) * dtype.itemsize
+    if len(data) != expected:
+        raise ValueError(f"Frame length {len(data)} does not match header (expected {expected})")
+
+    offsets = np.frombuffer(data, dtype='<u2', count=count, offset=FRAME_HEADER.size)
+    millis = offsets.astype(np.int64) + start_millis
+    packed = np.frombuffer(data, dtype=dtype, count=count * len(channels), offset=samples_offset)
+
+    samples = np.zeros((count, NUM_SENSORS), dtype=np.float32)
+    samples[:, channels] = packed.reshape(count, len(channels))
+    return userid, millis, samples
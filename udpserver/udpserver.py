@@ -1,15 +1,63 @@
 import asyncio
+import multiprocessing
+import signal
 import socket
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 import sys
+import numpy as np
 import psycopg2
 from nats.aio.client import Client as NATS
 import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.batch_writer import BatchWriter
+from common.sensor_codec import encode_samples
+from common.sensor_chunks import CHUNK_COLUMNS, SensorChunkBuilder
+from common.sensor_rollups import ROLLUP_COLUMNS, ROLLUP_MERGE_SQL, SensorRollupBuilder
+from sensor_frames import NUM_SENSORS, is_binary_frame, decode_frame, peek_userid
+
 # Initialize NATS client
 NATS_SERVER = os.environ['NATS_SERVER']
 NATS_USER = os.environ['NATS_USER']
 NATS_PASSWORD = os.environ['NATS_PASSWORD']
 NATS_TOPIC = os.environ['NATS_TOPIC']
+
+# UDP ingest tuning
+UDP_PORT = int(os.environ.get('UDP_PORT', 8081))
+UDP_MAX_DATAGRAM = 65535
+UDP_DRAIN_LIMIT = int(os.environ.get('UDP_DRAIN_LIMIT', 1024))  # Max extra datagrams read per readiness event
+UDP_RCVBUF_BYTES = int(os.environ.get('UDP_RCVBUF_BYTES', 4 * 1024 * 1024))
+UDP_STATS_INTERVAL = float(os.environ.get('UDP_STATS_INTERVAL', 10))
+
+# Multi-process ingest: UDP_WORKERS > 1 forks that many workers sharing UDP_PORT via
+# SO_REUSEPORT. Users are sharded by userid; worker i also listens on
+# UDP_HANDOFF_HOST:UDP_HANDOFF_BASE_PORT + i for datagrams forwarded by its siblings.
+UDP_WORKERS = int(os.environ.get('UDP_WORKERS', 1))
+UDP_HANDOFF_HOST = '127.0.0.1'
+UDP_HANDOFF_BASE_PORT = int(os.environ.get('UDP_HANDOFF_BASE_PORT', 18100))
+
+# Batched user_sensor writer: flush when WRITER_BATCH_SIZE rows are pending or
+# WRITER_FLUSH_INTERVAL seconds after the first pending row, whichever comes first
+WRITER_BATCH_SIZE = int(os.environ.get('WRITER_BATCH_SIZE', 500))
+WRITER_FLUSH_INTERVAL = float(os.environ.get('WRITER_FLUSH_INTERVAL', 0.25))
+WRITER_MAX_QUEUE = int(os.environ.get('WRITER_MAX_QUEUE', 50000))
+
+# Columnar user_sensor_chunks: each user's samples are also grouped into blocks of
+# CHUNK_MILLIS device time (closed early after CHUNK_IDLE_SECONDS without samples)
+WRITE_SENSOR_CHUNKS = os.environ.get('WRITE_SENSOR_CHUNKS', '1') == '1'
+CHUNK_MILLIS = int(os.environ.get('CHUNK_MILLIS', 1000))
+CHUNK_IDLE_SECONDS = float(os.environ.get('CHUNK_IDLE_SECONDS', 2.0))
+
+# user_sensor_rollups: per-channel min/max/mean at 100 ms, 1 s and 1 min, with open
+# buckets merged into the table every ROLLUP_FLUSH_INTERVAL seconds
+WRITE_SENSOR_ROLLUPS = os.environ.get('WRITE_SENSOR_ROLLUPS', '1') == '1'
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get('ROLLUP_FLUSH_INTERVAL', 1.0))
+
+# user_sensor is partitioned by day; keep this many days of partitions created ahead
+PARTITION_DAYS_AHEAD = int(os.environ.get('PARTITION_DAYS_AHEAD', 7))
+PARTITION_CHECK_INTERVAL = 3600
+
 async def initialize_nats():
     nc = NATS()
     await nc.connect(
@@ -29,49 +77,105 @@ def initialize_db():
     )
     return conn
 
-# Store sensor data in the PostgreSQL database
-def store_data(conn, userid, millis, sensor_values, ts):
-    cursor = conn.cursor()
+# Create the daily user_sensor partitions from yesterday through PARTITION_DAYS_AHEAD days ahead
+def ensure_user_sensor_partitions():
+    conn = initialize_db()
     try:
-        # Ensure sensor_values list has 5 elements, filling missing values with 0
-        sensor_values += [0] * (5 - len(sensor_values))
-        
-        cursor.execute('''
-            INSERT INTO user_sensor (userid, millis, sensor_a0, sensor_a1, sensor_a2, sensor_a3, sensor_a4, ts)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (userid, millis, *sensor_values, ts))
+        cursor = conn.cursor()
+        cursor.execute("SELECT create_user_sensor_partitions(CURRENT_DATE - 1, %s)", (PARTITION_DAYS_AHEAD + 2,))
         conn.commit()
-    except Exception as e:
-        conn.rollback()
-        print(f"Failed to store data: {e}")
-    finally:
         cursor.close()
+    finally:
+        conn.close()
+
+# Periodically make sure partitions exist before data for their day arrives
+async def maintain_partitions():
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, ensure_user_sensor_partitions)
+        except Exception as e:
+            print(f"Failed to create user_sensor partitions: {e}")
+        await asyncio.sleep(PARTITION_CHECK_INTERVAL)
+
+# Queue sensor data for the batched PostgreSQL writer. Samples dropped because the
+# queue is full are counted in the writer's periodic report, not logged one by one.
+def store_data(writer, userid, millis, sensor_values, ts):
+    # Ensure sensor_values list has 5 elements, filling missing values with 0
+    sensor_values += [0] * (5 - len(sensor_values))
+    writer.enqueue((userid, millis, *sensor_values[:5], ts))
+
+# Fans decoded samples out to the per-sample user_sensor writer and, when enabled,
+# the per-user chunk builder feeding user_sensor_chunks and the rollup builder
+# feeding user_sensor_rollups
+class SensorStore:
+    def __init__(self, writer, chunk_writer=None, rollup_writer=None):
+        self.writer = writer
+        self.chunk_writer = chunk_writer
+        self.chunks = SensorChunkBuilder(CHUNK_MILLIS, CHUNK_IDLE_SECONDS) if chunk_writer is not None else None
+        self.rollup_writer = rollup_writer
+        self.rollups = SensorRollupBuilder() if rollup_writer is not None else None
+
+    def add(self, userid, millis, samples, received):
+        # Samples in a multi-sample frame were taken before the packet arrived;
+        # back-date each one by its distance from the newest sample
+        last_millis = int(millis[-1])
+        for sample_millis, sensor_values in zip(millis.tolist(), samples.tolist()):
+            ts = (received - timedelta(milliseconds=last_millis - sample_millis)).isoformat()
+            store_data(self.writer, userid, sample_millis, sensor_values, ts)
+
+        if self.chunks is not None:
+            self._enqueue_chunks(self.chunks.add(userid, millis, samples, received))
+        if self.rollups is not None:
+            ts_ms = int(received.timestamp() * 1000) - (last_millis - millis)
+            self.rollups.add(userid, ts_ms, samples)
+
+    def _enqueue_chunks(self, rows):
+        for row in rows:
+            if not self.chunk_writer.enqueue(row):
+                print(f"Chunk writer queue full; dropped chunk for user {row[0]} at {row[1]}")
+
+    # Periodically close chunks of users that stopped sending
+    async def flush_idle_chunks(self):
+        while True:
+            await asyncio.sleep(CHUNK_IDLE_SECONDS / 2)
+            self._enqueue_chunks(self.chunks.flush_idle())
+
+    # Periodically merge the open rollup buckets into user_sensor_rollups
+    async def flush_rollups(self):
+        while True:
+            await asyncio.sleep(ROLLUP_FLUSH_INTERVAL)
+            for row in self.rollups.flush():
+                if not self.rollup_writer.enqueue(row):
+                    print(f"Rollup writer queue full; dropped {row[1]} ms bucket for user {row[0]} at {row[2]}")
+
+# Parse a legacy CSV datagram (userid,millis,sensor_A0,...,sensor_A4) into the frame layout
+def parse_csv_packet(data):
+    values = data.decode().strip().split(',')
+    userid = int(values[0])
+    millis = np.array([int(values[1])], dtype=np.int64)
+    samples = np.zeros((1, NUM_SENSORS), dtype=np.float32)
+    sensor_values = [float(value) for value in values[2:2 + NUM_SENSORS]]
+    samples[0, :len(sensor_values)] = sensor_values
+    return userid, millis, samples
 
 # Handle incoming UDP data
-async def handle_data(conn, data, addr, nc):
+async def handle_data(store, data, addr, nc):
     try:
-        # Assuming the data is sent as a comma-separated string: userid,millis,sensor_A0,sensor_A1,sensor_A2,sensor_A3,sensor_A4
-        data_str = data.decode().strip()
-        values = data_str.split(',')
-        
-        userid = int(values[0])
-        millis = int(values[1])
-        sensor_values = [float(value) for value in values[2:]]
-        ts = datetime.now().isoformat()  # Calculate timestamp when packet is received
+        received = datetime.now()  # Calculate timestamp when packet is received
+        if is_binary_frame(data):
+            userid, millis, samples = decode_frame(data)
+        else:
+            # Old firmware sends one comma-separated sample per datagram
+            userid, millis, samples = parse_csv_packet(data)
+        if len(millis) == 0:
+            return
 
         # Store data in PostgreSQL
-        store_data(conn, userid, millis, sensor_values, ts)
-        print(f"Stored data from {addr}: {data_str}")
-        
-        # Publish data to NATS
-        message = {
-            "userid": userid,
-            "millis": millis,
-            "sensor_values": sensor_values,
-            "timestamp": ts
-        }
-        await nc.publish(NATS_TOPIC, str(message).encode())
-        print(f"Published data to NATS: {message}")
+        store.add(userid, millis, samples, received)
+
+        # Publish the whole datagram to NATS as one binary message
+        await nc.publish(NATS_TOPIC, encode_samples(userid, millis, samples, received.timestamp()))
     except Exception as e:
         print(f"Failed to handle data from {addr}: {data}. Error: {e}")
 
@@ -87,29 +191,251 @@ def get_ip_address():
     except Exception as e:
         return f"Unable to get IP address: {e}"
 
-# Main UDP server function
-async def udp_server(host, port, conn, nc):
-    loop = asyncio.get_event_loop()
+# Route datagrams to the worker that owns their user so each user's samples are
+# always parsed, stored and published by one process, in arrival order
+class ShardRouter:
+    def __init__(self, worker_index, num_workers, handoff_sock):
+        self.worker_index = worker_index
+        self.num_workers = num_workers
+        self.handoff_sock = handoff_sock
+        self.forwarded = 0
+
+    # Forward the datagram to its owning worker; returns False if this worker owns it
+    def forward(self, data):
+        try:
+            owner = shard_for_user(peek_userid(data), self.num_workers)
+        except ValueError:
+            return False  # Malformed packets are handled (and logged) locally
+        if owner == self.worker_index:
+            return False
+        try:
+            self.handoff_sock.sendto(data, (UDP_HANDOFF_HOST, UDP_HANDOFF_BASE_PORT + owner))
+            self.forwarded += 1
+        except OSError as e:
+            print(f"Failed to forward datagram to worker {owner}: {e}")
+        return True
+
+def shard_for_user(userid, num_workers):
+    return userid % num_workers
+
+# asyncio datagram protocol that drains every pending datagram on each readiness event
+class UDPIngestProtocol(asyncio.DatagramProtocol):
+    def __init__(self, sock, store, nc, router=None):
+        self.sock = sock
+        self.store = store
+        self.nc = nc
+        self.router = router
+        self.transport = None
+        self.packets_received = 0
+        self.bytes_received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self._dispatch(data, addr)
+        # The transport only reads one datagram per readiness callback, so pull
+        # everything else the kernel has already queued before yielding to the loop
+        for _ in range(UDP_DRAIN_LIMIT):
+            try:
+                data, addr = self.sock.recvfrom(UDP_MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                print(f"Failed to drain UDP socket: {e}")
+                break
+            self._dispatch(data, addr)
+
+    def _dispatch(self, data, addr):
+        self.packets_received += 1
+        self.bytes_received += len(data)
+        if self.router is not None and self.router.forward(data):
+            return
+        asyncio.create_task(handle_data(self.store, data, addr, self.nc))
+
+    def error_received(self, exc):
+        print(f"UDP socket error: {exc}")
+
+# Read the kernel's drop counter for a bound UDP socket from /proc/net/udp (Linux only)
+def get_kernel_drops(sock):
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        for path in ('/proc/net/udp', '/proc/net/udp6'):
+            with open(path) as f:
+                next(f)  # Skip the header line
+                for line in f:
+                    fields = line.split()
+                    if fields[9] == inode:
+                        return int(fields[-1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+# Periodically report packets/sec and kernel drops for the UDP socket
+async def report_ingest_stats(protocol, sock, label, router=None, handoff=None):
+    last_packets = protocol.packets_received
+    last_bytes = protocol.bytes_received
+    last_time = time.monotonic()
+    while True:
+        await asyncio.sleep(UDP_STATS_INTERVAL)
+        now = time.monotonic()
+        elapsed = now - last_time
+        packets = protocol.packets_received - last_packets
+        nbytes = protocol.bytes_received - last_bytes
+        drops = get_kernel_drops(sock)
+        line = (f"{label}: {packets / elapsed:.1f} packets/s, {nbytes / elapsed / 1024:.1f} KiB/s, "
+                f"total packets {protocol.packets_received}, kernel drops {drops if drops is not None else 'n/a'}")
+        if router is not None:
+            line += f", forwarded to peers {router.forwarded}, received from peers {handoff.packets_received}"
+        print(line)
+        last_packets = protocol.packets_received
+        last_bytes = protocol.bytes_received
+        last_time = now
+
+# Create a non-blocking UDP socket, optionally sharing the port with sibling workers
+def create_udp_socket(host, port, reuse_port=False):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        # The kernel hashes each sender's address to one of the sockets bound to the port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # A larger receive buffer absorbs bursts from many armbands between drains
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF_BYTES)
     sock.bind((host, port))
     sock.setblocking(False)
+    return sock
+
+# Main UDP server function
+async def udp_server(host, port, store, nc, worker_index=0, num_workers=1):
+    loop = asyncio.get_running_loop()
+    sharded = num_workers > 1
+    sock = create_udp_socket(host, port, reuse_port=sharded)
+
+    router = None
+    handoff = None
+    if sharded:
+        # Private loopback socket on which sibling workers hand over this worker's users
+        handoff_sock = create_udp_socket(UDP_HANDOFF_HOST, UDP_HANDOFF_BASE_PORT + worker_index)
+        router = ShardRouter(worker_index, num_workers, handoff_sock)
+        _, handoff = await loop.create_datagram_endpoint(
+            lambda: UDPIngestProtocol(handoff_sock, store, nc),
+            sock=handoff_sock
+        )
+        label = f"UDP ingest worker {worker_index}"
+    else:
+        ip_address = get_ip_address()
+        print(f"Wi-Fi LAN IP Address: {ip_address}")
+        print(f"UDP Server started on {ip_address}:{port}")
+        label = "UDP ingest"
+
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: UDPIngestProtocol(sock, store, nc, router),
+        sock=sock
+    )
+    try:
+        await report_ingest_stats(protocol, sock, label, router, handoff)
+    finally:
+        transport.close()
+
+# Main entry point for one ingest process; each worker owns its DB writer and NATS connection
+async def main(worker_index=0, num_workers=1):
+    suffix = "" if num_workers == 1 else f"-{worker_index}"
+    writer = BatchWriter(
+        f"user_sensor{suffix}",
+        initialize_db,
+        "user_sensor",
+        ["userid", "millis", "sensor_a0", "sensor_a1", "sensor_a2", "sensor_a3", "sensor_a4", "ts"],
+        batch_size=WRITER_BATCH_SIZE,
+        flush_interval=WRITER_FLUSH_INTERVAL,
+        max_queue=WRITER_MAX_QUEUE,
+        report_interval=UDP_STATS_INTERVAL
+    )
+    tasks = writer.start()  # Background COPY writer for user_sensor
 
+    chunk_writer = None
+    if WRITE_SENSOR_CHUNKS:
+        # Chunks are ~1 row per user per second, so small batches are plenty
+        chunk_writer = BatchWriter(
+            f"user_sensor_chunks{suffix}",
+            initialize_db,
+            "user_sensor_chunks",
+            CHUNK_COLUMNS,
+            batch_size=50,
+            flush_interval=1.0,
+            max_queue=WRITER_MAX_QUEUE,
+            report_interval=UDP_STATS_INTERVAL
+        )
+        tasks.extend(chunk_writer.start())
+
+    rollup_writer = None
+    if WRITE_SENSOR_ROLLUPS:
+        rollup_writer = BatchWriter(
+            f"user_sensor_rollups{suffix}",
+            initialize_db,
+            "user_sensor_rollups",
+            ROLLUP_COLUMNS,
+            batch_size=WRITER_BATCH_SIZE,
+            flush_interval=ROLLUP_FLUSH_INTERVAL,
+            max_queue=WRITER_MAX_QUEUE,
+            report_interval=UDP_STATS_INTERVAL,
+            merge_sql=ROLLUP_MERGE_SQL
+        )
+        tasks.extend(rollup_writer.start())
+
+    store = SensorStore(writer, chunk_writer, rollup_writer)
+    if store.chunks is not None:
+        tasks.append(asyncio.create_task(store.flush_idle_chunks()))
+    if store.rollups is not None:
+        tasks.append(asyncio.create_task(store.flush_rollups()))
+
+    if worker_index == 0:
+        tasks.append(asyncio.create_task(maintain_partitions()))
+    nc = await initialize_nats()  # Initialize the NATS client
+    await udp_server('0.0.0.0', UDP_PORT, store, nc, worker_index, num_workers)
+
+def run_worker(worker_index, num_workers):
+    # Workers restarted by the supervisor would otherwise inherit its signal handlers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        asyncio.run(main(worker_index, num_workers))
+    except KeyboardInterrupt:
+        pass
+
+# Supervisor: fork UDP_WORKERS ingest processes sharing the port and restart any that die
+def supervise(num_workers):
     ip_address = get_ip_address()
     print(f"Wi-Fi LAN IP Address: {ip_address}")
-    print(f"UDP Server started on {ip_address}:{port}")
+    print(f"UDP Server starting {num_workers} workers on {ip_address}:{UDP_PORT}")
 
-    while True:
-        try:
-            data, addr = await loop.run_in_executor(None, sock.recvfrom, 1024)
-            asyncio.create_task(handle_data(conn, data, addr, nc))
-        except BlockingIOError:
-            await asyncio.sleep(0.1)  # Adjust the sleep time as needed
-
-# Main entry point
-async def main():
-    conn = initialize_db()  # Initialize the PostgreSQL connection
-    nc = await initialize_nats()  # Initialize the NATS client
-    await udp_server('0.0.0.0', 8081, conn, nc)
+    def start_worker(index):
+        process = multiprocessing.Process(target=run_worker, args=(index, num_workers), name=f"udp-worker-{index}")
+        process.start()
+        return process
+
+    workers = [start_worker(index) for index in range(num_workers)]
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while not stopping:
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    print(f"UDP worker {index} exited with code {process.exitcode}; restarting")
+                    workers[index] = start_worker(index)
+            time.sleep(1)
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join(timeout=5)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if UDP_WORKERS > 1:
+        supervise(UDP_WORKERS)
+    else:
+        asyncio.run(main())